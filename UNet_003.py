@@ -16,6 +16,7 @@ from PIL import Image
 import torchvision.transforms as transforms
  
 import matplotlib.pyplot as plt
+from dataset import resize_data, smart_resize
  
 def display_image(img):
     img = img.permute(1,2,0)
@@ -36,53 +37,6 @@ def extract_frames(video_path, nb_frames=10, delta=1, timeit=False):
         print(f"read: {t2-t1}")
     return video
  
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
- 
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
- 
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
- 
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...,C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
- 
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
- 
 dataset_dir = "/raid/datasets/hackathon2024"
 root_dir = os.path.expanduser("~/automathon-2024")
  
@@ -14,9 +14,12 @@ from tqdm import tqdm
 import csv
 import timm
 import wandb
+from checkpoint import save_checkpoint
 
 from PIL import Image
 import torchvision.transforms.v2 as transforms
+from dataset import resize_data, smart_resize
+from models import UNetDenseNet201
 
 # UTILITIES
 
@@ -36,55 +39,6 @@ def extract_frames(video_path, nb_frames=10, delta=1, timeit=False):
         print(f"read: {t2-t1}")
     return video
 
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
-
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
-
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
-
-
 # SETUP DATASET
 
 dataset_dir = "/raid/datasets/hackathon2024"
@@ -221,61 +175,8 @@ experimental_dataset = VideoDataset(dataset_dir, dataset_choice="experimental",
 
 # MODELE
 
-class DoubleConv(nn.Module):
-    def __init__(self, in_channels, out_channels):
-        super(DoubleConv, self).__init__()
-        self.double_conv = nn.Sequential(
-            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True),
-            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True)
-        )
-
-    def forward(self, x):
-        return self.double_conv(x)
-
-class UNet(nn.Module):
-    def __init__(self, num_classes):
-        super(UNet, self).__init__()
-        # Encoder (utilise DenseNet201 pré-entraîné de TIMM)
-        densenet = timm.create_model('densenet201', pretrained=True)
-        self.encoder = densenet.features
-        
-        # Decoder
-        self.decoder = nn.ModuleList([
-            DoubleConv(1920, 1024),
-            nn.ConvTranspose2d(1024, 512, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(512, 512),
-            nn.ConvTranspose2d(512, 256, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(256, 256),
-            nn.ConvTranspose2d(256, 128, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(128, 128),
-            nn.ConvTranspose2d(128, 64, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(64, 64),
-            nn.ConvTranspose2d(64, 32, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(32, 32)
-        ])
-        
-        # Classification binaire
-        self.global_pool = nn.AdaptiveAvgPool2d(1)
-        self.fc = nn.Linear(32, num_classes)
-
-    def forward(self, x):
-        # Encoder
-        x = self.encoder(x[:, :, 0])
-        # Decoder
-        for idx, layer in enumerate(self.decoder):
-            x = layer(x)
-        # Classification binaire
-        x = self.global_pool(x)
-        x = torch.flatten(x, 1)
-        x = self.fc(x)
-        return torch.sigmoid(x)
-
 # Créer une instance du modèle
-model = UNet(1)
+model = UNetDenseNet201(1)
 summary(model)
 
 
@@ -292,7 +193,7 @@ run = wandb.init(
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 batch_size = 32
 loss_fn = nn.MSELoss()
-model = UNet(1).to(device)
+model = UNetDenseNet201(1).to(device)
 print("Training model:")
 summary(model, input_size=(batch_size, 3, 10, 256, 256))
 optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
@@ -316,6 +217,10 @@ for epoch in range(epochs):
         optimizer.step()
         run.log({"loss": loss.item(), "epoch": epoch})
 
+# rechargement : load_model(lambda: UNetDenseNet201(1, pretrained=False), "model_004.safetensors", device)
+save_checkpoint(model.state_dict(), "model_004.safetensors", metadata={"model": "UNet_004", "epochs": epochs})
+model.eval()
+
 ## TEST
 
 loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
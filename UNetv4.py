@@ -8,15 +8,22 @@ from torch.utils.data import Dataset, DataLoader
 from torchinfo import summary
 import torchvision.io as io
 import os
+import sys
 import json
 from torchvision.io.video import re
 from tqdm import tqdm
 import csv
 import timm
 import wandb
+from checkpoint import save_checkpoint, load_checkpoint
+from training import train
+from validation import holdout_split
+from distributed import setup_distributed, cleanup_distributed, is_main
 
 from PIL import Image
 import torchvision.transforms.v2 as transforms
+from dataset import resize_data, smart_resize
+from models import UNetInceptionV4
 
 # UTILITIES
 
@@ -36,55 +43,6 @@ def extract_frames(video_path, nb_frames=10, delta=1, timeit=False):
         print(f"read: {t2-t1}")
     return video
 
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
-
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
-
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
-
-
 # SETUP DATASET
 
 dataset_dir = "/raid/datasets/hackathon2024"
@@ -223,102 +181,53 @@ experimental_dataset = VideoDataset(dataset_dir, dataset_choice="experimental",
 # MODELE
 
 # Définition du modèle UNet avec InceptionV4
-class DoubleConv(nn.Module):
-    def __init__(self, in_channels, out_channels):
-        super(DoubleConv, self).__init__()
-        self.double_conv = nn.Sequential(
-            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True),
-            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
-            nn.BatchNorm2d(out_channels),
-            nn.ReLU(inplace=True)
-        )
-
-    def forward(self, x):
-        return self.double_conv(x)
-
-class UNet(nn.Module):
-    def __init__(self, num_classes):
-        super(UNet, self).__init__()
-        # Encoder (utilise InceptionV4 pré-entraîné de TIMM)
-        inception = timm.create_model('inception_v4', pretrained=True)
-        for p in inception.features.parameters():
-            p.requires_grad = False
-        self.encoder = inception.features
-        
-        # Decoder
-        self.decoder = nn.ModuleList([
-            DoubleConv(1536, 512),
-            nn.ConvTranspose2d(512, 256, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(256, 256),
-            nn.ConvTranspose2d(256, 128, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(128, 128),
-            nn.ConvTranspose2d(128, 64, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(64, 64),
-            nn.ConvTranspose2d(64, 32, kernel_size=3, stride=2, padding=1, output_padding=1),
-            DoubleConv(32, 32),
-        ])
-        
-        # Classification binaire
-        self.global_pool = nn.AdaptiveAvgPool2d(1)
-        self.fc = nn.Linear(32, num_classes)
-
-    def forward(self, x):
-        # Encoder
-        x = self.encoder(x[:, :, 0])
-        # Decoder
-        for idx, layer in enumerate(self.decoder):
-            x = layer(x)
-        # Classification binaire
-        x = self.global_pool(x)
-        x = torch.flatten(x, 1)
-        x = self.fc(x)
-        return torch.sigmoid(x)
-
-
 # LOGGING
 
 
-wandb.login(key="b15da3ba051c5858226f1d6b28aee6534682d044")
-run = wandb.init(
-    project="UNETv4",
-)
+# en DDP (torchrun / srun --ntasks>1) seul le rank 0 log dans wandb
+rank, world_size, device = setup_distributed()
+log = None
+if is_main():
+    wandb.login(key="b15da3ba051c5858226f1d6b28aee6534682d044")
+    run = wandb.init(
+        project="UNETv4",
+    )
+    log = run.log
 
 
 # ENTRAINEMENT
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 batch_size = 32
 loss_fn = nn.MSELoss()
-model = UNet(1).to(device)
-print("Training model:")
-summary(model, input_size=(batch_size, 3, 10, 256, 256))
+model = UNetInceptionV4(1).to(device)
+if is_main():
+    print("Training model:")
+    summary(model, input_size=(batch_size, 3, 10, 256, 256))
 optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
 epochs = 1
-loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True)
-#loader = DataLoader(experimental_dataset, batch_size=2, shuffle=True)
 
 print("Training...")
-for epoch in range(epochs):
-    for sample in tqdm(loader):
-        optimizer.zero_grad()
-        X, label, ID = sample
-        X = X.to(device)
-        X = X.permute(0, 2, 1, 3, 4)
-        label = label.to(device)
-        label = torch.unsqueeze(label, dim=1)
-        label_pred = model(X)
-        label = torch.unsqueeze(label,dim=1)
-        loss = loss_fn(label, label_pred)
-        loss.backward()
-        optimizer.step()
-        run.log({"loss": loss.item(), "epoch": epoch})
-
-torch.save(model.state_dict(), "model.pt")
-del model
-model = UNet(1).to(device)
-model.load_state_dict(torch.load("model.pt"))
+# 10% de train_dataset en holdout stratifie, 512 videos evaluees tous les 200 pas ;
+# arret apres 5 validations sans progres
+train_part, holdout = holdout_split(train_dataset, fraction=0.1, subsample=512)
+# reprend tout seul depuis checkpoints_unetv4/ si un creneau precedent a ete coupe
+finished = train(model, train_part, loss_fn, optimizer, device, epochs, batch_size=batch_size,
+                 ckpt_dir="checkpoints_unetv4", walltime=3600, permute=True, log=log,
+                 val_dataset=holdout, val_every=200, patience=5)
+cleanup_distributed()
+if not finished or rank != 0:
+    # walltime atteinte : le checkpoint est ecrit, on relance le job pour continuer
+    # (et le test/la submission ne tournent que sur le rank 0)
+    sys.exit(0)
+
+# on garde le modele en memoire pour le test, le checkpoint sert a le recharger
+# plus tard : load_model(lambda: UNetInceptionV4(1, pretrained=False), "model.safetensors", device)
+save_checkpoint(model.state_dict(), "model.safetensors", metadata={"model": "UNetv4", "epochs": epochs})
+# la submission utilise le meilleur modele sur le holdout, pas le dernier
+best_path = os.path.join("checkpoints_unetv4", "best.safetensors")
+if os.path.exists(best_path):
+    model.load_state_dict(load_checkpoint(best_path, device))
+model.eval()
 ## TEST
 
 loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False)
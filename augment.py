@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# AUGMENTATION PAR BATCH
+# Des transforms.v2 par sample dans VideoDataset.__getitem__ chargeraient encore
+# plus les workers. BatchAugment travaille sur le batch entier [B, T, 3, H, W]
+# dans [0, 1], deja sur le device (training.prepare_batch, donc sur le stream de
+# prefetch) : un tirage de parametres par clip, applique a toutes ses frames.
+# Marche aussi sur CPU. Le main mesure le cout par rapport a un pas d'entrainement.
+#
+#   python augment.py --model cnn3d --batch-size 8
+
+import argparse
+import math
+import time
+
+import torch
+import torch.nn.functional as F
+
+
+def _per_clip(X):
+    # forme pour diffuser un parametre [B] sur [B, T, C, H, W]
+    return (X.shape[0],) + (1,) * (X.dim() - 1)
+
+
+def _gaussian_kernels(sigma, radius):
+    # sigma [B] -> noyaux [B, 2 radius + 1], tous de la meme taille
+    x = torch.arange(-radius, radius + 1, device=sigma.device, dtype=torch.float32)
+    k = torch.exp(-x ** 2 / (2 * sigma.float()[:, None] ** 2))
+    return k / k.sum(dim=1, keepdim=True)
+
+
+def gaussian_blur(X, sigma, max_sigma=None):
+    # flou gaussien separable, X [B, ..., H, W], sigma [B] (un par clip) ;
+    # une convolution groupee pour tout le batch
+    shape = X.shape
+    max_sigma = float(sigma.max()) if max_sigma is None else max_sigma
+    radius = max(1, int(math.ceil(2 * max_sigma)))
+    k = _gaussian_kernels(sigma, radius).to(X.dtype)
+    # un groupe par plan [H, W], chacun avec le noyau de son clip
+    planes = X[0].numel() // (shape[-2] * shape[-1])
+    k = k.repeat_interleave(planes, dim=0)
+    x = X.reshape(1, -1, shape[-2], shape[-1])
+    x = F.conv2d(F.pad(x, (radius, radius, 0, 0), mode="reflect"), k.view(-1, 1, 1, 2 * radius + 1), groups=len(k))
+    x = F.conv2d(F.pad(x, (0, 0, radius, radius), mode="reflect"), k.view(-1, 1, 2 * radius + 1, 1), groups=len(k))
+    return x.view(shape)
+
+
+class BatchAugment:
+    """
+    p_* : probabilite d'appliquer chaque transformation a un clip.
+    crop_scale : part de l'aire gardee par le random resized crop.
+    jitter : amplitude max de luminosite / contraste / saturation.
+    blur_sigma : intervalle du sigma du flou, tire par clip.
+    compress_scales : facteurs de sous-echantillonnage possibles, un par clip ;
+    compress_levels : intervalle du nombre de niveaux de quantification.
+    frame_drop : probabilite qu'une frame soit remplacee par la precedente.
+    """
+    def __init__(self, p_flip=0.5, p_crop=0.5, crop_scale=(0.6, 1.0), p_jitter=0.8, jitter=0.2,
+                 p_blur=0.2, blur_sigma=(0.5, 2.0), p_compress=0.3, compress_scales=(0.4, 0.5, 0.6, 0.7, 0.8),
+                 compress_levels=(32, 128), noise=0.03, frame_drop=0.1):
+        self.p_flip = p_flip
+        self.p_crop = p_crop
+        self.crop_scale = crop_scale
+        self.p_jitter = p_jitter
+        self.jitter = jitter
+        self.p_blur = p_blur
+        self.blur_sigma = blur_sigma
+        self.p_compress = p_compress
+        self.compress_scales = compress_scales
+        self.compress_levels = compress_levels
+        self.noise = noise
+        self.frame_drop = frame_drop
+
+    def _mask(self, p, B, device):
+        return torch.rand(B, device=device) < p
+
+    def flip(self, X):
+        mask = self._mask(self.p_flip, X.shape[0], X.device).view(_per_clip(X))
+        return torch.where(mask, X.flip(-1), X)
+
+    def crop(self, X):
+        # random resized crop via grid_sample : une boite par clip, meme taille de sortie
+        B, T, C, H, W = X.shape
+        apply = self._mask(self.p_crop, B, X.device)
+        lo, hi = self.crop_scale
+        scale = torch.empty(B, device=X.device).uniform_(lo, hi).sqrt()
+        scale = torch.where(apply, scale, torch.ones_like(scale))
+        tx = (torch.rand(B, device=X.device) * 2 - 1) * (1 - scale)
+        ty = (torch.rand(B, device=X.device) * 2 - 1) * (1 - scale)
+        theta = torch.zeros(B, 2, 3, device=X.device, dtype=X.dtype)
+        theta[:, 0, 0] = scale
+        theta[:, 1, 1] = scale
+        theta[:, 0, 2] = tx
+        theta[:, 1, 2] = ty
+        theta = theta.repeat_interleave(T, dim=0)
+        grid = F.affine_grid(theta, (B * T, C, H, W), align_corners=False)
+        return F.grid_sample(X.flatten(0, 1), grid, mode="bilinear", padding_mode="reflection",
+                             align_corners=False).view(B, T, C, H, W)
+
+    def color(self, X):
+        B = X.shape[0]
+        shape = _per_clip(X)
+        apply = self._mask(self.p_jitter, B, X.device).view(shape)
+
+        def factor():
+            f = 1 + (torch.rand(B, device=X.device) * 2 - 1) * self.jitter
+            return torch.where(apply, f.view(shape), torch.ones_like(f).view(shape)).to(X.dtype)
+
+        X = X * factor()
+        mean = X.mean(dim=(1, 2, 3, 4), keepdim=True)
+        X = (X - mean) * factor() + mean
+        gray = (0.299 * X[:, :, 0:1] + 0.587 * X[:, :, 1:2] + 0.114 * X[:, :, 2:3])
+        X = (X - gray) * factor() + gray
+        return X.clamp(0, 1)
+
+    # blur et compress transforment tout le batch puis choisissent par clip avec
+    # torch.where : ni apply.any() ni X[apply], qui forceraient une synchro
+    # device -> host a chaque batch (sur le stream de prefetch)
+    def blur(self, X):
+        apply = self._mask(self.p_blur, X.shape[0], X.device).view(_per_clip(X))
+        lo, hi = self.blur_sigma
+        # sigma par clip sur le device ; le rayon du noyau vient de la borne, sans synchro
+        sigma = torch.empty(X.shape[0], device=X.device).uniform_(lo, hi)
+        return torch.where(apply, gaussian_blur(X, sigma, max_sigma=hi), X)
+
+    def compress(self, X):
+        # imite une re-compression : sous-echantillonnage, quantification et bruit,
+        # avec un facteur et un nombre de niveaux par clip
+        apply = self._mask(self.p_compress, X.shape[0], X.device).view(_per_clip(X))
+        B, T, C, H, W = X.shape
+        # interpolate ne prend qu'une taille par appel : chaque facteur est
+        # calcule sur le batch et chaque clip garde le sien
+        choice = torch.randint(len(self.compress_scales), (B,), device=X.device).view(_per_clip(X))
+        x = X
+        for i, factor in enumerate(self.compress_scales):
+            small = F.interpolate(X.flatten(0, 1), scale_factor=factor, mode="bilinear", align_corners=False)
+            scaled = F.interpolate(small, size=(H, W), mode="bilinear", align_corners=False).view(B, T, C, H, W)
+            x = torch.where(choice == i, scaled, x)
+        lo, hi = self.compress_levels
+        levels = torch.randint(lo, hi, (B,), device=X.device).to(X.dtype).view(_per_clip(X))
+        x = torch.round(x * levels) / levels
+        x = x + torch.randn_like(x) * self.noise
+        return torch.where(apply, x.clamp(0, 1), X)
+
+    def drop_frames(self, X):
+        # une frame retiree est remplacee par la derniere gardee : T ne change pas
+        B, T = X.shape[:2]
+        keep = torch.rand(B, T, device=X.device) >= self.frame_drop
+        keep[:, 0] = True
+        source = torch.arange(T, device=X.device).expand(B, T) * keep
+        source = source.cummax(dim=1).values
+        return X[torch.arange(B, device=X.device)[:, None], source]
+
+    def __call__(self, X):
+        X = self.flip(X)
+        X = self.crop(X)
+        X = self.color(X)
+        X = self.blur(X)
+        X = self.compress(X)
+        if self.frame_drop > 0:
+            X = self.drop_frames(X)
+        return X
+
+
+if __name__ == "__main__":
+    from models import MODELS, build_model
+    from training import prepare_batch
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="cnn3d", choices=sorted(MODELS))
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    spec = MODELS[args.model]
+    model = build_model(args.model, pretrained=False).to(device)
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad])
+    augment = BatchAugment()
+    sample = (torch.randint(0, 256, (args.batch_size, 10, 3, spec["size"], spec["size"]), dtype=torch.uint8),
+              torch.rand(args.batch_size).round(), list(range(args.batch_size)))
+
+    def timed(fn):
+        # moyenne sur args.steps apres un pas de chauffe
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        t1 = time.time()
+        for _ in range(args.steps):
+            fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        return (time.time() - t1) / args.steps
+
+    X, label, ID = prepare_batch(sample, device)
+
+    def step():
+        optimizer.zero_grad()
+        x = X.permute(0, 2, 1, 3, 4) if spec["permute"] else X
+        out = model(x[:, 0] if spec["first_frame"] else x)
+        out.float().mean().backward()
+        optimizer.step()
+
+    t_aug = timed(lambda: augment(X))
+    t_step = timed(step)
+    print(f"augmentation {t_aug * 1000:.1f} ms, step {t_step * 1000:.1f} ms ({100 * t_aug / t_step:.1f}% of step time)")
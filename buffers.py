@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# BUFFERS PREALLOUES
+# Au lieu de decoder frame par frame dans une liste, torch.stack, puis laisser
+# le collate du DataLoader re-empiler le batch, chaque worker decode directement
+# dans un batch uint8 [B, T, 3, H, W] tire d'un anneau de buffers reutilises.
+# Quand le batch traverse la queue du DataLoader, torch deplace son stockage en
+# memoire partagee une seule fois : les batchs suivants passent sans copie.
+# La normalisation /255 est faite plus tard, sur le device (voir training.prepare_batch).
+#
+#   python buffers.py --data-dir /raid/datasets/hackathon2024/resized_dataset --epochs 3
+
+import argparse
+import os
+
+import psutil
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from decode import loader_kwargs
+from prefetch import track, wait_copy
+from quarantine import DecodeError
+
+
+class FramePool:
+    """
+    Anneau de `depth` buffers par forme. Un buffer est reutilise `depth` batchs
+    plus tard : depth doit couvrir les batchs en vol (prefetch_factor par worker,
+    ou les batchs copies d'avance par prefetch.DevicePrefetcher, + celui en
+    cours d'utilisation). Un buffer epingle attend en plus la fin de sa copie
+    asynchrone vers le device avant d'etre reecrit.
+    """
+    def __init__(self, depth=4, pin=False):
+        self.depth = depth
+        self.pin = pin
+        self.rings = {}
+        self.allocations = 0
+        self.reuses = 0
+
+    def acquire(self, shape):
+        shape = tuple(shape)
+        buffers, i = self.rings.setdefault(shape, ([], 0))
+        if len(buffers) < self.depth:
+            buf = torch.empty(shape, dtype=torch.uint8, pin_memory=self.pin)
+            if self.pin:
+                track(buf)
+            buffers.append(buf)
+            self.allocations += 1
+        else:
+            buf = buffers[i % self.depth]
+            if self.pin:
+                wait_copy(buf)
+            self.reuses += 1
+        self.rings[shape] = (buffers, i + 1)
+        return buf
+
+    def stats(self):
+        return {"allocations": self.allocations, "reuses": self.reuses,
+                "bytes": sum(b.nbytes for buffers, _ in self.rings.values() for b in buffers)}
+
+
+# un pool par process : chaque worker du DataLoader a le sien
+_pools = {}
+
+
+def get_pool(depth=4, pin=False):
+    pid = os.getpid()
+    if pid not in _pools:
+        _pools[pid] = FramePool(depth, pin)
+    return _pools[pid]
+
+
+class PooledVideoDataset(Dataset):
+    """
+    Enveloppe un VideoDataset : __getitems__ decode tout le batch dans un buffer
+    du pool et renvoie (X uint8, label, ID) deja assemble.
+    """
+    def __init__(self, dataset, depth=4, pin=False):
+        self.dataset = dataset
+        self.depth = depth
+        self.pin = pin
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return self.dataset[idx]
+
+    def __getitems__(self, indices):
+        ds = self.dataset
+        pool = get_pool(self.depth, self.pin)
+        X = pool.acquire((len(indices), ds.nb_frames, 3, ds.size, ds.size))
+        indices = list(indices)
+        if hasattr(ds, "read_batch"):
+            # shards.ShardDataset : tout le batch en un seul decode
+            X = ds.read_batch(indices, out=X)
+            return self._assemble(ds, X, indices)
+        for i in range(len(indices)):
+            while True:
+                try:
+                    n = len(ds.read(indices[i], out=X[i]))
+                    break
+                except DecodeError:
+                    if ds.dataset_choice == "test":
+                        # en test la video garde son ID (voir VideoDataset.quarantined_ids)
+                        n = len(X[i].copy_(ds.blank()))
+                        break
+                    # video mise en quarantaine : on prend la suivante
+                    indices[i] = (indices[i] + 1) % len(ds)
+            if n < ds.nb_frames:
+                # video trop courte : on repete la derniere frame
+                X[i, n:] = X[i, n - 1]
+        return self._assemble(ds, X, indices)
+
+    def _assemble(self, ds, X, indices):
+        IDs = [ds.ids[ds.key(idx)] for idx in indices]
+        if ds.dataset_choice == "test":
+            return X, IDs
+        label = torch.stack([ds.data[ds.key(idx)] for idx in indices])
+        return X, label, IDs
+
+
+def pooled_collate(batch):
+    # le batch est deja assemble par __getitems__
+    return batch
+
+
+def pooled_loader(dataset, batch_size, sampler=None, shuffle=False, num_workers=0, pin=False, prefetch_factor=2,
+                  lookahead=2):
+    # pin seulement sans worker : un buffer epingle ne passe pas en memoire partagee.
+    # lookahead : batchs copies d'avance par DevicePrefetcher, lus directement
+    # dans l'anneau sans worker (avec workers ils sont d'abord copies en memoire epinglee)
+    pin = pin and num_workers == 0 and torch.cuda.is_available()
+    depth = (prefetch_factor + 2) if num_workers else (lookahead + 2)
+    kwargs = loader_kwargs(num_workers)
+    if num_workers:
+        kwargs["prefetch_factor"] = prefetch_factor
+    return DataLoader(PooledVideoDataset(dataset, depth, pin), batch_size=batch_size, sampler=sampler,
+                      shuffle=shuffle if sampler is None else False, collate_fn=pooled_collate, **kwargs)
+
+
+if __name__ == "__main__":
+    from dataset import VideoDataset, resized_dir
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default=resized_dir)
+    parser.add_argument("--split", default="experimental")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--pin", action="store_true")
+    args = parser.parse_args()
+
+    # allocations et RSS par epoch, sans worker pour que le pool soit celui du process
+    ds = VideoDataset(args.data_dir, dataset_choice=args.split)
+    loader = pooled_loader(ds, args.batch_size, shuffle=True, pin=args.pin)
+    proc = psutil.Process()
+    for epoch in range(args.epochs):
+        for sample in loader:
+            pass
+        stats = get_pool().stats()
+        print(f"epoch {epoch}: rss {proc.memory_info().rss / 2**20:.0f} MiB  "
+              f"allocations {stats['allocations']}  reuses {stats['reuses']}  pool {stats['bytes'] / 2**20:.0f} MiB")
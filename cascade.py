@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# CASCADE
+# Un modele pas cher (linear, cnn2d sur la premiere frame...) score toutes les
+# videos ; seules celles dont le score tombe dans une bande d'incertitude
+# [low, high] passent dans le modele cher (UNet DenseNet201, Inception...).
+# La bande est choisie sur un jeu annote (experimental_dataset par defaut) :
+# la moins chere qui reste a `tolerance` pres de la precision du modele cher seul.
+#
+#   python cascade.py --cheap cnn2d --cheap-checkpoint cnn2d.safetensors \
+#       --expensive unet_densenet201 --expensive-checkpoint model_004.safetensors
+
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+from tqdm import tqdm
+
+import quarantine
+from dataset import VideoDataset, resized_dir
+from models import MODELS, load_registered, predict_proba
+
+
+def score_dataset(name, model, dataset, device, batch_size=32):
+    # renvoie (probas, labels ou None, ids, cout moyen en secondes par video)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    probs, labels, ids = [], [], []
+    elapsed = 0.0
+    with torch.inference_mode():
+        for sample in tqdm(loader, desc=name):
+            X, ID = sample[0], sample[-1]
+            X = X.to(device)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            t1 = time.time()
+            p = predict_proba(name, model, X)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            elapsed += time.time() - t1
+            probs.append(p.float().cpu())
+            if len(sample) == 3:
+                labels.append(sample[1])
+            ids.extend(list(ID))
+    probs = torch.cat(probs).numpy()
+    labels = torch.cat(labels).numpy() if labels else None
+    return probs, labels, ids, elapsed / max(len(probs), 1)
+
+
+def cascade_predict(cheap, expensive, low, high):
+    escalate = (cheap > low) & (cheap < high)
+    return np.where(escalate, expensive, cheap), escalate
+
+
+def tune_band(cheap, expensive, labels, cheap_cost, expensive_cost, threshold=0.5, tolerance=0.005, steps=21):
+    """
+    Parcourt les bandes [low, high] autour du seuil et renvoie
+    (meilleure bande, liste (low, high, accuracy, cout moyen)).
+    """
+    target = ((expensive > threshold) == labels).mean()
+    results = []
+    for low in np.linspace(0, threshold, steps):
+        for high in np.linspace(threshold, 1, steps):
+            pred, escalate = cascade_predict(cheap, expensive, low, high)
+            acc = ((pred > threshold) == labels).mean()
+            cost = cheap_cost + escalate.mean() * expensive_cost
+            results.append((float(low), float(high), float(acc), float(cost)))
+    ok = [r for r in results if r[2] >= target - tolerance]
+    best = min(ok, key=lambda r: (r[3], -r[2])) if ok else max(results, key=lambda r: r[2])
+    return best, results
+
+
+def pareto(results):
+    # bandes non dominees (aucune autre n'est a la fois moins chere et plus precise)
+    front = []
+    for r in sorted(results, key=lambda r: (r[3], -r[2])):
+        if not front or r[2] > front[-1][2]:
+            front.append(r)
+    return front
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cheap", choices=sorted(MODELS), required=True)
+    parser.add_argument("--cheap-checkpoint", required=True)
+    parser.add_argument("--expensive", choices=sorted(MODELS), required=True)
+    parser.add_argument("--expensive-checkpoint", required=True)
+    parser.add_argument("--data-dir", default=resized_dir)
+    parser.add_argument("--holdout", default="experimental", choices=["train", "experimental"])
+    parser.add_argument("--holdout-size", type=int, help="sous-echantillon du holdout")
+    parser.add_argument("--tolerance", type=float, default=0.005)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", default="submission_cascade.csv")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    cheap_model = load_registered(args.cheap, args.cheap_checkpoint, device)
+    expensive_model = load_registered(args.expensive, args.expensive_checkpoint, device)
+
+    # reglage de la bande sur le holdout annote
+    holdout = VideoDataset(args.data_dir, dataset_choice=args.holdout)
+    if args.holdout_size:
+        g = torch.Generator().manual_seed(0)
+        holdout = Subset(holdout, torch.randperm(len(holdout), generator=g)[:args.holdout_size].tolist())
+    cheap_p, labels, _, cheap_cost = score_dataset(args.cheap, cheap_model, holdout, device, args.batch_size)
+    exp_p, _, _, exp_cost = score_dataset(args.expensive, expensive_model, holdout, device, args.batch_size)
+    (low, high, acc, cost), results = tune_band(cheap_p, exp_p, labels, cheap_cost, exp_cost, tolerance=args.tolerance)
+    print(f"cheap only:     acc {((cheap_p > 0.5) == labels).mean():.4f}  cost {cheap_cost * 1000:.2f} ms/video")
+    print(f"expensive only: acc {((exp_p > 0.5) == labels).mean():.4f}  cost {exp_cost * 1000:.2f} ms/video")
+    print(f"cascade [{low:.3f}, {high:.3f}]: acc {acc:.4f}  cost {cost * 1000:.2f} ms/video"
+          f"  ({exp_cost / cost:.1f}x cheaper than expensive only)")
+    print("accuracy / cost frontier:")
+    for r in pareto(results):
+        print(f"  [{r[0]:.3f}, {r[1]:.3f}]  acc {r[2]:.4f}  cost {r[3] * 1000:.2f} ms/video")
+
+    # test : le modele cher ne voit que les videos escaladees
+    test = VideoDataset(args.data_dir, dataset_choice="test")
+    cheap_p, _, ids, _ = score_dataset(args.cheap, cheap_model, test, device, args.batch_size)
+    escalate = np.where((cheap_p > low) & (cheap_p < high))[0]
+    final = cheap_p.copy()
+    if len(escalate):
+        exp_p, _, _, _ = score_dataset(args.expensive, expensive_model, Subset(test, escalate.tolist()), device, args.batch_size)
+        final[escalate] = exp_p
+    print(f"escalated {len(escalate)}/{len(final)} test videos")
+    # videos illisibles : prediction par defaut plutot que celle d'une video noire
+    broken = test.quarantined_ids()
+    for i, ID in enumerate(ids):
+        if ID in broken:
+            final[i] = quarantine.default_proba
+    if broken:
+        print(f"{len(broken)} unreadable test videos get the default prediction {quarantine.default_proba}")
+    lines = ["id,label\n"] + [f"{ID},{int(p > 0.5)}\n" for ID, p in zip(ids, final)]
+    with open(args.output, "w") as file:
+        file.writelines(lines)
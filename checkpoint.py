@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# CHECKPOINTS
+# Sauvegarde en safetensors (ecriture atomique) et rechargement zero-copy via mmap.
+# Le modele est reconstruit sur le device "meta" : aucun poids pretrained n'est
+# telecharge ni initialise, load_state_dict(assign=True) branche directement les
+# tensors du checkpoint.
+
+import os
+import tempfile
+import time
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file, load_file
+
+
+def _unshare(state_dict):
+    # safetensors refuse les tensors qui partagent leur memoire (poids lies,
+    # vues...), on ne clone que ceux-la pour ne pas doubler la RAM
+    seen = set()
+    tensors = {}
+    for k, v in state_dict.items():
+        v = v.detach()
+        key = (v.device, v.untyped_storage().data_ptr())
+        if key in seen or not v.is_contiguous():
+            v = v.clone(memory_format=torch.contiguous_format)
+        seen.add(key)
+        tensors[k] = v
+    return tensors
+
+
+def save_checkpoint(state_dict, path, metadata=None):
+    # ecrit dans un fichier temporaire du meme dossier puis os.replace :
+    # un job tue en plein milieu ne laisse jamais un checkpoint a moitie ecrit
+    tensors = _unshare(state_dict)
+    metadata = {k: str(v) for k, v in (metadata or {}).items()}
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=".safetensors")
+    os.close(fd)
+    try:
+        save_file(tensors, tmp_path, metadata=metadata)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_checkpoint(path, device="cpu"):
+    # safetensors mmap le fichier : sur cpu les tensors pointent dans le mmap,
+    # sur cuda ils sont copies directement sans passer par un pickle
+    return load_file(path, device=str(device))
+
+
+def load_metadata(path):
+    with safe_open(path, framework="pt") as f:
+        return f.metadata() or {}
+
+
+def load_model(build_model, path, device="cpu", strict=True, timeit=False):
+    # build_model doit construire le modele SANS poids pretrained
+    # (ex: lambda: UNet(1, pretrained=False)), ils sont ecrases de toute facon
+    t1 = time.time()
+    with torch.device("meta"):
+        model = build_model()
+    state_dict = load_checkpoint(path, device)
+    model.load_state_dict(state_dict, strict=strict, assign=True)
+    leftovers = [n for n, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if leftovers:
+        raise RuntimeError(f"checkpoint {path} does not initialize: {leftovers}")
+    t2 = time.time()
+    if timeit:
+        print(f"load: {t2-t1}")
+    return model
+
+
+def atomic_save(obj, path):
+    # meme principe que save_checkpoint pour les objets non-tensor
+    # (etat de l'optimizer, RNG, position du sampler...)
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".tmp-", suffix=".pt")
+    os.close(fd)
+    try:
+        torch.save(obj, tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+# DATASET
+# Version importable (sans effets de bord) des utilitaires et du VideoDataset
+# copies dans chaque script, pour les modules partages (service, cascade...).
+
+import time
+import torch
+from torch.utils.data import Dataset
+import torchvision.io as io
+import os
+import json
+import csv
+from io import BytesIO
+
+import torchvision.transforms.v2 as transforms
+
+import quarantine
+
+dataset_dir = "/raid/datasets/hackathon2024"
+resized_dir = os.path.join(dataset_dir, "resized_dataset")
+nb_frames = 10
+
+TEMPORAL = ["uniform", "subset", "clip"]
+
+# UTILITIES
+
+def extract_frames(video_path, nb_frames=10, delta=None, timeit=False):
+    # use time to measure the time it takes to resize a video
+    # delta : ecart en secondes entre les frames ; None : reparties sur toute la
+    # video d'apres probe.csv (ou un probe direct). seek() est absolu : l'ancien
+    # reader.seek(delta) a chaque tour renvoyait nb_frames fois la meme frame.
+    from probe import video_meta, uniform_frame_times  # ici : probe.py importe deja ce module
+    t1 = time.time()
+    reader = io.VideoReader(video_path)
+    if delta is not None:
+        times = [i * delta for i in range(nb_frames)]
+    else:
+        times = uniform_frame_times(video_meta(video_path), nb_frames)
+    # take nb_frames frames uniformly sampled from the video (sans fps connu : les premieres)
+    frames = []
+    for t in times if times is not None else [None] * nb_frames:
+        if t is not None:
+            reader.seek(t)
+        frame = next(reader, None)
+        if frame is None:
+            break
+        frames.append(frame['data'])
+    if not frames:
+        raise quarantine.EmptyVideo(f"no frames decoded from {video_path}")
+    t2 = time.time()     
+    video = pad_frames(torch.stack(frames), nb_frames)
+    if timeit:
+        print(f"read: {t2-t1}")
+    return video
+
+def pad_frames(video, nb_frames, out=None):
+    # video trop courte : on repete la derniere frame (comme buffers.py) pour
+    # que tous les samples aient nb_frames frames ; out : video ecrite dans out
+    n = len(video)
+    if n >= nb_frames:
+        return video
+    if out is not None:
+        out[n:nb_frames] = out[n - 1]
+        return out[:nb_frames]
+    return torch.cat([video, video[-1:].expand(nb_frames - n, *video.shape[1:])])
+
+def smart_resize(data, size): # kudos louis
+    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
+    # x, y, height et width servent a faire un crop avant de resize
+
+    full_height = data.shape[-2]
+    full_width = data.shape[-1]
+
+    if full_height > full_width:
+        alt_height = size
+        alt_width = int(full_width / (full_height / size))
+    elif full_height < full_width:
+        alt_height = int(full_height / (full_width / size))
+        alt_width = size
+    else:
+        alt_height = size
+        alt_width = size
+    tr = transforms.Compose([
+        transforms.Resize((alt_height, alt_width)),
+        transforms.CenterCrop(size)
+    ])
+    return tr(data)
+
+def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
+    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
+    # x, y, height et width servent a faire un crop avant de resize
+
+    full_height = data.shape[-2]
+    full_width = data.shape[-1]
+    height = full_height - y if height is None else height
+    width = full_width -x if width is None else width
+
+    ratio = new_height/new_width
+    if height/width > ratio:
+        expand_height = height
+        expand_width = int(height / ratio)
+    elif height/width < ratio:
+        expand_height = int(width * ratio)
+        expand_width = width
+    else:
+        expand_height = height
+        expand_width = width
+    tr = transforms.Compose([
+        transforms.CenterCrop((expand_height, expand_width)),
+        transforms.Resize((new_height, new_width))
+    ])
+    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
+    return tr(x)
+
+
+def pyramid_level(root_dir, size):
+    # sous-dossier d'un cache pyramidal (preprocess.py --sizes) pour `size` : le
+    # plus petit niveau >= size, sinon "full" ; None si ce n'est pas une pyramide
+    path = os.path.join(root_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        levels = json.load(file).get("levels")
+    if not levels:
+        return None
+    sizes = sorted(l for l in levels if l != "full")
+    above = [s for s in sizes if s >= size]
+    if above:
+        return str(above[0])
+    return "full" if "full" in levels else str(sizes[-1])
+
+
+class VideoDataset(Dataset):
+    """
+    This Dataset takes a video and returns a tensor of shape [10, 3, 256, 256]
+    That is 10 colored frames of 256x256 pixels.
+    source="pt" lit le cache de .pt, source="mp4" decode les videos brutes avec
+    le backend de decode.py (par defaut "auto" : le plus rapide calibre).
+
+    Un cache peut stocker K > nb_frames frames par video (preprocess.py
+    --nb-frames 32) : chaque lecture en tire nb_frames selon `temporal`
+    ("uniform" : toujours les memes, "subset" : sous-ensemble aleatoire trie,
+    "clip" : fenetre contigue aleatoire) et `clips` echantillons par video et
+    par epoch, sans jamais re-decoder.
+
+    Sur un cache pyramidal, root_dir est la racine de la pyramide : le niveau
+    est choisi d'apres `size` et redimensionne a `size` s'il ne tombe pas juste.
+    """
+    def __init__(self, root_dir, dataset_choice="train", nb_frames=10, source="pt", size=256,
+                 decode_backend="auto", temporal="uniform", clips=1):
+        super().__init__()
+        self.dataset_choice = dataset_choice
+        self.nb_frames = nb_frames
+        # valeur des etapes de progressive.py qui ne fixent pas nb_frames
+        self.default_nb_frames = nb_frames
+        self.source = source
+        self.size = size
+        self.decode_backend = decode_backend
+        if temporal not in TEMPORAL:
+            raise ValueError(f"temporal must be one of {TEMPORAL}")
+        self.temporal = temporal
+        self.clips = clips
+        self.base_dir = root_dir
+        self.level = pyramid_level(root_dir, size) if source == "pt" else None
+        if self.level is not None:
+            root_dir = os.path.join(root_dir, self.level)
+        if  self.dataset_choice == "train":
+            self.root_dir = os.path.join(root_dir, "train_dataset")
+        elif  self.dataset_choice == "test":
+            self.root_dir = os.path.join(root_dir, "test_dataset")
+        elif  self.dataset_choice == "experimental":
+            self.root_dir = os.path.join(root_dir, "experimental_dataset")
+        else:
+            raise ValueError("choice must be 'train', 'test' or 'experimental'")
+
+        with open(os.path.join(root_dir, "dataset.csv"), 'r') as file:
+            reader = csv.reader(file)
+            # read dataset.csv with id,label columns to create
+            # a dict which associated label: id
+            self.ids = {row[1][:-3] + "pt" : row[0] for row in reader}
+
+        if self.dataset_choice == "test":
+            self.data = None
+        else:
+            with open(os.path.join(self.root_dir, "metadata.json"), 'r') as file:
+                self.data= json.load(file)
+                self.data = {k[:-3] + "pt" : (torch.tensor(float(1)) if v == 'fake' else torch.tensor(float(0))) for k, v in self.data.items()}
+
+        ext = '.mp4' if source == "mp4" else '.pt'
+        # les videos en quarantaine (decodeur en echec) sont ignorees, sauf en
+        # test : chaque video doit avoir sa ligne dans la submission
+        split = os.path.basename(self.root_dir)
+        self.quarantined = {k for k in quarantine.load(root_dir) if k.startswith(split + "/")}
+        self.video_files = [f for f in self.list_files() if f.endswith(ext)
+                            and (self.dataset_choice == "test" or f"{split}/{f[:-len(ext)]}" not in self.quarantined)]
+
+    def list_files(self):
+        # fichiers du split (shards.ShardDataset les prend dans son index)
+        return os.listdir(self.root_dir)
+
+    def __len__(self):
+        return len(self.video_files) * self.clips
+
+    def set_resolution(self, size, nb_frames=None):
+        # entre deux epochs (progressive.py) : sur une pyramide on passe au
+        # niveau le plus proche, sinon read() redimensionne ; une etape sans
+        # nb_frames revient a celui du constructeur (meme run avec ou sans reprise)
+        self.size = size
+        self.nb_frames = self.default_nb_frames if nb_frames is None else nb_frames
+        if self.level is not None:
+            self.level = pyramid_level(self.base_dir, size)
+            split_dir = os.path.basename(self.root_dir)
+            self.root_dir = os.path.join(self.base_dir, self.level, split_dir)
+
+    def video_index(self, idx):
+        # les `clips` echantillons d'une video sont idx, idx + n, idx + 2n...
+        return idx % len(self.video_files)
+
+    def path(self, idx):
+        return os.path.join(self.root_dir, self.video_files[self.video_index(idx)])
+
+    def key(self, idx):
+        # nom du .pt correspondant, cle de self.ids et self.data
+        f = self.video_files[self.video_index(idx)]
+        return f[:-3] + "pt" if self.source == "mp4" else f
+
+    def frame_indices(self, total):
+        # nb_frames indices parmi les `total` frames stockees
+        n = self.nb_frames
+        if total <= n:
+            return list(range(total))
+        if self.temporal == "subset":
+            return sorted(torch.randperm(total)[:n].tolist())
+        if self.temporal == "clip":
+            start = int(torch.randint(total - n + 1, ()))
+            return list(range(start, start + n))
+        return [i * total // n for i in range(n)]
+
+    def read(self, idx, out=None, data=None):
+        # video brute uint8 [T, 3, H, W], ecrite dans `out` si on en fournit un
+        # data : octets du fichier deja en memoire (voir readahead.py)
+        # leve quarantine.DecodeError si la video est corrompue ou bloque le decodeur
+        video_path = self.path(idx)
+        if quarantine.video_key(video_path) in self.quarantined:
+            raise quarantine.DecodeError(video_path)
+        return pad_frames(self._read(video_path, out, data), self.nb_frames, out)
+
+    def blank(self):
+        # video noire a la place d'une video de test illisible
+        return torch.zeros(self.nb_frames, 3, self.size, self.size, dtype=torch.uint8)
+
+    def quarantined_ids(self):
+        # IDs des videos du split en quarantaine, relus sur disque (les workers ont pu en ajouter)
+        skipped = quarantine.load(os.path.dirname(self.root_dir))
+        return {self.ids[self.key(i)] for i in range(len(self.video_files))
+                if quarantine.video_key(self.path(i)) in skipped}
+
+    def _read(self, video_path, out=None, data=None):
+        if self.source == "mp4":
+            # import ici : decode.py importe deja ce module
+            from decode import decode_video, av_extract_frames, frame_indices
+            # seul le decodage mp4 passe par le process de decodage (timeout) ;
+            # il ecrit dans `out` a travers la memoire partagee. Frames choisies
+            # ici d'apres le chemin, les memes avec ou sans readahead
+            kwargs = {"indices": frame_indices(video_path, self.nb_frames)}
+            if data is not None:
+                # seul pyav sait decoder depuis un buffer memoire
+                fn, args = av_extract_frames, (BytesIO(data), self.nb_frames, self.size)
+            else:
+                fn, args = decode_video, (video_path, self.nb_frames, self.size)
+                kwargs["backend"] = self.decode_backend
+            return quarantine.guarded_decode(fn, video_path, args, kwargs, isolate=True, out=out)
+        # les .pt sont deja en [K, 3, 256, 256] uint8 : lus ici, les frames sont
+        # tirees dans ce process et ecrites directement dans `out`
+        stored = quarantine.guarded_decode(torch.load, video_path, (BytesIO(data) if data is not None else video_path,))
+        return self.select(stored, out)
+
+    def select(self, video, out=None):
+        # frames de l'epoch et taille demandee a partir de la video stockee
+        if len(video) > self.nb_frames:
+            video = video[self.frame_indices(len(video))]
+        if video.shape[-2:] != (self.size, self.size):
+            # niveau de pyramide plus grand que size (ou crop pleine resolution)
+            video = resize_data(video, self.size, self.size)
+        if out is None:
+            return pad_frames(video, self.nb_frames)
+        return pad_frames(out[:len(video)].copy_(video), self.nb_frames, out)
+
+    def __getitem__(self, idx):
+        try:
+            video = self.read(idx) / 255
+        except quarantine.DecodeError:
+            if self.dataset_choice != "test":
+                # video mise en quarantaine : on renvoie la suivante pour ne pas casser l'epoch
+                return self[(idx + 1) % len(self)]
+            # en test la video garde son ID ; sa prediction est remplacee (quarantined_ids)
+            video = self.blank() / 255
+
+        key = self.key(idx)
+        ID = self.ids[key]
+
+        if self.dataset_choice == "test":
+            return video, ID
+        else:
+            label = self.data[key]
+            return video, label, ID
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+# DECODAGE
+# Backends de decodage interchangeables (VideoReader, pyav, io.read_video),
+# chacun avec une option de threads. La commande `calibrate` les chronometre sur
+# un echantillon du dataset et retient le plus rapide par codec/resolution dans
+# decode_calibration.json ; backend="auto" s'en sert ensuite.
+# Le backend pyav fait le crop et le resize dans ffmpeg (filter graph, ou
+# simplement au reformat quand il n'y a pas de crop) : les frames sortent
+# directement a la taille voulue au lieu d'empiler la pleine resolution puis de
+# passer par smart_resize.
+# Le decodage utilise les threads du codec (frame + slice) ; threads=None prend
+# la part du budget CPU (--cpus-per-task) allouee a chaque worker du DataLoader
+# pour ne pas surcharger les coeurs.
+#
+#   python decode.py parity /raid/datasets/hackathon2024/train_dataset --sample 20
+#   python decode.py calibrate /raid/datasets/hackathon2024/train_dataset --sample 20
+#   python decode.py threads /raid/datasets/hackathon2024/train_dataset --workers 1 2 4 --threads 1 2 4
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import av
+import numpy as np
+import torch
+import torchvision.io as io
+
+import quarantine
+from dataset import smart_resize
+from probe import lookup, uniform_frame_indices, video_meta
+
+calibration_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "decode_calibration.json")
+
+
+# BUDGET DE THREADS
+
+# herite par le process de decodage de quarantine.py (voir set_decode_threads)
+decode_threads = int(os.environ["DECODE_THREADS"]) if os.environ.get("DECODE_THREADS") else None
+
+
+def cpu_budget():
+    # CPUs de ce process : l'allocation (ou l'affinite) est partagee par les
+    # ranks que torchrun lance dans la meme tache (LOCAL_WORLD_SIZE)
+    n = os.environ.get("SLURM_CPUS_PER_TASK")
+    if n:
+        total = int(n)
+    else:
+        total = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    return max(1, total // int(os.environ.get("LOCAL_WORLD_SIZE", 1)))
+
+
+def threads_per_worker(num_workers, budget=None):
+    budget = budget or cpu_budget()
+    return max(1, budget // max(num_workers, 1))
+
+
+def set_decode_threads(n):
+    global decode_threads
+    decode_threads = n
+    # le process de decodage (quarantine.DecodeServer) le lit au demarrage
+    os.environ["DECODE_THREADS"] = str(n)
+
+
+def _threads(threads):
+    # None : budget du process ; 0 : laisse ffmpeg choisir (tous les coeurs)
+    if threads is None:
+        return decode_threads if decode_threads is not None else 0
+    return threads
+
+
+def decode_worker_init(worker_id):
+    # worker_init_fn du DataLoader : chaque worker prend sa part du budget et
+    # torch n'y lance pas ses propres threads en plus
+    info = torch.utils.data.get_worker_info()
+    set_decode_threads(threads_per_worker(info.num_workers))
+    torch.set_num_threads(1)
+
+
+def loader_kwargs(num_workers):
+    # a passer au DataLoader ; sans worker c'est le process principal qui decode
+    if num_workers == 0:
+        set_decode_threads(threads_per_worker(1))
+        return {"num_workers": 0}
+    return {"num_workers": num_workers, "worker_init_fn": decode_worker_init}
+
+
+def fit_size(height, width, size):
+    # meme calcul que smart_resize : le plus grand cote passe a `size`
+    if height > width:
+        return size, int(width / (height / size))
+    elif height < width:
+        return int(height / (width / size)), size
+    return size, size
+
+
+def video_size(video_path):
+    # (height, width) de la premiere piste video, sans decoder
+    meta = lookup(video_path)
+    if meta is not None:
+        return meta["height"], meta["width"]
+    with av.open(video_path) as container:
+        ctx = container.streams.video[0].codec_context
+        return ctx.height, ctx.width
+
+
+def _letterbox(arr, size):
+    # centre l'image [H, W, 3] dans un carre size x size noir, comme CenterCrop
+    # de torchvision quand l'image est plus petite que le crop
+    out = np.zeros((size, size, 3), dtype=np.uint8)
+    h, w = arr.shape[:2]
+    top, left = (size - h) // 2, (size - w) // 2
+    out[top:top + h, left:left + w] = arr
+    return out
+
+
+def _crop_graph(stream, box, height, width):
+    x, y, h, w = box
+    graph = av.filter.Graph()
+    src = graph.add_buffer(template=stream)
+    crop = graph.add("crop", f"{w}:{h}:{x}:{y}")
+    scale = graph.add("scale", f"{width}:{height}:flags=area")
+    fmt = graph.add("format", "rgb24")
+    sink = graph.add("buffersink")
+    src.link_to(crop)
+    crop.link_to(scale)
+    scale.link_to(fmt)
+    fmt.link_to(sink)
+    graph.configure()
+    return graph
+
+
+def av_extract_frames(video_path, nb_frames=10, size=None, box=None, start=0.0, letterbox=True, threads=None,
+                      out=None, indices=None):
+    """
+    Renvoie [nb_frames, 3, S, S] uint8 (S = size) : les nb_frames premieres frames
+    a partir de `start` secondes, recadrees sur box = (x, y, height, width) puis
+    redimensionnees comme smart_resize. size=None garde la resolution source.
+    letterbox=False garde le rapport d'aspect sans padding.
+    out : buffer [nb_frames, 3, S, S] uint8 (voir buffers.FramePool) dans lequel
+    on decode directement, sans liste de frames ni torch.stack.
+    indices : numeros de frames a garder depuis le debut de la video (ex.
+    probe.uniform_frame_indices) au lieu des nb_frames premieres ; les autres
+    sont decodees mais pas converties.
+    """
+    if indices is not None:
+        wanted = set(indices)
+        nb_frames = len(wanted)
+    container = av.open(video_path)
+    try:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        stream.thread_count = _threads(threads)
+        src_height, src_width = stream.codec_context.height, stream.codec_context.width
+        crop_height, crop_width = (box[2], box[3]) if box is not None else (src_height, src_width)
+        if size is None:
+            height, width = crop_height, crop_width
+        else:
+            height, width = fit_size(crop_height, crop_width, size)
+        graph = _crop_graph(stream, box, height, width) if box is not None else None
+        if start > 0:
+            container.seek(int(start / stream.time_base), stream=stream)
+
+        frames = []
+        n = 0
+        for i, frame in enumerate(container.decode(stream)):
+            if frame.time is not None and frame.time < start:
+                continue
+            if indices is not None and i not in wanted:
+                continue
+            if graph is not None:
+                graph.push(frame)
+                arr = graph.pull().to_ndarray()
+            else:
+                # pas de crop : le reformat de swscale suffit
+                arr = frame.reformat(width=width, height=height, format="rgb24", interpolation="AREA").to_ndarray()
+            if out is not None and size is not None and letterbox:
+                # letterbox directement dans le buffer
+                h, w = arr.shape[:2]
+                top, left = (size - h) // 2, (size - w) // 2
+                if h != size or w != size:
+                    out[n].zero_()
+                out[n, :, top:top + h, left:left + w].copy_(torch.from_numpy(arr).permute(2, 0, 1))
+            elif out is not None:
+                out[n].copy_(torch.from_numpy(arr).permute(2, 0, 1))
+            else:
+                if size is not None and letterbox:
+                    arr = _letterbox(arr, size)
+                frames.append(torch.from_numpy(arr))
+            n += 1
+            if n == nb_frames:
+                break
+    finally:
+        container.close()
+    if n == 0:
+        raise quarantine.EmptyVideo(f"no frames decoded from {video_path}")
+    if out is not None:
+        return out[:n]
+    return torch.stack(frames).permute(0, 3, 1, 2).contiguous()
+
+
+# BACKENDS
+# signature commune : (video_path, nb_frames, size, threads, indices) -> [T, 3, S, S]
+# uint8 ; indices=None : nb_frames frames reparties sur toute la video, les
+# memes que le cache .pt (preprocess.py) ; size=None garde la resolution source
+
+
+def frame_indices(video_path, nb_frames):
+    # numeros des frames a decoder d'apres probe.csv (ou un probe direct)
+    return uniform_frame_indices(video_meta(video_path), nb_frames)
+
+
+DECODE_BACKENDS = {}
+
+
+def register_backend(name):
+    def wrap(fn):
+        DECODE_BACKENDS[name] = fn
+        return fn
+    return wrap
+
+
+@register_backend("videoreader")
+def videoreader_backend(video_path, nb_frames=10, size=None, threads=None, indices=None):
+    indices = frame_indices(video_path, nb_frames) if indices is None else indices
+    wanted, last = set(indices), max(indices)
+    reader = io.VideoReader(video_path, "video", num_threads=_threads(threads))
+    frames = []
+    for i, frame in enumerate(reader):
+        if i in wanted:
+            frames.append(frame['data'])
+        if i >= last:
+            break
+    if not frames:
+        raise quarantine.EmptyVideo(f"no frames decoded from {video_path}")
+    video = torch.stack(frames)
+    return video if size is None else smart_resize(video, size)
+
+
+@register_backend("av")
+def av_backend(video_path, nb_frames=10, size=None, threads=None, indices=None):
+    indices = frame_indices(video_path, nb_frames) if indices is None else indices
+    return av_extract_frames(video_path, nb_frames, size, threads=threads, indices=indices)
+
+
+@register_backend("read_video")
+def read_video_backend(video_path, nb_frames=10, size=None, threads=None, indices=None, window=1.0):
+    # read_video decode une fenetre en secondes : on l'agrandit jusqu'a la
+    # derniere frame voulue (read_video ne prend pas d'option de threads).
+    # Son `info` ne donne que les fps : la duree vient de probe.csv (ou d'un probe)
+    indices = frame_indices(video_path, nb_frames) if indices is None else indices
+    duration = video_meta(video_path)["duration"] or None
+    while True:
+        video, _, info = io.read_video(video_path, start_pts=0, end_pts=window, pts_unit="sec",
+                                       output_format="TCHW")
+        if len(video) > max(indices) or window > 60 or (duration is not None and window >= duration):
+            break
+        window *= 2
+    video = video[[i for i in indices if i < len(video)]]
+    if len(video) == 0:
+        raise quarantine.EmptyVideo(f"no frames decoded from {video_path}")
+    return video if size is None else smart_resize(video, size)
+
+
+def codec_key(video_path):
+    # cle de calibration : codec + resolution, ex "h264/1920x1080"
+    meta = lookup(video_path)
+    if meta is not None:
+        return f"{meta['codec']}/{meta['width']}x{meta['height']}"
+    with av.open(video_path) as container:
+        ctx = container.streams.video[0].codec_context
+        return f"{ctx.name}/{ctx.width}x{ctx.height}"
+
+
+_calibration = {}
+
+
+def load_calibration(path=None):
+    # lu une seule fois par process (et par worker du DataLoader)
+    path = path or calibration_path
+    if path not in _calibration:
+        table = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                table = json.load(file)
+        _calibration[path] = table
+    return _calibration[path]
+
+
+def choose_backend(video_path, calibration=None):
+    # (nom, threads) : le plus rapide mesure pour ce codec/resolution, pyav sinon
+    table = load_calibration(calibration)
+    entry = table.get(codec_key(video_path)) if table else None
+    if entry is None:
+        return "av", 0
+    return entry["backend"], entry["threads"]
+
+
+def decode_video(video_path, nb_frames=10, size=None, backend="auto", threads=None, calibration=None, out=None,
+                 indices=None):
+    indices = frame_indices(video_path, nb_frames) if indices is None else indices
+    if backend == "auto":
+        backend, calibrated = choose_backend(video_path, calibration)
+        if threads is None:
+            # la calibration a ete faite seule sur la machine : on la plafonne au budget
+            threads = calibrated if decode_threads is None else min(calibrated or decode_threads, decode_threads)
+    if backend == "av":
+        return av_extract_frames(video_path, nb_frames, size, threads=threads, out=out, indices=indices)
+    video = DECODE_BACKENDS[backend](video_path, nb_frames, size, threads=threads, indices=indices)
+    return video if out is None else out[:len(video)].copy_(video)
+
+
+def calibrate(video_paths, nb_frames=10, size=256, threads_options=(0, 1, 2, 4), repeats=2, path=None):
+    """
+    Chronometre chaque (backend, threads) sur les videos, groupees par
+    codec/resolution, et ecrit le plus rapide de chaque groupe.
+    """
+    groups = {}
+    for p in video_paths:
+        groups.setdefault(codec_key(p), []).append(p)
+    table = {}
+    for key, paths in groups.items():
+        timings = {}
+        for name, fn in DECODE_BACKENDS.items():
+            for threads in threads_options:
+                try:
+                    t1 = time.time()
+                    for _ in range(repeats):
+                        for p in paths:
+                            fn(p, nb_frames, size, threads=threads)
+                    timings[f"{name}:{threads}"] = (time.time() - t1) / (repeats * len(paths))
+                except Exception as e:
+                    print(f"{key} {name}:{threads} failed: {e}")
+        if not timings:
+            # aucun backend ne lit ce groupe : pas d'entree, choose_backend prendra pyav
+            print(f"{key}: every backend failed, not calibrated")
+            continue
+        best = min(timings, key=timings.get)
+        name, threads = best.split(":")
+        table[key] = {"backend": name, "threads": int(threads), "videos": len(paths), "timings": timings}
+        print(f"{key}: {best} ({timings[best] * 1000:.1f} ms/video)")
+    path = path or calibration_path
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(table, file, indent=2)
+    os.replace(tmp_path, path)
+    _calibration[path] = table
+    return table
+
+
+def _bench_worker(args):
+    paths, threads, nb_frames, size = args
+    torch.set_num_threads(1)
+    frames = 0
+    t1 = time.time()
+    for p in paths:
+        frames += len(av_extract_frames(p, nb_frames, size, threads=threads, indices=frame_indices(p, nb_frames)))
+    return frames, time.time() - t1
+
+
+def bench_threads(video_paths, workers_options=(1, 2, 4), threads_options=(1, 2, 4), nb_frames=10, size=256):
+    # images/s decodees selon (workers, threads par worker), comme dans un DataLoader
+    results = []
+    for workers in workers_options:
+        for threads in threads_options:
+            shards = [(video_paths[i::workers], threads, nb_frames, size) for i in range(workers)]
+            t1 = time.time()
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                out = pool.map(_bench_worker, shards)
+            elapsed = time.time() - t1
+            frames = sum(f for f, _ in out)
+            results.append({"workers": workers, "threads": threads, "fps": frames / elapsed,
+                            "fps_per_worker": frames / sum(t for _, t in out) if out else 0.0})
+            print(f"workers {workers}  threads/worker {threads}  "
+                  f"{results[-1]['fps']:.1f} frames/s  ({results[-1]['fps_per_worker']:.1f} per worker)")
+    return results
+
+
+def parity(video_paths, nb_frames=10, size=256):
+    # compare av_extract_frames(size) a smart_resize(av_extract_frames(None))
+    # sur les memes frames : seule l'interpolation differe
+    diffs, t_ref, t_av = [], 0.0, 0.0
+    for path in video_paths:
+        t1 = time.time()
+        ref = smart_resize(av_extract_frames(path, nb_frames), size)
+        t2 = time.time()
+        out = av_extract_frames(path, nb_frames, size)
+        t3 = time.time()
+        if ref.shape != out.shape:
+            raise AssertionError(f"{path}: shape {tuple(out.shape)} != {tuple(ref.shape)}")
+        diffs.append((out.float() - ref.float()).abs().mean().item())
+        t_ref += t2 - t1
+        t_av += t3 - t2
+    return {"mean_abs_diff": float(np.mean(diffs)), "max_mean_abs_diff": float(np.max(diffs)),
+            "smart_resize_s": t_ref / len(video_paths), "av_scaled_s": t_av / len(video_paths)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("parity")
+    p.add_argument("videos")
+    p.add_argument("--sample", type=int, default=20)
+    p.add_argument("--size", type=int, default=256)
+    p.add_argument("--tolerance", type=float, default=3.0, help="ecart moyen max en niveaux de gris (0-255)")
+    p = sub.add_parser("calibrate")
+    p.add_argument("videos")
+    p.add_argument("--sample", type=int, default=20)
+    p.add_argument("--size", type=int, default=256)
+    p.add_argument("--threads", type=int, nargs="+", default=[0, 1, 2, 4])
+    p.add_argument("--output", default=calibration_path)
+    p = sub.add_parser("threads")
+    p.add_argument("videos")
+    p.add_argument("--sample", type=int, default=40)
+    p.add_argument("--size", type=int, default=256)
+    p.add_argument("--nb-frames", type=int, default=30)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(args.videos) if f.endswith(".mp4"))
+    files = random.Random(0).sample(files, min(args.sample, len(files)))
+    paths = [os.path.join(args.videos, f) for f in files]
+    if args.command == "parity":
+        res = parity(paths, size=args.size)
+        print(res)
+        if res["max_mean_abs_diff"] > args.tolerance:
+            raise SystemExit(f"parity check failed: {res['max_mean_abs_diff']:.2f} > {args.tolerance}")
+        print("parity ok")
+    elif args.command == "calibrate":
+        calibrate(paths, size=args.size, threads_options=args.threads, path=args.output)
+    else:
+        bench_threads(paths, args.workers, args.threads, args.nb_frames, args.size)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# DISTRIBUE
+# Initialisation DDP depuis torchrun (RANK/WORLD_SIZE/LOCAL_RANK) ou depuis srun
+# multi-task (SLURM_PROCID/SLURM_NTASKS/SLURM_LOCALID). Sans GPU on tombe sur gloo,
+# ce qui permet de tester avec plusieurs process CPU sur une seule machine :
+#   torchrun --standalone --nproc_per_node=2 UNetv4.py
+# Sur le cluster, srun --ntasks=N (voir runddp) : l'agent torchrun ne relaie pas
+# le USR1 du checkpoint avant l'echeance, il en meurt.
+
+import os
+import subprocess
+import torch
+import torch.distributed as dist
+
+
+def _slurm_master_addr():
+    nodelist = os.environ.get("SLURM_JOB_NODELIST", os.environ.get("SLURM_NODELIST"))
+    if not nodelist:
+        return "127.0.0.1"
+    hosts = subprocess.check_output(["scontrol", "show", "hostnames", nodelist], text=True)
+    return hosts.split()[0]
+
+
+def setup_distributed(backend=None, port=29500):
+    """
+    Renvoie (rank, world_size, device). Avec un seul process on ne touche pas
+    a torch.distributed et le device est le meme que dans les scripts.
+    """
+    if "RANK" in os.environ:
+        rank = int(os.environ["RANK"])
+        world_size = int(os.environ["WORLD_SIZE"])
+        local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    elif int(os.environ.get("SLURM_NTASKS", 1)) > 1:
+        rank = int(os.environ["SLURM_PROCID"])
+        world_size = int(os.environ["SLURM_NTASKS"])
+        local_rank = int(os.environ.get("SLURM_LOCALID", 0))
+        os.environ.setdefault("MASTER_ADDR", _slurm_master_addr())
+        os.environ.setdefault("MASTER_PORT", str(port))
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return 0, 1, device
+
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank % torch.cuda.device_count())
+        device = torch.device("cuda", torch.cuda.current_device())
+    else:
+        device = torch.device("cpu")
+    backend = backend or os.environ.get("DIST_BACKEND") or ("nccl" if device.type == "cuda" else "gloo")
+    if not dist.is_initialized():
+        dist.init_process_group(backend, rank=rank, world_size=world_size)
+    return rank, world_size, device
+
+
+def cleanup_distributed():
+    if dist.is_available() and dist.is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+def get_rank():
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main():
+    # logging, checkpoints et submission uniquement sur le rank 0
+    return get_rank() == 0
+
+
+def barrier():
+    if get_world_size() > 1:
+        dist.barrier()
+
+
+def any_rank(flag, device):
+    # vrai si au moins un rank leve le drapeau : tous les ranks doivent
+    # s'arreter/checkpointer au meme step sinon les all-reduce se bloquent
+    if get_world_size() == 1:
+        return bool(flag)
+    t = torch.tensor([1 if flag else 0], device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.MAX)
+    return bool(t.item())
+
+
+def any_ranks(flags, device):
+    # any_rank pour plusieurs drapeaux en un seul all-reduce (et une seule synchro)
+    if get_world_size() == 1:
+        return [bool(f) for f in flags]
+    t = torch.tensor([1 if f else 0 for f in flags], device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.MAX)
+    return [bool(f) for f in t.tolist()]
+
+
+def all_sum(values, device):
+    # sommes sur tous les ranks de quelques nombres (ex. loss totale et nombre de samples)
+    if get_world_size() == 1:
+        return [float(v) for v in values]
+    t = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(t)
+    return t.tolist()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# EXEMPLES DIFFICILES
+# Au lieu d'un shuffle uniforme, chaque epoch melange des videos tirees selon
+# leur derniere loss (les difficiles plus souvent) et des videos au hasard,
+# equilibrees entre real et fake. Les videos deja tres bien classees peuvent etre
+# sautees pour une partie des pas. La loss par video est tenue dans un tableau
+# float32, mis a jour par training.train et sauve avec le checkpoint.
+# Le main compare le nombre de pas pour atteindre une loss de validation.
+#
+#   python hardsampler.py --model cnn3d --target-loss 0.45 --hard-fraction 0.5 --skip-fraction 0.3
+
+import argparse
+import os
+
+import torch
+import torch.distributed as dist
+
+from training import ResumableSampler
+from validation import label_array
+
+
+def _draw(weights, k, generator):
+    # multinomial refuse k = 0 (hard_fraction 0 ou 1, petite epoch)
+    if k <= 0:
+        return torch.empty(0, dtype=torch.long)
+    return torch.multinomial(weights, k, replacement=True, generator=generator)
+
+
+class HardExampleSampler(ResumableSampler):
+    """
+    warmup : epochs en shuffle uniforme avant d'utiliser les losses.
+    hard_fraction : part de l'epoch tiree proportionnellement a la loss, le reste
+    uniformement ; les deux tirages sont equilibres entre classes si `labels`.
+    skip_fraction : part des videos les plus faciles retiree de l'epoch (l'epoch
+    fait donc moins de pas).
+    L'ordre ne depend que de (seed, epoch, losses) : identique sur tous les
+    ranks tant que sync() est appele en fin d'epoch, et reproductible a la reprise.
+    """
+    def __init__(self, data_source, labels=None, seed=0, warmup=1, hard_fraction=0.5, skip_fraction=0.0,
+                 rank=0, num_replicas=1):
+        super().__init__(data_source, seed=seed, shuffle=True, rank=rank, num_replicas=num_replicas)
+        n = len(data_source)
+        self.labels = labels
+        self.warmup = warmup
+        self.hard_fraction = hard_fraction
+        self.skip_fraction = skip_fraction
+        # nan : jamais vue, traitee comme la plus difficile
+        self.losses = torch.full((n,), float("nan"))
+        self._pending = torch.full((n,), float("nan"))
+
+    def update(self, indices, losses):
+        self._pending[torch.as_tensor(indices)] = losses.cpu().float()
+
+    def sync(self, device=None, commit=True):
+        # fusionne les losses vues par tous les ranks pendant l'epoch ; commit=False
+        # (checkpoint en cours d'epoch) les laisse en attente, les memes sur tous
+        # les ranks : la moyenne du sync suivant n'en est pas changee
+        pending = self._pending
+        if dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1:
+            seen = (~pending.isnan()).float()
+            values = torch.nan_to_num(pending)
+            both = torch.stack([values, seen]).to(device)
+            dist.all_reduce(both)
+            values, seen = both.cpu()
+            pending = torch.where(seen > 0, values / seen.clamp(min=1), torch.full_like(values, float("nan")))
+        if not commit:
+            self._pending = pending
+            return
+        mask = ~pending.isnan()
+        self.losses[mask] = pending[mask]
+        self._pending.fill_(float("nan"))
+
+    def state_dict(self):
+        # pending : losses de l'epoch en cours, perdues sinon a la reprise
+        return {"losses": self.losses.clone(), "pending": self._pending.clone()}
+
+    def load_state_dict(self, state):
+        self.losses = state["losses"].clone()
+        if "pending" in state:
+            self._pending = state["pending"].clone()
+
+    def _weights(self, base):
+        # poids de tirage par video, chaque classe recoit la meme masse
+        weights = base.clone()
+        if self.labels is not None:
+            for c in [0.0, 1.0]:
+                members = self.labels == c
+                total = weights[members].sum()
+                if total > 0:
+                    weights[members] /= total
+        return weights
+
+    def indices(self):
+        if self.epoch < self.warmup:
+            return super().indices()
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = len(self.losses)
+        seen = ~self.losses.isnan()
+        losses = torch.where(seen, self.losses, self.losses[seen].max() if seen.any() else torch.tensor(1.0))
+        candidates = torch.ones(n, dtype=torch.bool)
+        if self.skip_fraction > 0:
+            # les plus faciles (loss la plus basse) sortent de l'epoch
+            easiest = losses.argsort()[:int(n * self.skip_fraction)]
+            candidates[easiest] = False
+        m = int(candidates.sum())
+        n_hard = int(m * self.hard_fraction)
+        hard = _draw(self._weights((losses + 1e-3) * candidates), n_hard, g)
+        rest = _draw(self._weights(candidates.float()), m - n_hard, g)
+        order = torch.cat([hard, rest])
+        return order[torch.randperm(len(order), generator=g)].tolist()
+
+
+if __name__ == "__main__":
+    from dataset import VideoDataset, resized_dir
+    from models import MODELS, build_model
+    from training import train
+    from progressive import time_to_target
+
+    parser = argparse.ArgumentParser()
+    choices = sorted(m for m, spec in MODELS.items() if spec["output"] == "sigmoid")
+    parser.add_argument("--model", default="cnn3d", choices=choices)
+    parser.add_argument("--data-dir", default=resized_dir)
+    parser.add_argument("--target-loss", type=float, required=True, help="loss de validation (split experimental)")
+    parser.add_argument("--hard-fraction", type=float, default=0.5)
+    parser.add_argument("--skip-fraction", type=float, default=0.0)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--ckpt-dir", default="checkpoints_hardsampler")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    spec = MODELS[args.model]
+    dataset = VideoDataset(args.data_dir, dataset_choice="train", size=spec["size"])
+    val_dataset = VideoDataset(args.data_dir, dataset_choice="experimental", size=spec["size"])
+    hard = HardExampleSampler(dataset, label_array(dataset), warmup=args.warmup,
+                              hard_fraction=args.hard_fraction, skip_fraction=args.skip_fraction)
+    results = {}
+    for name, sampler in [("uniform", None), ("hard", hard)]:
+        torch.manual_seed(0)
+        model = build_model(args.model).to(device)
+        optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.lr)
+        ckpt_dir = os.path.join(args.ckpt_dir, name)
+        train(model, dataset, torch.nn.BCELoss(), optimizer, device, args.epochs, batch_size=args.batch_size,
+              ckpt_dir=ckpt_dir, permute=spec["permute"], num_workers=args.num_workers, pooled=True,
+              sampler=sampler, val_dataset=val_dataset, target_loss=args.target_loss)
+        state = torch.load(os.path.join(ckpt_dir, "state.pt"), map_location="cpu")
+        results[name] = (state.get("steps_to_target"), time_to_target(ckpt_dir))
+
+    for name, (steps, seconds) in results.items():
+        label = f"{steps} steps, {seconds:.0f}s" if steps is not None else "not reached"
+        print(f"{name:8s} validation loss {args.target_loss}: {label}")
+    if results["uniform"][0] and results["hard"][0]:
+        print(f"steps saved: {1 - results['hard'][0] / results['uniform'][0]:.0%}")
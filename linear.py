@@ -16,6 +16,8 @@ import wandb
 
 from PIL import Image
 import torchvision.transforms.v2 as transforms
+from dataset import resize_data, smart_resize
+from models import DeepfakeDetector
 
 # UTILITIES
 
@@ -35,55 +37,6 @@ def extract_frames(video_path, nb_frames=10, delta=1, timeit=False):
         print(f"read: {t2-t1}")
     return video
 
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
-
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
-
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
-
-
 # SETUP DATASET
 
 dataset_dir = "/raid/datasets/hackathon2024"
@@ -220,32 +173,6 @@ experimental_dataset = VideoDataset(dataset_dir, dataset_choice="experimental",
 
 # MODELE
 
-class DeepfakeDetector(nn.Module):
-    def __init__(self, nb_frames=10):
-        super().__init__()
-        self.flat = nn.Flatten()
-        self.linear1 = nn.Linear(nb_frames*3*256*256, 128)
-        self.relu1 = nn.ReLU()
-        self.linear2 = nn.Linear(128, 256)
-        self.relu2 = nn.ReLU()
-        self.linear3 = nn.Linear(256, 512)
-        self.relu3 = nn.ReLU()
-        self.linear4 = nn.Linear(512, 1)
-        self.sigmoid = nn.Sigmoid()
-
-    def forward(self, x):
-        y = self.flat(x)
-        y = self.linear1(y)
-        y = self.relu1(y)
-        y = self.linear2(y)
-        y = self.relu2(y)
-        y = self.linear3(y)
-        y = self.relu3(y)
-        y = self.linear4(y)
-        y = self.sigmoid(y)
-        return y
-
-
 # LOGGING
 
 
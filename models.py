@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+# MODELES
+# Les architectures des differents scripts, importables sans lancer
+# d'entrainement, et un registre nom -> (constructeur, format d'entree).
+# Les scripts (linear, othoCNN2D, run, UNetv4, UNet_004) importent leur modele
+# d'ici : une seule definition, les checkpoints restent interchangeables.
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import timm
+
+from checkpoint import load_model
+
+
+class DeepfakeDetector(nn.Module):
+    def __init__(self, nb_frames=10):
+        super().__init__()
+        self.flat = nn.Flatten()
+        self.linear1 = nn.Linear(nb_frames*3*256*256, 128)
+        self.relu1 = nn.ReLU()
+        self.linear2 = nn.Linear(128, 256)
+        self.relu2 = nn.ReLU()
+        self.linear3 = nn.Linear(256, 512)
+        self.relu3 = nn.ReLU()
+        self.linear4 = nn.Linear(512, 1)
+        self.sigmoid = nn.Sigmoid()
+
+    def forward(self, x):
+        y = self.flat(x)
+        y = self.linear1(y)
+        y = self.relu1(y)
+        y = self.linear2(y)
+        y = self.relu2(y)
+        y = self.linear3(y)
+        y = self.relu3(y)
+        y = self.linear4(y)
+        y = self.sigmoid(y)
+        return y
+
+
+class EnhancedCNN4(nn.Module):
+    def __init__(self):
+        in_channels = 3
+        out_channels = 32
+        k_size = 3
+        stride_ = 1
+        padding_ = 1
+        pool_k_size = 2
+        pool_stride = 2
+        pool_padding = 0
+        dropout_rate = 0.5
+
+        
+
+        super(EnhancedCNN4, self).__init__()
+        self.conv1 = nn.Conv2d(in_channels, out_channels, kernel_size= k_size, stride=stride_, padding=padding_)
+        self.bn1 = nn.BatchNorm2d(out_channels)
+
+
+        in_channels = out_channels
+        out_channels = out_channels*2
+
+        self.conv2 = nn.Conv2d(in_channels, out_channels, kernel_size= k_size, stride= stride_, padding=padding_)
+        self.bn2 = nn.BatchNorm2d(out_channels)
+
+        self.pool1 = nn.MaxPool2d(kernel_size=pool_k_size, stride=pool_stride)
+
+        in_channels = out_channels
+        out_channels = out_channels*2
+
+        self.conv3 = nn.Conv2d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
+        self.bn3 = nn.BatchNorm2d(out_channels)
+
+        in_channels = out_channels
+        out_channels = out_channels*2
+
+        self.conv4 = nn.Conv2d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
+        self.bn4 = nn.BatchNorm2d(out_channels)
+
+        self.pool2 = nn.MaxPool2d(kernel_size=pool_k_size, stride=pool_stride)
+        
+
+
+
+        # Calculate the size of the output from the last pooling layer
+        def calc_output_dim(input_dim, kernel_size, stride, padding):
+            return (input_dim - kernel_size + 2 * padding) // stride + 1
+        
+        #Initial dimension of the data is 64
+        dim = 64
+        # After conv1
+        dim = calc_output_dim(dim, k_size, stride_, padding_)      
+        # After conv2
+        dim = calc_output_dim(dim, k_size, stride_, padding_)
+        # After pool1
+        dim = calc_output_dim(dim, pool_k_size, pool_stride, pool_padding)   
+        # After conv3
+        dim = calc_output_dim(dim, k_size, stride_, padding_)
+        # After conv4
+        dim = calc_output_dim(dim, k_size, stride_, padding_)
+
+        # After pool2
+        dim = calc_output_dim(dim, pool_k_size, pool_stride, pool_padding)          
+
+        self.dropout = nn.Dropout(dropout_rate)
+        # ramene la carte a dim x dim quelle que soit la resolution d'entree
+        # (identite a 64px, aucun poids : les checkpoints restent compatibles)
+        self.head_pool = nn.AdaptiveAvgPool2d((dim, dim))
+    
+        self.fc = nn.Linear(in_features= out_channels*dim*dim, out_features=1024)
+        
+        #out_features is the number of classes we want to predict, here Cat and Dog so 2 classses
+        self.fc2 = nn.Linear(in_features=1024 , out_features=2)
+        
+
+    def forward(self, x):
+        
+        x = F.relu(self.bn1(self.conv1(x)))
+        x = self.pool1(F.relu(self.bn2(self.conv2(x))))
+        x = F.relu(self.bn3(self.conv3(x)))
+        x = self.pool2(F.relu(self.bn4(self.conv4(x))))
+        x = self.head_pool(x)
+
+        x = torch.flatten(x, 1)
+        x = self.dropout(x)
+        x = F.relu(self.fc(x))
+        x = (self.fc2(x))
+        return x
+
+
+class EnhancedCNN4_3D(nn.Module):
+    def __init__(self):
+        super(EnhancedCNN4_3D, self).__init__()
+        in_channels = 3
+        out_channels = 32
+        k_size = (3, 3, 3)  # Kernel size now includes time dimension
+        stride_ = (1, 1, 1)  # Stride now includes time dimension
+        padding_ = (1, 1, 1)  # Padding now includes time dimension
+        pool_k_size = (1, 2, 2)  # Pooling in the time dimension remains 1
+        pool_stride = (1, 2, 2)  # Pooling stride in the time dimension
+        pool_padding = (0, 0, 0)  # Pool padding
+        dropout_rate = 0.5
+
+        # Convolutional and BatchNorm layers now use 3D
+        self.conv1 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
+        self.bn1 = nn.BatchNorm3d(out_channels)
+
+        in_channels = out_channels
+        out_channels *= 2  # Doubling the output channels with each layer
+
+        self.conv2 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
+        self.bn2 = nn.BatchNorm3d(out_channels)
+        self.pool1 = nn.MaxPool3d(kernel_size=pool_k_size, stride=pool_stride, padding=pool_padding)
+
+        in_channels = out_channels
+        out_channels *= 2
+
+        self.conv3 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
+        self.bn3 = nn.BatchNorm3d(out_channels)
+
+        in_channels = out_channels
+        out_channels *= 2
+
+        self.pool2 = nn.MaxPool3d(kernel_size=pool_k_size, stride=pool_stride)
+
+        # Assuming input depth is 10 frames and each frame is 256x256 pixels
+        # This would need to be adjusted based on actual input size
+        input_frames = 10
+        dim = 256  # Initial dimension of the data in height and width
+        for _ in range(2):  # Two pooling layers
+            input_frames = (input_frames - pool_k_size[0] + 2 * pool_padding[0]) // pool_stride[0] + 1
+            dim = (dim - pool_k_size[1] + 2 * pool_padding[1]) // pool_stride[1] + 1
+            dim = (dim - pool_k_size[2] + 2 * pool_padding[2]) // pool_stride[2] + 1
+
+        self.dropout = nn.Dropout(dropout_rate)
+        # tete independante de la resolution et du nombre de frames (identite
+        # en 10x256x256) pour l'entrainement progressif
+        self.head_pool = nn.AdaptiveAvgPool3d((input_frames, dim, dim))
+        self.fc = nn.Linear(5242880, 1024)  # Adjusting for 3D volume
+        self.fc2 = nn.Linear(1024, 1)  # Number of classes
+
+    def forward(self, x):
+        
+
+        x = F.relu(self.bn1(self.conv1(x)))
+        
+        x = self.pool1(F.relu(self.bn2(self.conv2(x))))
+        
+        x = self.pool2(F.relu(self.bn3(self.conv3(x))))
+        x = self.head_pool(x)
+        
+        x = torch.flatten(x, 1)
+        
+        
+        x = self.dropout(x)
+        x = F.relu(self.fc(x))
+        x = F.relu(self.fc2(x))
+        x = F.sigmoid(x)
+        return x
+
+
+class DoubleConv(nn.Module):
+    def __init__(self, in_channels, out_channels):
+        super(DoubleConv, self).__init__()
+        self.double_conv = nn.Sequential(
+            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True),
+            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
+            nn.BatchNorm2d(out_channels),
+            nn.ReLU(inplace=True)
+        )
+
+    def forward(self, x):
+        return self.double_conv(x)
+
+
+class UNetInceptionV4(nn.Module):
+    def __init__(self, num_classes, pretrained=True):
+        super(UNetInceptionV4, self).__init__()
+        # Encoder (utilise InceptionV4 pré-entraîné de TIMM)
+        # pretrained=False quand on recharge un checkpoint qui ecrase tout
+        inception = timm.create_model('inception_v4', pretrained=pretrained)
+        for p in inception.features.parameters():
+            p.requires_grad = False
+        self.encoder = inception.features
+        
+        # Decoder
+        self.decoder = nn.ModuleList([
+            DoubleConv(1536, 512),
+            nn.ConvTranspose2d(512, 256, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(256, 256),
+            nn.ConvTranspose2d(256, 128, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(128, 128),
+            nn.ConvTranspose2d(128, 64, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(64, 64),
+            nn.ConvTranspose2d(64, 32, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(32, 32),
+        ])
+        
+        # Classification binaire
+        self.global_pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(32, num_classes)
+
+    def forward(self, x):
+        # Encoder
+        x = self.encoder(x[:, :, 0])
+        # Decoder
+        for idx, layer in enumerate(self.decoder):
+            x = layer(x)
+        # Classification binaire
+        x = self.global_pool(x)
+        x = torch.flatten(x, 1)
+        x = self.fc(x)
+        return torch.sigmoid(x)
+
+
+class UNetDenseNet201(nn.Module):
+    def __init__(self, num_classes, pretrained=True):
+        super(UNetDenseNet201, self).__init__()
+        # Encoder (utilise DenseNet201 pré-entraîné de TIMM)
+        # pretrained=False quand on recharge un checkpoint qui ecrase tout
+        densenet = timm.create_model('densenet201', pretrained=pretrained)
+        self.encoder = densenet.features
+        
+        # Decoder
+        self.decoder = nn.ModuleList([
+            DoubleConv(1920, 1024),
+            nn.ConvTranspose2d(1024, 512, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(512, 512),
+            nn.ConvTranspose2d(512, 256, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(256, 256),
+            nn.ConvTranspose2d(256, 128, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(128, 128),
+            nn.ConvTranspose2d(128, 64, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(64, 64),
+            nn.ConvTranspose2d(64, 32, kernel_size=3, stride=2, padding=1, output_padding=1),
+            DoubleConv(32, 32)
+        ])
+        
+        # Classification binaire
+        self.global_pool = nn.AdaptiveAvgPool2d(1)
+        self.fc = nn.Linear(32, num_classes)
+
+    def forward(self, x):
+        # Encoder
+        x = self.encoder(x[:, :, 0])
+        # Decoder
+        for idx, layer in enumerate(self.decoder):
+            x = layer(x)
+        # Classification binaire
+        x = self.global_pool(x)
+        x = torch.flatten(x, 1)
+        x = self.fc(x)
+        return torch.sigmoid(x)
+
+
+# REGISTRE
+# input : comment passer d'un batch VideoDataset [B, T, 3, H, W] dans [0, 1]
+# a l'entree du modele ; output : "sigmoid" (deja une proba) ou "logits" (2 classes)
+# progressive : accepte d'autres resolutions / nombres de frames (progressive.py)
+
+MODELS = {
+    "linear": {
+        "build": lambda pretrained=True: DeepfakeDetector(),
+        "permute": False, "first_frame": False, "size": 256, "output": "sigmoid", "progressive": False,
+    },
+    "cnn2d": {
+        "build": lambda pretrained=True: EnhancedCNN4(),
+        "permute": False, "first_frame": True, "size": 64, "output": "logits", "progressive": True,
+    },
+    "cnn3d": {
+        "build": lambda pretrained=True: EnhancedCNN4_3D(),
+        "permute": True, "first_frame": False, "size": 256, "output": "sigmoid", "progressive": True,
+    },
+    "unetv4": {
+        "build": lambda pretrained=True: UNetInceptionV4(1, pretrained=pretrained),
+        "permute": True, "first_frame": False, "size": 256, "output": "sigmoid", "progressive": True,
+    },
+    "unet_densenet201": {
+        "build": lambda pretrained=True: UNetDenseNet201(1, pretrained=pretrained),
+        "permute": True, "first_frame": False, "size": 256, "output": "sigmoid", "progressive": True,
+    },
+}
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def build_model(name, pretrained=True):
+    if name not in MODELS:
+        raise ValueError(f"unknown model {name!r}, choose from {sorted(MODELS)}")
+    return MODELS[name]["build"](pretrained=pretrained)
+
+
+def load_registered(name, path, device="cpu"):
+    # recharge un checkpoint safetensors sans reconstruire les poids pretrained
+    model = load_model(lambda: build_model(name, pretrained=False), path, device)
+    return model.eval()
+
+
+def prepare_input(name, X):
+    spec = MODELS[name]
+    if spec["first_frame"]:
+        X = X[:, 0]
+        mean = torch.tensor(IMAGENET_MEAN, device=X.device).view(1, 3, 1, 1)
+        std = torch.tensor(IMAGENET_STD, device=X.device).view(1, 3, 1, 1)
+        X = (X - mean) / std
+    if X.shape[-1] != spec["size"] or X.shape[-2] != spec["size"]:
+        X = F.interpolate(X.flatten(0, -4), size=(spec["size"], spec["size"]), mode="bilinear",
+                          antialias=True, align_corners=False).view(*X.shape[:-2], spec["size"], spec["size"])
+    if spec["permute"]:
+        X = X.permute(0, 2, 1, 3, 4)
+    return X
+
+
+def predict_proba(name, model, X):
+    # renvoie la proba "fake" de chaque video du batch, shape [B]
+    out = model(prepare_input(name, X))
+    if MODELS[name]["output"] == "logits":
+        return torch.softmax(out, dim=1)[:, 1]
+    return out.flatten()
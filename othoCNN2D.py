@@ -16,6 +16,8 @@ import wandb
 
 from PIL import Image
 import torchvision.transforms.v2 as transforms
+from dataset import resize_data, smart_resize
+from models import EnhancedCNN4
 
 # UTILITIES
 
@@ -24,55 +26,6 @@ def extract_first_frame(video_path):
     frame = next(reader)['data']  # Read the first frame
     return frame.unsqueeze(0)  # Add a batch dimension
 
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
-
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
-
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
-
-
 # SETUP DATASET
 
 dataset_dir = "/raid/datasets/hackathon2024"
@@ -192,93 +145,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-class EnhancedCNN4(nn.Module):
-    def __init__(self):
-        in_channels = 3
-        out_channels = 32
-        k_size = 3
-        stride_ = 1
-        padding_ = 1
-        pool_k_size = 2
-        pool_stride = 2
-        pool_padding = 0
-        dropout_rate = 0.5
-
-        
-
-        super(EnhancedCNN4, self).__init__()
-        self.conv1 = nn.Conv2d(in_channels, out_channels, kernel_size= k_size, stride=stride_, padding=padding_)
-        self.bn1 = nn.BatchNorm2d(out_channels)
-
-
-        in_channels = out_channels
-        out_channels = out_channels*2
-
-        self.conv2 = nn.Conv2d(in_channels, out_channels, kernel_size= k_size, stride= stride_, padding=padding_)
-        self.bn2 = nn.BatchNorm2d(out_channels)
-
-        self.pool1 = nn.MaxPool2d(kernel_size=pool_k_size, stride=pool_stride)
-
-        in_channels = out_channels
-        out_channels = out_channels*2
-
-        self.conv3 = nn.Conv2d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
-        self.bn3 = nn.BatchNorm2d(out_channels)
-
-        in_channels = out_channels
-        out_channels = out_channels*2
-
-        self.conv4 = nn.Conv2d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
-        self.bn4 = nn.BatchNorm2d(out_channels)
-
-        self.pool2 = nn.MaxPool2d(kernel_size=pool_k_size, stride=pool_stride)
-        
-
-
-
-        # Calculate the size of the output from the last pooling layer
-        def calc_output_dim(input_dim, kernel_size, stride, padding):
-            return (input_dim - kernel_size + 2 * padding) // stride + 1
-        
-        #Initial dimension of the data is 64
-        dim = 64
-        # After conv1
-        dim = calc_output_dim(dim, k_size, stride_, padding_)      
-        # After conv2
-        dim = calc_output_dim(dim, k_size, stride_, padding_)
-        # After pool1
-        dim = calc_output_dim(dim, pool_k_size, pool_stride, pool_padding)   
-        # After conv3
-        dim = calc_output_dim(dim, k_size, stride_, padding_)
-        # After conv4
-        dim = calc_output_dim(dim, k_size, stride_, padding_)
-
-        # After pool2
-        dim = calc_output_dim(dim, pool_k_size, pool_stride, pool_padding)          
-
-        self.dropout = nn.Dropout(dropout_rate)
-    
-        self.fc = nn.Linear(in_features= out_channels*dim*dim, out_features=1024)
-        
-        #out_features is the number of classes we want to predict, here Cat and Dog so 2 classses
-        self.fc2 = nn.Linear(in_features=1024 , out_features=2)
-        
-
-    def forward(self, x):
-        
-        x = F.relu(self.bn1(self.conv1(x)))
-        x = self.pool1(F.relu(self.bn2(self.conv2(x))))
-        x = F.relu(self.bn3(self.conv3(x)))
-        x = self.pool2(F.relu(self.bn4(self.conv4(x))))
-
-        x = torch.flatten(x, 1)
-        x = self.dropout(x)
-        x = F.relu(self.fc(x))
-        x = (self.fc2(x))
-        return x
-
-
-
 # LOGGING
 
 wandb.login(key="b15da3ba051c5858226f1d6b28aee6534682d044")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# PREFETCH SUR LE DEVICE
+# Les boucles faisaient X.to(device) juste avant model(X) : la copie host ->
+# device ne recouvrait jamais le calcul. DevicePrefetcher enveloppe un loader et
+# garde le batch suivant deja sur le device : copie depuis de la memoire epinglee
+# sur un stream CUDA a part, puis conversion uint8 -> float, /255 et permute des
+# canaux sur le device (la fonction `prepare`, ex. training.prepare_batch).
+# Sans CUDA, un thread prepare les batchs en avance dans une queue : meme
+# logique de recouvrement, testable sur CPU.
+#
+#   python prefetch.py --batches 50 --compute-ms 20
+
+import argparse
+import queue
+import threading
+import time
+
+import torch
+
+
+def _pin(sample):
+    # epingle les tenseurs CPU du batch (copie si besoin) pour un transfert asynchrone
+    return [x.pin_memory() if torch.is_tensor(x) and x.device.type == "cpu" and not x.is_pinned() else x
+            for x in sample]
+
+
+# buffers epingles reutilises (buffers.FramePool) : data_ptr -> event de la
+# derniere copie asynchrone vers le device qui les lit encore
+_reused = {}
+
+
+def track(buf):
+    # buf sera rempli a nouveau plus tard : voir wait_copy
+    _reused[buf.data_ptr()] = None
+
+
+def wait_copy(buf):
+    # avant de reecrire un buffer suivi, attend la fin de sa copie vers le device
+    event = _reused.get(buf.data_ptr())
+    if event is not None:
+        event.synchronize()
+        _reused[buf.data_ptr()] = None
+
+
+def _record_copies(sample, stream):
+    for x in sample:
+        if torch.is_tensor(x) and not x.is_cuda and x.data_ptr() in _reused:
+            event = torch.cuda.Event()
+            event.record(stream)
+            _reused[x.data_ptr()] = event
+
+
+def _record(sample, stream):
+    # les tenseurs alloues sur le stream de copie sont utilises sur le stream courant
+    for x in sample:
+        if torch.is_tensor(x) and x.is_cuda:
+            x.record_stream(stream)
+
+
+class DevicePrefetcher:
+    """
+    Itere sur prepare(batch, device) avec `depth` batchs d'avance.
+    prepare : fonction qui transfere et transforme un batch (non_blocking=True).
+    """
+    def __init__(self, loader, device, prepare, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.prepare = prepare
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type == "cuda":
+            return self._cuda_iter()
+        return self._thread_iter()
+
+    def _cuda_iter(self):
+        stream = torch.cuda.Stream(self.device)
+        pending = []
+        it = iter(self.loader)
+
+        def submit():
+            sample = next(it, None)
+            if sample is None:
+                return False
+            sample = _pin(sample)
+            with torch.cuda.stream(stream):
+                pending.append(self.prepare(sample, self.device))
+            _record_copies(sample, stream)
+            return True
+
+        for _ in range(self.depth):
+            if not submit():
+                break
+        while pending:
+            torch.cuda.current_stream(self.device).wait_stream(stream)
+            batch = pending.pop(0)
+            _record(batch, torch.cuda.current_stream(self.device))
+            # la copie du batch suivant part pendant le calcul sur celui-ci
+            submit()
+            yield batch
+
+    def _thread_iter(self):
+        q = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        done = object()
+
+        def producer():
+            try:
+                for sample in self.loader:
+                    if stop.is_set():
+                        return
+                    q.put(self.prepare(sample, self.device))
+                q.put(done)
+            except Exception as e:
+                q.put(e)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = q.get()
+                if batch is done:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # sortie anticipee (walltime...) : on debloque le producteur
+            stop.set()
+            while thread.is_alive():
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    thread.join(timeout=0.01)
+
+
+if __name__ == "__main__":
+    from training import prepare_batch
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--load-ms", type=float, default=20, help="temps simule de chargement d'un batch")
+    parser.add_argument("--compute-ms", type=float, default=20, help="temps simule du pas d'entrainement")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    def loader():
+        for i in range(args.batches):
+            time.sleep(args.load_ms / 1000)
+            yield (torch.randint(0, 256, (args.batch_size, 10, 3, 256, 256), dtype=torch.uint8),
+                   torch.zeros(args.batch_size), list(range(args.batch_size)))
+
+    def step(X):
+        time.sleep(args.compute_ms / 1000)
+        return X.mean()
+
+    prepare = lambda sample, device: prepare_batch(sample, device, permute=True)
+    for name, batches in [("sync", (prepare(s, device) for s in loader())),
+                          ("prefetch", DevicePrefetcher(loader(), device, prepare))]:
+        t1 = time.time()
+        for X, label, ID in batches:
+            step(X)
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        print(f"{name:9s} {time.time() - t1:.2f}s for {args.batches} batches")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# CONSTRUCTION DU CACHE
+# Version importable du bloc "MAKE RESIZED DATASET" des scripts : decode chaque
+# mp4, recadre sur la region d'interet, redimensionne et sauve un .pt par video.
+# Un manifest.json a la racine du cache garde pour chaque video la boite de
+# recadrage : un nouveau build (autre taille...) la reutilise sans relancer la
+# detection.
+# Avec --sizes, une seule passe de decodage produit une pyramide : un sous-cache
+# par resolution (out/64, out/128, out/full...) derive du meme crop pleine
+# resolution ; VideoDataset(out, size=...) choisit le niveau.
+# Avec --num-shards N, le process ne traite que les videos de son shard (hash du
+# nom, stable quel que soit le listing) et ecrit manifest.<shard>.json ; --merge
+# assemble ensuite manifest.json (voir slurm.py pour les job arrays).
+#
+#   python preprocess.py --out /raid/datasets/hackathon2024/roi128_dataset --size 128 --roi saliency
+#   python preprocess.py --out /raid/datasets/hackathon2024/pyramid_dataset --sizes 64 128 256 full
+#   python preprocess.py --out ... --num-shards 16 --shard 3   (ou SLURM_ARRAY_TASK_ID)
+#   python preprocess.py --out ... --num-shards 16 --merge
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import torch
+from tqdm import tqdm
+
+from dataset import dataset_dir, extract_frames, nb_frames, resize_data
+from decode import av_extract_frames, video_size
+from probe import lookup, uniform_frame_indices, video_meta
+import quarantine
+from roi import ROI_DETECTORS, get_roi_detector, crop_resize
+
+DECODERS = ["videoreader", "av"]
+
+SPLITS = ["train", "test", "experimental"]
+
+
+def list_videos(src_dir, split):
+    split_dir = os.path.join(src_dir, f"{split}_dataset")
+    return sorted(f for f in os.listdir(split_dir) if f.endswith('.mp4'))
+
+
+def shard_of(key, num_shards):
+    # partition deterministe : sha1 et pas hash(), qui change a chaque process
+    return int(hashlib.sha1(key.encode()).hexdigest(), 16) % num_shards
+
+
+def manifest_path(cache_dir, shard=None):
+    return os.path.join(cache_dir, "manifest.json" if shard is None else f"manifest.{shard}.json")
+
+
+def load_manifest(cache_dir, shard=None):
+    path = manifest_path(cache_dir, shard)
+    if not os.path.exists(path):
+        return {"videos": {}}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_manifest(cache_dir, manifest, shard=None):
+    path = manifest_path(cache_dir, shard)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, path)
+
+
+def av_process(in_path, size, nb_frames, roi, box):
+    # crop + resize faits par ffmpeg ; la detection ROI tourne sur un decodage
+    # reduit et la boite est remise a l'echelle de la source ; frames reparties
+    # sur toute la video d'apres probe.csv, comme extract_frames
+    src_height, src_width = video_size(in_path)
+    indices = uniform_frame_indices(video_meta(in_path), nb_frames)
+    if box is None and roi != "none":
+        small = av_extract_frames(in_path, size=256, letterbox=False, indices=indices)
+        x, y, h, w = get_roi_detector(roi)(small)
+        sy, sx = src_height / small.shape[-2], src_width / small.shape[-1]
+        box = (int(x * sx), int(y * sy), int(h * sy), int(w * sx))
+    if box is None or tuple(box) == (0, 0, src_height, src_width):
+        return av_extract_frames(in_path, size=size, indices=indices), (0, 0, src_height, src_width)
+    return av_extract_frames(in_path, size=size, box=box, indices=indices), box
+
+
+def process_video(in_path, out_path, size=256, nb_frames=10, roi="none", box=None, decoder="videoreader"):
+    # renvoie l'entree du manifest pour cette video
+    t1 = time.time()
+    if decoder == "av":
+        video, box = av_process(in_path, size, nb_frames, roi, box)
+    else:
+        video = extract_frames(in_path, nb_frames=nb_frames)
+        if box is None:
+            box = get_roi_detector(roi)(video)
+        video = crop_resize(video, size, box)
+    torch.save(video, out_path)
+    return {"box": [int(v) for v in box], "roi": roi, "time": time.time() - t1}
+
+
+def process_pyramid(in_path, out_paths, nb_frames=10, roi="none", box=None, decoder="videoreader"):
+    # out_paths : {niveau : chemin}, niveau = taille en pixels ou "full" (crop
+    # a la resolution source) ; un seul decodage, les niveaux sont des resize du crop
+    t1 = time.time()
+    if decoder == "av":
+        crop, box = av_process(in_path, None, nb_frames, roi, box)
+    else:
+        video = extract_frames(in_path, nb_frames=nb_frames)
+        if box is None:
+            box = get_roi_detector(roi)(video)
+        x, y, height, width = box
+        crop = video[..., y:y + height, x:x + width]
+    for level, out_path in out_paths.items():
+        torch.save(crop.clone() if level == "full" else resize_data(crop, level, level), out_path)
+    return {"box": [int(v) for v in box], "roi": roi, "time": time.time() - t1}
+
+
+def parse_level(level):
+    return level if level == "full" else int(level)
+
+
+def copy_metadata(src_dir, out_dir):
+    for rel in ["dataset.csv", "train_dataset/metadata.json", "experimental_dataset/metadata.json"]:
+        src = os.path.join(src_dir, rel)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(out_dir, rel))
+
+
+def build_cache(src_dir, out_dir, splits=SPLITS, size=256, nb_frames=10, roi="none", boxes_from=None,
+                decoder="videoreader", sizes=None, shard=None, num_shards=1):
+    """
+    Construit le cache dans out_dir/{split}_dataset/*.pt et met a jour
+    out_dir/manifest.json. boxes_from : un autre cache dont on reprend les boites.
+    sizes : niveaux de pyramide (ex. [64, 128, 256, "full"]), chacun dans
+    out_dir/{niveau}/{split}_dataset/*.pt ; remplace size.
+    shard / num_shards : ne traite que les videos du shard et ecrit
+    out_dir/manifest.<shard>.json, a fusionner avec merge_manifests.
+    """
+    manifest = load_manifest(out_dir, shard)
+    manifest.update({"size": size, "nb_frames": nb_frames, "roi": roi})
+    if sizes:
+        manifest.update({"size": None, "levels": list(sizes)})
+    if shard is not None:
+        manifest.update({"shard": shard, "num_shards": num_shards})
+    known_boxes = load_manifest(boxes_from or out_dir)["videos"]
+    errors = []
+    skipped = quarantine.load(src_dir)
+    level_dirs = {level: os.path.join(out_dir, str(level)) for level in sizes or []}
+    for split in splits:
+        for d in list(level_dirs.values()) or [out_dir]:
+            os.makedirs(os.path.join(d, f"{split}_dataset"), exist_ok=True)
+        for f in tqdm(list_videos(src_dir, split), desc=split):
+            if f"{split}_dataset/{f[:-4]}" in skipped:
+                continue
+            key = f"{split}_dataset/{f[:-3]}pt"
+            if shard is not None and shard_of(key, num_shards) != shard:
+                continue
+            cached = known_boxes.get(key)
+            box = cached["box"] if cached and cached.get("roi") == roi else None
+            in_path = os.path.join(src_dir, f"{split}_dataset", f)
+            try:
+                # timeout + quarantaine des videos corrompues ou pathologiques
+                if sizes:
+                    out_paths = {level: os.path.join(d, key) for level, d in level_dirs.items()}
+                    fn, args = process_pyramid, (in_path, out_paths, nb_frames, roi, box, decoder)
+                else:
+                    fn, args = process_video, (in_path, os.path.join(out_dir, key), size, nb_frames, roi, box, decoder)
+                entry = quarantine.guarded_decode(fn, in_path, args, isolate=True)
+                # metadonnees du conteneur si probe.py est passe sur le dataset source
+                meta = lookup(in_path)
+                if meta is not None:
+                    entry.update({k: meta[k] for k in ["codec", "width", "height", "fps", "duration", "frames"]})
+                manifest["videos"][key] = entry
+            except Exception as e:
+                errors.append((f, e))
+    if shard is None:
+        # en shards, c'est merge_manifests qui copie les metadonnees (une seule fois)
+        for d in list(level_dirs.values()) or [out_dir]:
+            copy_metadata(src_dir, d)
+    save_manifest(out_dir, manifest, shard)
+    if errors:
+        print(errors)
+    return manifest
+
+
+def merge_manifests(src_dir, out_dir, num_shards):
+    """
+    Fusionne les manifest.<shard>.json des num_shards shards dans
+    out_dir/manifest.json, copie les metadonnees puis supprime les fichiers
+    des shards. Echoue si un shard manque (job du array en echec).
+    """
+    missing = [i for i in range(num_shards) if not os.path.exists(manifest_path(out_dir, i))]
+    if missing:
+        raise FileNotFoundError(f"no manifest for shards {missing} in {out_dir}")
+    manifest = load_manifest(out_dir)
+    for i in range(num_shards):
+        part = load_manifest(out_dir, i)
+        if part.get("num_shards") != num_shards:
+            raise ValueError(f"shard {i} was built with num_shards={part.get('num_shards')}, expected {num_shards}")
+        videos = part.pop("videos")
+        part.pop("shard")
+        part.pop("num_shards")
+        manifest.update(part)
+        manifest["videos"].update(videos)
+    level_dirs = [os.path.join(out_dir, str(level)) for level in manifest.get("levels") or []]
+    for d in level_dirs or [out_dir]:
+        copy_metadata(src_dir, d)
+    save_manifest(out_dir, manifest)
+    for i in range(num_shards):
+        os.remove(manifest_path(out_dir, i))
+    print(f"merged {num_shards} shards: {len(manifest['videos'])} videos in {manifest_path(out_dir)}")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default=dataset_dir)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--splits", nargs="+", default=SPLITS, choices=SPLITS)
+    parser.add_argument("--size", type=int, default=256)
+    parser.add_argument("--sizes", nargs="+", type=parse_level,
+                        help="pyramide de resolutions en une passe, ex. 64 128 256 full")
+    parser.add_argument("--nb-frames", type=int, default=nb_frames,
+                        help="frames stockees par video ; au-dela de 10 VideoDataset(temporal=...) en tire un sous-ensemble a chaque epoch")
+    parser.add_argument("--roi", default="none", choices=sorted(ROI_DETECTORS))
+    parser.add_argument("--boxes-from", help="cache dont on reutilise les boites du manifest")
+    parser.add_argument("--decoder", default="videoreader", choices=DECODERS,
+                        help="av : crop/resize dans ffmpeg, les frames sortent deja a la bonne taille")
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument("--shard", type=int, default=os.environ.get("SLURM_ARRAY_TASK_ID"),
+                        help="shard traite par ce process (defaut : SLURM_ARRAY_TASK_ID)")
+    parser.add_argument("--merge", action="store_true", help="fusionne les manifests des shards et quitte")
+    args = parser.parse_args()
+    if args.merge:
+        merge_manifests(args.src, args.out, args.num_shards)
+    else:
+        shard = args.shard if args.num_shards > 1 else None
+        if args.num_shards > 1 and shard is None:
+            parser.error("--num-shards > 1 needs --shard or SLURM_ARRAY_TASK_ID")
+        build_cache(args.src, args.out, args.splits, args.size, args.nb_frames, args.roi, args.boxes_from,
+                    args.decoder, args.sizes, shard, args.num_shards)
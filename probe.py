@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# PROBE DES VIDEOS
+# Lit une fois les metadonnees de conteneur (codec, resolution, fps, duree,
+# nombre de frames) de toutes les videos des splits, dans un pool de process,
+# et les garde dans une petite table CSV. Samplers, resize et manifest s'en
+# servent sans rouvrir les flux. Seuls les fichiers nouveaux ou modifies
+# (taille/mtime) sont re-probes.
+#
+#   python probe.py --src /raid/datasets/hackathon2024 --workers 8
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import av
+from tqdm import tqdm
+
+from dataset import dataset_dir
+
+SPLITS = ["train", "test", "experimental"]
+FIELDS = ["split", "file", "size", "mtime", "codec", "width", "height", "fps", "duration", "frames"]
+table_path = os.path.join(dataset_dir, "probe.csv")
+
+
+def probe_video(path):
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        ctx = stream.codec_context
+        fps = float(stream.average_rate) if stream.average_rate else 0.0
+        if stream.duration is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / av.time_base
+        else:
+            duration = 0.0
+        frames = stream.frames or int(round(duration * fps))
+        return {"codec": ctx.name, "width": ctx.width, "height": ctx.height,
+                "fps": fps, "duration": duration, "frames": frames}
+
+
+def _probe_job(job):
+    split, file, path, size, mtime = job
+    try:
+        row = probe_video(path)
+    except Exception as e:
+        print(f"probe failed for {path}: {e}")
+        return None
+    row.update({"split": split, "file": file, "size": size, "mtime": mtime})
+    return row
+
+
+def read_table(path=None):
+    # {chemin absolu : ligne}, avec les types numeriques restaures ; la table
+    # est toujours a la racine du dataset, a cote des dossiers {split}_dataset
+    path = path or table_path
+    rows = {}
+    if not os.path.exists(path):
+        return rows
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            for k in ["size", "width", "height", "frames"]:
+                row[k] = int(row[k])
+            for k in ["mtime", "fps", "duration"]:
+                row[k] = float(row[k])
+            rows[os.path.join(root, f"{row['split']}_dataset", row["file"])] = row
+    return rows
+
+
+def write_table(rows, path=None):
+    path = path or table_path
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in sorted(rows.values(), key=lambda r: (r["split"], r["file"])):
+            writer.writerow({k: row[k] for k in FIELDS})
+    os.replace(tmp_path, path)
+
+
+def probe_dataset(src_dir=dataset_dir, splits=SPLITS, workers=8):
+    """
+    Met a jour la table src_dir/probe.csv : seules les videos absentes ou dont
+    la taille/mtime a change sont re-probees.
+    """
+    path = os.path.join(os.path.abspath(src_dir), "probe.csv")
+    old = read_table(path)
+    # les splits non demandes restent tels quels
+    rows = {k: v for k, v in old.items() if v["split"] not in splits}
+    jobs = []
+    for split in splits:
+        split_dir = os.path.join(src_dir, f"{split}_dataset")
+        for f in sorted(os.listdir(split_dir)):
+            if not f.endswith('.mp4'):
+                continue
+            full = os.path.join(os.path.abspath(split_dir), f)
+            st = os.stat(full)
+            known = old.get(full)
+            if known and known["size"] == st.st_size and known["mtime"] == st.st_mtime:
+                rows[full] = known
+            else:
+                jobs.append((split, f, full, st.st_size, st.st_mtime))
+    print(f"{len(rows)} videos up to date, probing {len(jobs)}")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for job, row in zip(jobs, tqdm(pool.map(_probe_job, jobs, chunksize=16), total=len(jobs))):
+            if row is not None:
+                rows[job[2]] = row
+    write_table(rows, path)
+    _tables.pop(path, None)
+    return rows
+
+
+_tables = {}
+
+
+def lookup(video_path):
+    # metadonnees d'une video depuis la table de son dataset, None si elle n'y
+    # est pas (chemin non str, video jamais probee...)
+    if not isinstance(video_path, str):
+        return None
+    video_path = os.path.abspath(video_path)
+    path = os.path.join(os.path.dirname(os.path.dirname(video_path)), "probe.csv")
+    if path not in _tables:
+        _tables[path] = read_table(path)
+    return _tables[path].get(video_path)
+
+
+def video_meta(video_path):
+    # ligne de la table si la video a ete probee, sinon probe direct
+    meta = lookup(video_path)
+    return meta if meta is not None else probe_video(video_path)
+
+
+def uniform_frame_indices(meta, nb_frames):
+    # nb_frames indices repartis sur toute la video
+    total = max(meta["frames"], 1)
+    if total <= nb_frames:
+        return list(range(total))
+    step = total / nb_frames
+    return [int(i * step) for i in range(nb_frames)]
+
+
+def uniform_frame_times(meta, nb_frames):
+    # instants (secondes) des uniform_frame_indices, pour seek ; None sans fps connu
+    fps = meta["fps"] or (meta["frames"] / meta["duration"] if meta["duration"] else 0)
+    if not fps:
+        return None
+    return [i / fps for i in uniform_frame_indices(meta, nb_frames)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default=dataset_dir)
+    parser.add_argument("--splits", nargs="+", default=SPLITS, choices=SPLITS)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    probe_dataset(args.src, args.splits, args.workers)
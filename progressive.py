@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# ENTRAINEMENT PROGRESSIF
+# Les premieres epochs a 64-128px coutent une fraction des FLOPs des convs
+# (EnhancedCNN4_3D, decodeurs DoubleConv, encodeurs timm). Un ResolutionSchedule
+# donne la taille (et eventuellement le nombre de frames) de chaque epoch :
+# training.train l'applique au dataset (niveau de pyramide, voir preprocess.py
+# --sizes) ou, a defaut, redimensionne le batch sur le device.
+# Le main compare le temps pour atteindre une loss cible avec et sans schedule.
+#
+#   python progressive.py --model cnn3d --data-dir /raid/datasets/hackathon2024/pyramid_dataset \
+#       --schedule 0:64 2:128 4:256 --target-loss 0.45 --epochs 8
+
+import argparse
+import os
+
+import torch
+import torch.nn.functional as F
+
+
+class ResolutionSchedule:
+    """
+    stages : [(epoch de debut, taille, nb_frames ou None)], tries par epoch.
+    L'etape en cours est la derniere dont l'epoch de debut est <= epoch.
+    """
+    def __init__(self, stages):
+        self.stages = sorted((int(e), int(s), None if f is None else int(f)) for e, s, f in stages)
+        if not self.stages or self.stages[0][0] != 0:
+            raise ValueError("the schedule must start at epoch 0")
+
+    @classmethod
+    def parse(cls, specs):
+        # ["0:64", "2:128:5", "4:256"] -> epoch:taille[:frames]
+        stages = []
+        for spec in specs:
+            parts = spec.split(":")
+            stages.append((parts[0], parts[1], parts[2] if len(parts) > 2 else None))
+        return cls(stages)
+
+    def at(self, epoch):
+        size, nb_frames = None, None
+        for start, s, f in self.stages:
+            if start <= epoch:
+                size, nb_frames = s, f
+        return size, nb_frames
+
+    def __repr__(self):
+        return " ".join(f"{e}:{s}" + (f":{f}" if f else "") for e, s, f in self.stages)
+
+
+def resize_batch(X, size=None, nb_frames=None):
+    # X [B, T, 3, H, W] deja sur le device ; frames prises uniformement
+    if nb_frames is not None and X.shape[1] != nb_frames:
+        T = X.shape[1]
+        X = X[:, [i * T // nb_frames for i in range(nb_frames)]]
+    if size is not None and (X.shape[-2] != size or X.shape[-1] != size):
+        B, T = X.shape[:2]
+        X = F.interpolate(X.flatten(0, 1), size=(size, size), mode="bilinear", antialias=True,
+                          align_corners=False).view(B, T, X.shape[2], size, size)
+    return X
+
+
+def time_to_target(ckpt_dir):
+    # secondes d'entrainement avant d'atteindre la loss cible (None si jamais atteinte)
+    state = torch.load(os.path.join(ckpt_dir, "state.pt"), map_location="cpu")
+    return state.get("time_to_target")
+
+
+if __name__ == "__main__":
+    from dataset import VideoDataset, resized_dir
+    from models import MODELS, build_model
+    from training import train
+
+    parser = argparse.ArgumentParser()
+    # modeles video entraines directement par training.train (sortie sigmoid)
+    choices = sorted(m for m, spec in MODELS.items() if spec["progressive"] and not spec["first_frame"])
+    parser.add_argument("--model", default="cnn3d", choices=choices)
+    parser.add_argument("--data-dir", default=resized_dir)
+    parser.add_argument("--schedule", nargs="+", default=["0:64", "2:128", "4:256"], help="epoch:taille[:frames]")
+    parser.add_argument("--target-loss", type=float, required=True)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--ckpt-dir", default="checkpoints_progressive")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    spec = MODELS[args.model]
+    schedule = ResolutionSchedule.parse(args.schedule)
+    results = {}
+    for name, sched in [("fixed", None), ("progressive", schedule)]:
+        torch.manual_seed(0)
+        model = build_model(args.model).to(device)
+        optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.lr)
+        dataset = VideoDataset(args.data_dir, dataset_choice="train", size=spec["size"])
+        loss_fn = torch.nn.BCELoss()
+        ckpt_dir = os.path.join(args.ckpt_dir, name)
+        train(model, dataset, loss_fn, optimizer, device, args.epochs, batch_size=args.batch_size,
+              ckpt_dir=ckpt_dir, permute=spec["permute"], num_workers=args.num_workers, pooled=True,
+              schedule=sched, target_loss=args.target_loss)
+        results[name] = time_to_target(ckpt_dir)
+
+    for name, t in results.items():
+        label = f"{t:.0f}s" if t is not None else "not reached"
+        print(f"{name:12s} time to loss {args.target_loss}: {label}")
+    if None not in results.values():
+        print(f"speedup: {results['fixed'] / results['progressive']:.2f}x ({schedule})")
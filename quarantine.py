@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+# QUARANTAINE
+# Une video corrompue ou pathologique peut bloquer VideoReader/pyav dans du
+# code C, ou le faire planter, et donc tout un worker du DataLoader. Le
+# decodage des mp4 tourne dans un process de decodage persistant (un par
+# process qui decode, lance par subprocess : pas de fork d'un process
+# multithread), tue et relance a l'echeance. Les frames reviennent par une
+# memoire partagee dans laquelle le decodeur ecrit directement. Les lectures
+# de .pt et de shards restent dans le process, sans timeout.
+# Les videos dont le decodeur echoue (exceptions d'un fichier invalide, voir
+# is_decoder_error), plante ou depasse le timeout sont ajoutees a
+# quarantine.jsonl (a la racine du dataset, a cote des dossiers
+# {split}_dataset) avec la raison et le temps de decodage. Les datasets les
+# ignorent ensuite. Les autres erreurs (bug, E/S, memoire) remontent telles
+# quelles et une video lente est seulement signalee.
+#
+#   python quarantine.py /raid/datasets/hackathon2024   (liste la quarantaine)
+
+import importlib
+import json
+import mmap
+import os
+import pickle
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+decode_timeout = 30.0
+slow_threshold = 10.0
+# proba soumise pour une video de test illisible (sa ligne reste dans la submission)
+default_proba = 0.5
+
+
+class DecodeTimeout(Exception):
+    pass
+
+
+class DecodeError(Exception):
+    # levee apres mise en quarantaine, pour que l'appelant prenne un autre sample
+    pass
+
+
+def quarantine_path(root):
+    return os.path.join(root, "quarantine.jsonl")
+
+
+def video_key(path):
+    # "train_dataset/abc" : meme cle pour le .mp4 et le .pt
+    split_dir, f = os.path.split(os.path.abspath(path))
+    return f"{os.path.basename(split_dir)}/{os.path.splitext(f)[0]}"
+
+
+def load(root):
+    # {cle : derniere entree}
+    entries = {}
+    path = quarantine_path(root)
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                entries[entry["key"]] = entry
+    return entries
+
+
+def record(path, reason, elapsed):
+    # une ligne par ecriture en O_APPEND : plusieurs workers/jobs peuvent ecrire en meme temps
+    root = os.path.dirname(os.path.dirname(os.path.abspath(path)))
+    entry = {"key": video_key(path), "reason": reason, "decode_time": round(elapsed, 3), "when": time.time()}
+    line = (json.dumps(entry) + "\n").encode()
+    try:
+        fd = os.open(quarantine_path(root), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    except OSError as e:
+        print(f"cannot write quarantine for {path}: {e}")
+        return entry
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+    print(f"quarantined {entry['key']}: {reason} ({elapsed:.1f}s)")
+    return entry
+
+
+class EmptyVideo(ValueError):
+    # le decodeur n'a rendu aucune frame
+    pass
+
+
+# messages d'un fichier invalide remontes en RuntimeError (torch.load d'un .pt
+# tronque, VideoReader / read_video de torchvision)
+CORRUPT_MESSAGES = ("pytorchstreamreader failed", "invalid data found", "moov atom not found",
+                    "could not open", "could not find codec", "end of file")
+
+# signaux d'un decodeur qui plante (pas ceux de Slurm ou de l'OOM killer)
+CRASH_SIGNALS = {signal.SIGSEGV, signal.SIGBUS, signal.SIGABRT, signal.SIGFPE, signal.SIGILL}
+
+# au-dela, les echecs ne viennent plus des videos (bug, version de torch...) :
+# on arrete au lieu de mettre tout le dataset en quarantaine
+max_consecutive_failures = 20
+_failures = 0
+
+
+def is_decoder_error(e):
+    # seules les erreurs d'un fichier invalide mettent en quarantaine ; les
+    # bugs, erreurs d'E/S (NFS...) et manques de memoire remontent
+    if type(e).__module__.startswith("av.") and not isinstance(e, (FileNotFoundError, PermissionError)):
+        return True
+    if isinstance(e, (EmptyVideo, EOFError, pickle.UnpicklingError)):
+        return True
+    return isinstance(e, RuntimeError) and any(m in str(e).lower() for m in CORRUPT_MESSAGES)
+
+
+def _ref(fn):
+    # (module, nom) importable par le process de decodage ; un script lance en
+    # __main__ y est importe sous son nom de fichier
+    module = fn.__module__
+    if module == "__main__":
+        module = os.path.splitext(os.path.basename(sys.modules["__main__"].__file__))[0]
+    return module, fn.__qualname__
+
+
+def _staged(mm, shape, dtype):
+    import torch
+    n = 1
+    for d in shape:
+        n *= d
+    return torch.frombuffer(mm, dtype=getattr(torch, dtype), count=n).view(shape)
+
+
+def _serve(fd):
+    # boucle du process de decodage : un job (fonction, args, staging) par
+    # pickle sur stdin, la reponse en pickle sur le stdout d'origine
+    for sig in [signal.SIGUSR1, signal.SIGUSR2, signal.SIGINT]:
+        signal.signal(sig, signal.SIG_IGN)
+    # les print des decodeurs partent sur stderr, pas dans le protocole
+    reply = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    jobs = sys.stdin.buffer
+    mm = None
+    while True:
+        try:
+            (module, name), args, kwargs, staging = pickle.load(jobs)
+        except EOFError:
+            return
+        try:
+            fn = importlib.import_module(module)
+            for part in name.split("."):
+                fn = getattr(fn, part)
+            out = None
+            if staging is not None:
+                shape, dtype, nbytes = staging
+                if mm is None or len(mm) < nbytes:
+                    mm = mmap.mmap(fd, nbytes)
+                out = _staged(mm, shape, dtype)
+                kwargs = dict(kwargs, out=out)
+            result = fn(*args, **kwargs)
+            if out is not None and result.data_ptr() == out.data_ptr():
+                # ecrit en place : seul le nombre de frames repasse par le pipe
+                payload = ("staged", len(result))
+            else:
+                payload = ("ok", result)
+        except Exception as e:
+            if is_decoder_error(e):
+                payload = ("decoder", f"{type(e).__name__}: {e}")
+            else:
+                traceback.print_exc()
+                payload = ("error", e)
+        try:
+            data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # exception non picklable : on garde le message
+            data = pickle.dumps(("error", RuntimeError(f"{type(payload[1]).__name__}: {payload[1]}")))
+        reply.write(data)
+        reply.flush()
+
+
+class DecodeServer:
+    """
+    Process de decodage persistant. Lance par subprocess (les workers du
+    DataLoader sont daemon et ne peuvent pas creer de multiprocessing.Process),
+    il n'herite ni des threads ni des verrous du parent. Tue au timeout ou
+    mort d'un plantage, il est relance a l'appel suivant. La fonction appelee
+    doit etre importable (pas de lambda).
+    """
+    def __init__(self):
+        self.proc = None
+        # memoire partagee des frames : memfd, sans fichier a nettoyer
+        self.fd = os.memfd_create("decode_staging")
+        self.mm = None
+        # un job a la fois (thread du prefetcher, pool de readahead...)
+        self.lock = threading.Lock()
+
+    def _start(self):
+        # importe sous son nom (pas __main__) : memes classes d'exception que le parent
+        path = [os.path.dirname(os.path.abspath(__file__))] + [p for p in sys.path if p]
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path))
+        self.proc = subprocess.Popen([sys.executable, "-c", f"import quarantine; quarantine._serve({self.fd})"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, pass_fds=[self.fd], env=env)
+
+    def kill(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+
+    def _reserve(self, nbytes):
+        if self.mm is None or len(self.mm) < nbytes:
+            os.ftruncate(self.fd, nbytes)
+            self.mm = mmap.mmap(self.fd, nbytes)
+        return self.mm
+
+    def call(self, fn, args=(), kwargs=None, timeout=None, out=None):
+        """
+        Renvoie ("ok", resultat), ("decoder", message) ou ("error",
+        exception) ; ("decoder", ...) aussi si le process plante. Leve
+        DecodeTimeout s'il n'a pas repondu au bout de `timeout` secondes (il
+        est alors tue). out : tenseur que fn remplit (argument out=) ; fn
+        ecrit dans la memoire partagee, recopiee une fois dans out.
+        """
+        with self.lock:
+            kind, result = self._call(fn, args, kwargs, timeout, out)
+        if kind == "ok" and out is not None and result.data_ptr() != out.data_ptr():
+            result = out[:len(result)].copy_(result)
+        return kind, result
+
+    def _call(self, fn, args, kwargs, timeout, out):
+        staging = None
+        if out is not None:
+            nbytes = out.numel() * out.element_size()
+            self._reserve(nbytes)
+            staging = (tuple(out.shape), str(out.dtype).split(".")[-1], nbytes)
+        job = pickle.dumps((_ref(fn), args, kwargs or {}, staging), protocol=pickle.HIGHEST_PROTOCOL)
+        if self.proc is None or self.proc.poll() is not None:
+            self._start()
+        try:
+            self.proc.stdin.write(job)
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+        if not select.select([self.proc.stdout], [], [], timeout)[0]:
+            self.kill()
+            raise DecodeTimeout()
+        try:
+            kind, result = pickle.load(self.proc.stdout)
+        except EOFError:
+            code = self.proc.wait()
+            self.proc = None
+            if code < 0 and -code in CRASH_SIGNALS:
+                return "decoder", f"crashed with {signal.Signals(-code).name}"
+            return "error", RuntimeError(f"decode process exited without result (status {code})")
+        if kind == "staged":
+            return "ok", out[:result].copy_(_staged(self.mm, staging[0], staging[1])[:result])
+        return kind, result
+
+
+_server = None
+_server_pid = None
+
+
+def decode_server():
+    # un process de decodage par process (les workers forkes en lancent un)
+    global _server, _server_pid
+    if _server_pid != os.getpid():
+        _server, _server_pid = DecodeServer(), os.getpid()
+    return _server
+
+
+def guarded_decode(fn, path, args=(), kwargs=None, isolate=False, out=None, timeout=None, slow=None):
+    """
+    Appelle fn(*args, **kwargs). Si le decodeur echoue, plante ou depasse le
+    timeout, la video est mise en quarantaine et DecodeError est levee ; les
+    autres erreurs remontent sans quarantaine. Plus lente que `slow`
+    secondes : simple avertissement. isolate=True : dans le process de
+    decodage, sous timeout (fn importable, out= voir DecodeServer.call) ;
+    sinon dans ce process, sans timeout.
+    """
+    global _failures
+    timeout = decode_timeout if timeout is None else timeout
+    slow = slow_threshold if slow is None else slow
+    t1 = time.time()
+    if isolate:
+        try:
+            kind, result = decode_server().call(fn, args, kwargs, timeout, out)
+        except DecodeTimeout:
+            kind, result = "decoder", f"timeout after {timeout}s"
+    else:
+        try:
+            kind, result = "ok", fn(*args, **(kwargs or {}))
+        except Exception as e:
+            if not is_decoder_error(e):
+                raise
+            kind, result = "decoder", f"{type(e).__name__}: {e}"
+    if kind == "error":
+        raise result
+    if kind == "decoder":
+        _failures += 1
+        if _failures > max_consecutive_failures:
+            raise RuntimeError(f"{_failures} decode failures in a row, last on {path}: {result}; "
+                               "not quarantining, this looks systematic")
+        record(path, result, time.time() - t1)
+        raise DecodeError(path)
+    _failures = 0
+    elapsed = time.time() - t1
+    if elapsed > slow:
+        print(f"slow decode {video_key(path)}: {elapsed:.1f}s")
+    return result
+
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else "."
+    entries = load(root)
+    for key, entry in sorted(entries.items()):
+        print(f"{key}\t{entry['reason']}\t{entry['decode_time']}s")
+    print(f"{len(entries)} videos in quarantine")
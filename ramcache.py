@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+# CACHE EN RAM PARTAGEE
+# experimental_dataset (run.py, oscar_run.py, cross_entropy_run.py...) tient en
+# RAM, mais chaque epoch re-torch.load chaque .pt dans chaque worker. RamCache
+# garde les videos stockees dans un bloc de memoire partagee (/dev/shm) visible
+# par tous les workers du DataLoader et par les autres jobs du noeud qui lisent
+# le meme split : apres la premiere epoch, plus de disque ni de torch.load.
+# Le bloc a une taille max ; si le split ne tient pas, les videos les moins
+# recemment lues sont evincees (LRU). Il est supprime a la sortie du dernier
+# process qui l'a ouvert (un verrou partage par proprietaire).
+#
+#   python ramcache.py --data-dir /raid/datasets/hackathon2024/resized_dataset --split experimental --cap-gb 8
+#   python ramcache.py --split experimental --drop   (libere le bloc)
+
+import argparse
+import atexit
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+import quarantine
+from buffers import pooled_loader
+from dataset import VideoDataset, resized_dir
+
+
+def block_name(root_dir, n, shape, cap_bytes):
+    # meme split + memes videos + meme forme + meme taille max -> meme bloc, pour tous les jobs
+    key = f"{os.path.abspath(root_dir)}|{n}|{tuple(shape)}|{cap_bytes}"
+    return "deepfake_" + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+# slot_video d'un slot en cours d'ecriture (ni lisible ni evincable)
+WRITING = -2
+
+
+def stored_shape(dataset):
+    # forme d'une video stockee : la premiere du split qui se lit
+    for i in range(len(dataset.video_files)):
+        path = dataset.path(i)
+        try:
+            return tuple(quarantine.guarded_decode(torch.load, path, (path,)).shape)
+        except quarantine.DecodeError:
+            continue
+    raise ValueError(f"no readable video in {dataset.root_dir}")
+
+
+class RamCache(Dataset):
+    """
+    Enveloppe un VideoDataset source="pt". Le bloc partage contient :
+    video_slot [N] (slot de chaque video, -1 si absente), slot_video [C],
+    slot_len [C] (frames stockees), slot_stamp [C] (derniere lecture, pour le
+    LRU), puis les C slots uint8 [K, 3, H, W]. Verrous POSIX sur
+    /dev/shm/<nom>.lock : l'octet 0 protege l'index (tenu sans copie), l'octet
+    1 + s le slot s ; les copies de slots differents se font en parallele et
+    les lectures disque hors de tout verrou.
+    """
+    def __init__(self, dataset, cap_bytes=8 * 2**30, report_every=1000):
+        self.dataset = dataset
+        self.shape = stored_shape(dataset)
+        self.slot_bytes = int(np.prod(self.shape))
+        self.capacity = max(1, min(len(dataset.video_files), cap_bytes // self.slot_bytes))
+        self.name = block_name(dataset.root_dir, len(dataset.video_files), self.shape, cap_bytes)
+        self.report_every = report_every
+        self._pid = None
+        # proprietaire du bloc jusqu'a la sortie de ce process (les workers heritent du verrou)
+        self._owner = os.getpid()
+        self._users = open(f"/dev/shm/{self.name}.users", 'a+')
+        fcntl.flock(self._users, fcntl.LOCK_SH)
+        atexit.register(self.release)
+
+    def __getattr__(self, name):
+        # nb_frames, size, ids, data, key... viennent du dataset enveloppe
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    @contextmanager
+    def _locked(self, slot=None, shared=False):
+        # slot=None : index ; sinon les donnees du slot
+        start = 0 if slot is None else 1 + int(slot)
+        fcntl.lockf(self._lockfile, fcntl.LOCK_SH if shared else fcntl.LOCK_EX, 1, start)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._lockfile, fcntl.LOCK_UN, 1, start)
+
+    def release(self):
+        # dernier proprietaire (verrou exclusif obtenu) : supprime le bloc ; les
+        # fichiers de verrou restent, d'autres process peuvent les avoir ouverts
+        if self._users is None or self._owner != os.getpid():
+            return
+        try:
+            fcntl.flock(self._users, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pass
+        else:
+            self.drop(files=False)
+        self._users.close()
+        self._users = None
+
+    def _attach(self):
+        # une fois par process (les workers sont forkes)
+        if self._pid == os.getpid():
+            return
+        n, c = len(self.dataset.video_files), self.capacity
+        header = 4 * n + 4 * c + 4 * c + 8 * c
+        self._lockfile = open(f"/dev/shm/{self.name}.lock", 'a+')
+        with self._locked():
+            try:
+                self._shm = shared_memory.SharedMemory(self.name, create=True, size=header + c * self.slot_bytes)
+                created = True
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(self.name)
+                created = False
+            # le bloc doit survivre au process qui l'a cree (autres workers/jobs)
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+            buf = self._shm.buf
+            self.video_slot = np.ndarray((n,), np.int32, buf, 0)
+            self.slot_video = np.ndarray((c,), np.int32, buf, 4 * n)
+            self.slot_len = np.ndarray((c,), np.int32, buf, 4 * n + 4 * c)
+            self.slot_stamp = np.ndarray((c,), np.int64, buf, 4 * n + 8 * c)
+            self.slots = np.ndarray((c, *self.shape), np.uint8, buf, header)
+            if created:
+                self.video_slot[:] = -1
+                self.slot_video[:] = -1
+                self.slot_stamp[:] = 0
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, v):
+        # copie de la video v si elle est en RAM, sinon None
+        with self._locked():
+            slot = self.video_slot[v]
+            if slot < 0 or self.slot_video[slot] != v:
+                return None
+            self.slot_stamp[slot] = time.monotonic_ns()
+        with self._locked(slot, shared=True):
+            # le slot a pu etre evince entre les deux verrous
+            if self.slot_video[slot] != v:
+                return None
+            return torch.from_numpy(self.slots[slot, :self.slot_len[slot]].copy())
+
+    def _put(self, v, video):
+        if tuple(video.shape[1:]) != self.shape[1:] or len(video) > self.shape[0]:
+            return
+        with self._locked():
+            if self.video_slot[v] >= 0 and self.slot_video[self.video_slot[v]] == v:
+                return
+            # slot libre, sinon le moins recemment lu (hors slots en cours d'ecriture)
+            free = np.flatnonzero(self.slot_video == -1)
+            if len(free):
+                slot = int(free[0])
+            else:
+                stamps = np.where(self.slot_video == WRITING, np.iinfo(np.int64).max, self.slot_stamp)
+                slot = int(stamps.argmin())
+                if self.slot_video[slot] == WRITING:
+                    return
+            old = self.slot_video[slot]
+            if old >= 0:
+                self.video_slot[old] = -1
+            self.slot_video[slot] = WRITING
+        written = False
+        try:
+            with self._locked(slot):
+                self.slots[slot, :len(video)] = video.numpy()
+                self.slot_len[slot] = len(video)
+            written = True
+        finally:
+            with self._locked():
+                self.slot_video[slot] = v if written else -1
+                self.slot_stamp[slot] = time.monotonic_ns()
+                if written:
+                    self.video_slot[v] = slot
+
+    def stored(self, idx):
+        # video telle que stockee sur disque [K, 3, H, W] uint8
+        self._attach()
+        v = self.dataset.video_index(idx)
+        video = self._get(v)
+        if video is None:
+            self.misses += 1
+            path = self.dataset.path(idx)
+            video = quarantine.guarded_decode(torch.load, path, (path,))
+            self._put(v, video)
+        else:
+            self.hits += 1
+        total = self.hits + self.misses
+        if self.report_every and total % self.report_every == 0:
+            print(f"[ramcache pid {os.getpid()}] {self.stats()}")
+        return video
+
+    def stats(self):
+        total = max(self.hits + self.misses, 1)
+        used = int((self.slot_video >= 0).sum()) if self._pid == os.getpid() else 0
+        return {"hit_rate": self.hits / total, "slots_used": used, "capacity": self.capacity,
+                "bytes": self.capacity * self.slot_bytes}
+
+    def read(self, idx, out=None):
+        return self.dataset.select(self.stored(idx), out)
+
+    def __getitem__(self, idx):
+        try:
+            video = self.read(idx) / 255
+        except quarantine.DecodeError:
+            if self.dataset.dataset_choice != "test":
+                return self[(idx + 1) % len(self)]
+            video = self.dataset.blank() / 255
+        key = self.dataset.key(idx)
+        ID = self.dataset.ids[key]
+        if self.dataset.dataset_choice == "test":
+            return video, ID
+        return video, self.dataset.data[key], ID
+
+    def drop(self, files=True):
+        # supprime le bloc partage (les process deja attaches gardent leur mapping)
+        try:
+            shm = shared_memory.SharedMemory(self.name)
+        except FileNotFoundError:
+            return False
+        shm.close()
+        shm.unlink()
+        for ext in ["lock", "users"] if files else []:
+            if os.path.exists(f"/dev/shm/{self.name}.{ext}"):
+                os.remove(f"/dev/shm/{self.name}.{ext}")
+        return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default=resized_dir)
+    parser.add_argument("--split", default="experimental")
+    parser.add_argument("--cap-gb", type=float, default=8)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--drop", action="store_true", help="libere le bloc de ce split et quitte")
+    args = parser.parse_args()
+
+    ds = RamCache(VideoDataset(args.data_dir, dataset_choice=args.split), int(args.cap_gb * 2**30))
+    if args.drop:
+        print("dropped" if ds.drop() else "no block")
+    else:
+        print(f"{ds.name}: {ds.capacity}/{len(ds.video_files)} videos, {ds.capacity * ds.slot_bytes / 2**30:.2f} GiB")
+        for epoch in range(args.epochs):
+            t1 = time.time()
+            for sample in pooled_loader(ds, args.batch_size, shuffle=True, num_workers=args.num_workers):
+                pass
+            print(f"epoch {epoch}: {time.time() - t1:.1f}s")
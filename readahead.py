@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# LECTURE ANTICIPEE
+# Sur /raid (RAID reseau) chaque ouverture de fichier dans __getitem__ bloque le
+# worker. ReadAheadDataset connait l'ordre de l'epoch (plan(), appele par la
+# boucle d'entrainement avec l'ordre du sampler) et lit en avance, dans un pool
+# de threads, les octets des K prochaines videos que CE worker va traiter : le
+# DataLoader distribue les batchs aux workers a tour de role, chaque worker sait
+# donc lesquels lui reviennent. Le decodage se fait ensuite depuis la memoire.
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data import Dataset, get_worker_info
+
+from quarantine import DecodeError
+
+
+class ReadAheadDataset(Dataset):
+    """
+    Enveloppe un VideoDataset. k : nombre de videos lues en avance,
+    byte_budget : octets max en memoire (lus ou en cours de lecture) par worker.
+    """
+    def __init__(self, dataset, k=16, byte_budget=512 * 2**20, threads=4, batch_size=1, num_workers=0,
+                 report_every=1000):
+        self.dataset = dataset
+        self.k = k
+        self.byte_budget = byte_budget
+        self.threads = threads
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.report_every = report_every
+        self.order = []
+        self.position = {}
+        self._pid = None
+
+    def __getattr__(self, name):
+        # nb_frames, size, ids, data, key... viennent du dataset enveloppe
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def plan(self, order, batch_size=None, num_workers=None):
+        # ordre des indices de la prochaine epoch, avant de creer le DataLoader
+        # (batch_size/num_workers doivent etre ceux du DataLoader)
+        self.order = list(order)
+        self.position = {idx: p for p, idx in enumerate(self.order)}
+        self.batch_size = batch_size or self.batch_size
+        self.num_workers = self.num_workers if num_workers is None else num_workers
+        if self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+        self._pid = None
+
+    def _setup(self):
+        # etat propre a chaque process (les workers sont forkes a chaque epoch)
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads)
+        self._inflight = {}
+        self._bytes = 0
+        self._next = 0
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+        self.wait_time = 0.0
+
+    def _mine(self, pos):
+        info = get_worker_info()
+        if info is None:
+            return True
+        return (pos // self.batch_size) % self.num_workers == info.id
+
+    def path(self, idx):
+        return self.dataset.path(idx)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _schedule(self, pos):
+        # lance les lectures des k prochaines positions de ce worker, dans le budget
+        self._next = max(self._next, pos + 1)
+        scheduled = 0
+        while self._next < len(self.order) and len(self._inflight) < self.k and scheduled < self.k:
+            p = self._next
+            if not self._mine(p):
+                self._next += 1
+                continue
+            idx = self.order[p]
+            size = os.path.getsize(self.path(idx))
+            if self._bytes + size > self.byte_budget and self._inflight:
+                break
+            self._bytes += size
+            self._inflight[idx] = (self._pool.submit(self._read, self.path(idx)), size)
+            self._next += 1
+            scheduled += 1
+
+    def fetch(self, idx):
+        # octets du fichier : deja lus (hit), en cours de lecture (wait) ou lus maintenant (miss)
+        self._setup()
+        entry = self._inflight.pop(idx, None)
+        if entry is None:
+            self.misses += 1
+            data = self._read(self.path(idx))
+        else:
+            future, size = entry
+            if future.done():
+                self.hits += 1
+            else:
+                self.waits += 1
+            t1 = time.time()
+            data = future.result()
+            self.wait_time += time.time() - t1
+            self._bytes -= size
+        pos = self.position.get(idx)
+        if pos is not None:
+            self._schedule(pos)
+        total = self.hits + self.waits + self.misses
+        if self.report_every and total % self.report_every == 0:
+            print(f"[readahead pid {os.getpid()}] {self.stats()}")
+        return data
+
+    def stats(self):
+        total = max(self.hits + self.waits + self.misses, 1)
+        return {"hit_rate": self.hits / total, "wait_rate": self.waits / total, "miss_rate": self.misses / total,
+                "wait_time": self.wait_time, "bytes_in_memory": self._bytes}
+
+    def read(self, idx, out=None):
+        return self.dataset.read(idx, out=out, data=self.fetch(idx))
+
+    def __getitem__(self, idx):
+        try:
+            video = self.read(idx) / 255
+        except DecodeError:
+            if self.dataset.dataset_choice != "test":
+                return self[(idx + 1) % len(self)]
+            video = self.dataset.blank() / 255
+        key = self.dataset.key(idx)
+        ID = self.dataset.ids[key]
+        if self.dataset.dataset_choice == "test":
+            return video, ID
+        return video, self.dataset.data[key], ID
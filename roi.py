@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# REGION D'INTERET
+# Un detecteur prend les frames brutes uint8 [T, 3, H, W] d'une video et renvoie
+# une boite (x, y, height, width) dans le repere de la frame, directement
+# utilisable par resize_data. Le detecteur par defaut n'a besoin d'aucun reseau :
+# il combine le mouvement entre frames et un masque de teinte de peau.
+
+import torch
+import torch.nn.functional as F
+
+from dataset import resize_data
+
+ROI_DETECTORS = {}
+
+
+def register_roi(name):
+    def wrap(fn):
+        ROI_DETECTORS[name] = fn
+        return fn
+    return wrap
+
+
+def get_roi_detector(name):
+    if name not in ROI_DETECTORS:
+        raise ValueError(f"unknown ROI detector {name!r}, choose from {sorted(ROI_DETECTORS)}")
+    return ROI_DETECTORS[name]
+
+
+@register_roi("none")
+def full_frame(frames):
+    return 0, 0, frames.shape[-2], frames.shape[-1]
+
+
+def skin_mask(frames):
+    # seuils classiques en YCbCr (Chai & Ngan) sur des frames uint8
+    rgb = frames.float()
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    cb = 128 - 0.168736 * r - 0.331264 * g + 0.5 * b
+    cr = 128 + 0.5 * r - 0.418688 * g - 0.081312 * b
+    return ((cb >= 77) & (cb <= 127) & (cr >= 133) & (cr <= 173)).float()
+
+
+def _square_box(x0, y0, x1, y1, full_height, full_width, margin, min_frac):
+    side = max(x1 - x0, y1 - y0) * (1 + 2 * margin)
+    side = max(side, min_frac * min(full_height, full_width))
+    side = int(min(side, full_height, full_width))
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    x = int(min(max(cx - side / 2, 0), full_width - side))
+    y = int(min(max(cy - side / 2, 0), full_height - side))
+    return x, y, side, side
+
+
+@register_roi("saliency")
+def saliency_roi(frames, work_size=64, quantile=0.9, margin=0.25, min_frac=0.3):
+    """
+    Carte de saillance = mouvement moyen entre frames consecutives + masque
+    de peau, calculee en basse resolution. La boite englobe les pixels au-dessus
+    du quantile, elargie de `margin` et rendue carree.
+    """
+    full_height, full_width = frames.shape[-2], frames.shape[-1]
+    small = F.interpolate(frames.float(), size=(work_size, work_size), mode="area")
+    heat = skin_mask(small).mean(0)
+    if small.shape[0] > 1:
+        motion = (small[1:] - small[:-1]).abs().mean(dim=(0, 1))
+        heat = heat + motion / (motion.max() + 1e-6)
+    if heat.max() <= 0:
+        return full_frame(frames)
+    mask = heat >= torch.quantile(heat.flatten(), quantile)
+    ys, xs = torch.nonzero(mask, as_tuple=True)
+    sy, sx = full_height / work_size, full_width / work_size
+    x0, x1 = xs.min().item() * sx, (xs.max().item() + 1) * sx
+    y0, y1 = ys.min().item() * sy, (ys.max().item() + 1) * sy
+    return _square_box(x0, y0, x1, y1, full_height, full_width, margin, min_frac)
+
+
+def crop_resize(frames, size, box):
+    x, y, height, width = box
+    return resize_data(frames, size, size, x=x, y=y, height=height, width=width)
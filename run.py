@@ -16,6 +16,8 @@ import wandb
 
 from PIL import Image
 import torchvision.transforms.v2 as transforms
+from dataset import resize_data, smart_resize
+from models import EnhancedCNN4_3D
 
 # UTILITIES
 
@@ -35,55 +37,6 @@ def extract_frames(video_path, nb_frames=10, delta=1, timeit=False):
         print(f"read: {t2-t1}")
     return video[0]
 
-def smart_resize(data, size): # kudos louis
-    # Prends un tensor de shape [...,C,H,W] et le resize en [...C,size,size]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-
-    if full_height > full_width:
-        alt_height = size
-        alt_width = int(full_width / (full_height / size))
-    elif full_height < full_width:
-        alt_height = int(full_height / (full_width / size))
-        alt_width = size
-    else:
-        alt_height = size
-        alt_width = size
-    tr = transforms.Compose([
-        transforms.Resize((alt_height, alt_width)),
-        transforms.CenterCrop(size)
-    ])
-    return tr(data)
-
-def resize_data(data, new_height, new_width, x=0, y=0, height=None, width=None):
-    # Prends un tensor de shape [...,C,H,W] et le resize en [C,new_height,new_width]
-    # x, y, height et width servent a faire un crop avant de resize
-
-    full_height = data.shape[-2]
-    full_width = data.shape[-1]
-    height = full_height - y if height is None else height
-    width = full_width -x if width is None else width
-
-    ratio = new_height/new_width
-    if height/width > ratio:
-        expand_height = height
-        expand_width = int(height / ratio)
-    elif height/width < ratio:
-        expand_height = int(width * ratio)
-        expand_width = width
-    else:
-        expand_height = height
-        expand_width = width
-    tr = transforms.Compose([
-        transforms.CenterCrop((expand_height, expand_width)),
-        transforms.Resize((new_height, new_width))
-    ])
-    x = data[...,y:min(y+height, full_height), x:min(x+width, full_width)].clone()
-    return tr(x)
-
-
 # SETUP DATASET
 
 dataset_dir = "/raid/datasets/hackathon2024"
@@ -224,74 +177,6 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-class EnhancedCNN4_3D(nn.Module):
-    def __init__(self):
-        super(EnhancedCNN4_3D, self).__init__()
-        in_channels = 3
-        out_channels = 32
-        k_size = (3, 3, 3)  # Kernel size now includes time dimension
-        stride_ = (1, 1, 1)  # Stride now includes time dimension
-        padding_ = (1, 1, 1)  # Padding now includes time dimension
-        pool_k_size = (1, 2, 2)  # Pooling in the time dimension remains 1
-        pool_stride = (1, 2, 2)  # Pooling stride in the time dimension
-        pool_padding = (0, 0, 0)  # Pool padding
-        dropout_rate = 0.5
-
-        # Convolutional and BatchNorm layers now use 3D
-        self.conv1 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
-        self.bn1 = nn.BatchNorm3d(out_channels)
-
-        in_channels = out_channels
-        out_channels *= 2  # Doubling the output channels with each layer
-
-        self.conv2 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
-        self.bn2 = nn.BatchNorm3d(out_channels)
-        self.pool1 = nn.MaxPool3d(kernel_size=pool_k_size, stride=pool_stride, padding=pool_padding)
-
-        in_channels = out_channels
-        out_channels *= 2
-
-        self.conv3 = nn.Conv3d(in_channels, out_channels, kernel_size=k_size, stride=stride_, padding=padding_)
-        self.bn3 = nn.BatchNorm3d(out_channels)
-
-        in_channels = out_channels
-        out_channels *= 2
-
-        self.pool2 = nn.MaxPool3d(kernel_size=pool_k_size, stride=pool_stride)
-
-        # Assuming input depth is 10 frames and each frame is 256x256 pixels
-        # This would need to be adjusted based on actual input size
-        input_frames = 10
-        dim = 256  # Initial dimension of the data in height and width
-        for _ in range(2):  # Two pooling layers
-            input_frames = (input_frames - pool_k_size[0] + 2 * pool_padding[0]) // pool_stride[0] + 1
-            dim = (dim - pool_k_size[1] + 2 * pool_padding[1]) // pool_stride[1] + 1
-            dim = (dim - pool_k_size[2] + 2 * pool_padding[2]) // pool_stride[2] + 1
-
-        self.dropout = nn.Dropout(dropout_rate)
-        self.fc = nn.Linear(5242880, 1024)  # Adjusting for 3D volume
-        self.fc2 = nn.Linear(1024, 1)  # Number of classes
-
-    def forward(self, x):
-        
-
-        x = F.relu(self.bn1(self.conv1(x)))
-        
-        x = self.pool1(F.relu(self.bn2(self.conv2(x))))
-        
-        x = self.pool2(F.relu(self.bn3(self.conv3(x))))
-        
-        
-        x = torch.flatten(x, 1)
-        
-        
-        x = self.dropout(x)
-        x = F.relu(self.fc(x))
-        x = F.relu(self.fc2(x))
-        x = F.sigmoid(x)
-        return x
-
-
 # LOGGING
 
 wandb.login(key="b15da3ba051c5858226f1d6b28aee6534682d044")
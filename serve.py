@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# SERVICE DE SCORING
+# Garde un modele du registre charge en memoire et score des videos a la demande.
+# Les videos (chemins ou octets mp4) sont decodees par un pool de threads puis
+# regroupees en batchs dynamiques : un batch part des qu'il est plein ou que le
+# plus ancien element a attendu max_latency_ms.
+#
+#   python serve.py serve --model unetv4 --checkpoint model.safetensors --port 8000
+#   python serve.py loadtest --url http://127.0.0.1:8000 --videos /raid/datasets/hackathon2024/test_dataset
+#
+# POST /score   {"paths": ["a.mp4", ...]}  ou le corps brut d'un mp4 (Content-Type: video/mp4)
+#               -> {"fake_probability": [p, ...]} dans l'ordre des videos ; 400 si la requete est invalide
+# GET  /metrics latences p50/p99, debit, taille moyenne des batchs
+
+import argparse
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+from dataset import extract_frames, nb_frames, pad_frames, smart_resize
+from models import MODELS, build_model, load_registered, predict_proba
+
+
+def decode_video(video, size=256):
+    # video : chemin ou octets ; renvoie [nb_frames, 3, size, size] dans [0, 1]
+    # une video courte est completee ici : torch.stack du batch ne peut pas
+    # echouer pour tout le batch a cause d'une seule video
+    if isinstance(video, (bytes, bytearray)):
+        with tempfile.NamedTemporaryFile(suffix=".mp4") as f:
+            f.write(video)
+            f.flush()
+            frames = extract_frames(f.name, nb_frames=nb_frames)
+    else:
+        frames = extract_frames(video, nb_frames=nb_frames)
+    return pad_frames(smart_resize(frames, size), nb_frames) / 255
+
+
+class Metrics:
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.start = time.time()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.count += 1
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batch_sizes.append(size)
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self):
+        with self.lock:
+            lat = np.array(self.latencies) * 1000
+            elapsed = time.time() - self.start
+            return {
+                "count": self.count,
+                "errors": self.errors,
+                "throughput": self.count / elapsed if elapsed > 0 else 0.0,
+                "p50_ms": float(np.percentile(lat, 50)) if len(lat) else None,
+                "p99_ms": float(np.percentile(lat, 99)) if len(lat) else None,
+                "mean_batch": float(np.mean(self.batch_sizes)) if self.batch_sizes else None,
+            }
+
+
+class Scorer:
+    """
+    Decodage dans un pool de threads, inference dans un seul thread qui
+    construit les batchs dynamiquement.
+    """
+    def __init__(self, name, model, device, max_batch=16, max_latency_ms=20, decode_workers=4):
+        self.name = name
+        self.model = model.to(device).eval()
+        self.device = device
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self.size = 256
+        self.pool = ThreadPoolExecutor(max_workers=decode_workers)
+        self.queue = queue.Queue()
+        self.metrics = Metrics()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, video):
+        # renvoie un Future qui donnera la proba "fake" de la video
+        result = Future()
+        t0 = time.time()
+
+        def decoded(f):
+            try:
+                self.queue.put((f.result(), result, t0))
+            except Exception as e:
+                self.metrics.record_error()
+                result.set_exception(e)
+
+        self.pool.submit(decode_video, video, self.size).add_done_callback(decoded)
+        return result
+
+    def _next_batch(self):
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            videos, futures, starts = zip(*batch)
+            try:
+                X = torch.stack(videos).to(self.device)
+                with torch.inference_mode():
+                    probs = predict_proba(self.name, self.model, X).float().cpu().tolist()
+            except Exception as e:
+                for f in futures:
+                    self.metrics.record_error()
+                    f.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch))
+            now = time.time()
+            for f, p, t0 in zip(futures, probs, starts):
+                self.metrics.record(now - t0)
+                f.set_result(p)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.pool.shutdown()
+
+
+def make_handler(scorer):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._reply(200, scorer.metrics.summary())
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                videos = self._videos()
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+                return
+            futures = [scorer.submit(v) for v in videos]
+            try:
+                # une proba par video, dans l'ordre de la requete (doublons compris)
+                results = [f.result() for f in futures]
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"fake_probability": results})
+
+        def _videos(self):
+            # corps de la requete -> liste de chemins ou d'octets, ValueError si invalide
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                raise ValueError("invalid Content-Length")
+            body = self.rfile.read(length)
+            if not self.headers.get("Content-Type", "").startswith("application/json"):
+                if not body:
+                    raise ValueError("empty body")
+                return [body]
+            try:
+                payload = json.loads(body)
+            except ValueError as e:
+                raise ValueError(f"malformed JSON: {e}")
+            paths = payload.get("paths") if isinstance(payload, dict) else None
+            if not isinstance(paths, list) or not paths or not all(isinstance(v, str) for v in paths):
+                raise ValueError('expected {"paths": [non-empty list of strings]}')
+            missing = [v for v in paths if not os.path.isfile(v)]
+            if missing:
+                raise ValueError(f"no such file: {missing}")
+            return paths
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(args):
+    device = torch.device(args.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    if args.checkpoint:
+        model = load_registered(args.model, args.checkpoint, device)
+    else:
+        print("No checkpoint given, serving untrained weights")
+        model = build_model(args.model, pretrained=False)
+    scorer = Scorer(args.model, model, device, max_batch=args.max_batch,
+                    max_latency_ms=args.max_latency_ms, decode_workers=args.decode_workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(scorer))
+    print(f"Serving {args.model} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scorer.close()
+
+
+def loadtest(args):
+    import requests
+
+    if os.path.isdir(args.videos):
+        paths = [os.path.join(args.videos, f) for f in sorted(os.listdir(args.videos)) if f.endswith(".mp4")]
+    else:
+        paths = [args.videos]
+    paths = [os.path.abspath(p) for p in paths]
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        t0 = time.time()
+        r = requests.post(f"{args.url}/score", json={"paths": [paths[i % len(paths)]]})
+        r.raise_for_status()
+        with lock:
+            latencies.append(time.time() - t0)
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.time() - t0
+    lat = np.array(latencies) * 1000
+    print(f"requests: {len(lat)}  concurrency: {args.concurrency}")
+    print(f"throughput: {len(lat) / elapsed:.1f} videos/s")
+    print(f"p50: {np.percentile(lat, 50):.1f} ms  p99: {np.percentile(lat, 99):.1f} ms")
+    print("server:", requests.get(f"{args.url}/metrics").json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("serve")
+    p.add_argument("--model", choices=sorted(MODELS), required=True)
+    p.add_argument("--checkpoint")
+    p.add_argument("--device")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--max-batch", type=int, default=16)
+    p.add_argument("--max-latency-ms", type=float, default=20)
+    p.add_argument("--decode-workers", type=int, default=4)
+    p = sub.add_parser("loadtest")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--videos", required=True)
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        loadtest(args)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# SHARDS COMPRESSES
+# Un clip uint8 [10, 3, 256, 256] brut fait 1.97 Mo (voir test.pt) : le cache de
+# train fait des dizaines de Go et les epochs attendent /raid. Ici chaque frame
+# est stockee en JPEG (ou WebP) de qualite reglable, toutes les frames d'un
+# split dans un seul frames.bin + un index.pt (offsets). ~10x plus petit : tient
+# en page cache ou sur le disque local. Les batchs sont decodes d'un coup avec
+# torchvision.io.decode_jpeg, sur CPU dans les workers ou sur le device.
+#
+#   python shards.py build --src /raid/datasets/hackathon2024/resized_dataset --out /tmp/jpeg_dataset --quality 90
+#   python shards.py bench --raw /raid/datasets/hackathon2024/resized_dataset --shards /tmp/jpeg_dataset
+
+import argparse
+import io as _io
+import os
+import time
+
+import numpy as np
+import torch
+import torchvision
+import torchvision.io as io
+from PIL import Image
+from tqdm import tqdm
+
+from buffers import pooled_loader
+from dataset import VideoDataset, resize_data, resized_dir
+from preprocess import copy_metadata, SPLITS
+
+FORMATS = ["jpeg", "webp"]
+
+# decode_jpeg accepte une liste (et device=) a partir de torchvision 0.19
+_BATCHED_JPEG = tuple(int(v) for v in torchvision.__version__.split("+")[0].split(".")[:2]) >= (0, 19)
+
+
+def encode_frame(frame, fmt="jpeg", quality=90):
+    # frame uint8 [3, H, W] -> octets
+    if fmt == "jpeg":
+        return io.encode_jpeg(frame.contiguous(), quality=quality).numpy().tobytes()
+    buf = _io.BytesIO()
+    Image.fromarray(frame.permute(1, 2, 0).numpy()).save(buf, format="WEBP", quality=quality)
+    return buf.getvalue()
+
+
+def decode_frames(frames, fmt="jpeg", device="cpu"):
+    # liste d'octets -> liste de [3, H, W] uint8, en un appel quand c'est possible
+    if fmt == "jpeg":
+        data = [torch.frombuffer(bytearray(f), dtype=torch.uint8) for f in frames]
+        if _BATCHED_JPEG:
+            return io.decode_jpeg(data, device=device)
+        return [io.decode_jpeg(d, device=device) for d in data]
+    # WebP : pas de decodeur torchvision, PIL sur CPU
+    return [torch.from_numpy(np.asarray(Image.open(_io.BytesIO(f)).convert("RGB"))).permute(2, 0, 1).to(device)
+            for f in frames]
+
+
+def build_shards(src_dir, out_dir, splits=SPLITS, fmt="jpeg", quality=90):
+    """
+    Convertit un cache de .pt (preprocess.py) en out_dir/{split}_dataset/frames.bin
+    + index.pt, sans re-decoder les mp4.
+    """
+    for split in splits:
+        src_split = os.path.join(src_dir, f"{split}_dataset")
+        out_split = os.path.join(out_dir, f"{split}_dataset")
+        os.makedirs(out_split, exist_ok=True)
+        index = {"format": fmt, "quality": quality, "videos": {}}
+        raw, packed = 0, 0
+        with open(os.path.join(out_split, "frames.bin"), 'wb') as out:
+            for f in tqdm(sorted(f for f in os.listdir(src_split) if f.endswith('.pt')), desc=split):
+                video = torch.load(os.path.join(src_split, f))
+                entries = []
+                for frame in video:
+                    data = encode_frame(frame, fmt, quality)
+                    entries.append((out.tell(), len(data)))
+                    out.write(data)
+                index["videos"][f] = entries
+                raw += video.nbytes
+                packed += sum(n for _, n in entries)
+        torch.save(index, os.path.join(out_split, "index.pt"))
+        print(f"{split}: {raw / 2**30:.2f} GiB -> {packed / 2**30:.2f} GiB ({raw / max(packed, 1):.1f}x)")
+    copy_metadata(src_dir, out_dir)
+
+
+class ShardDataset(VideoDataset):
+    """
+    VideoDataset sur un cache de shards (build_shards). device="cuda" decode
+    sur le GPU : a utiliser sans worker (num_workers=0), les batchs sortent deja
+    sur le device.
+    """
+    def __init__(self, root_dir, dataset_choice="train", nb_frames=10, size=256, device="cpu", **kwargs):
+        self.index = None
+        self.device = device
+        self._file = None
+        self._pid = None
+        super().__init__(root_dir, dataset_choice, nb_frames, source="pt", size=size, **kwargs)
+
+    def list_files(self):
+        if self.index is None:
+            self.index = torch.load(os.path.join(self.root_dir, "index.pt"))
+        return sorted(self.index["videos"])
+
+    def _bytes(self, key, frames):
+        # un descripteur par process (les workers sont forkes)
+        if self._pid != os.getpid():
+            self._file = open(os.path.join(self.root_dir, "frames.bin"), 'rb')
+            self._pid = os.getpid()
+        entries = self.index["videos"][key]
+        return [os.pread(self._file.fileno(), entries[i][1], entries[i][0]) for i in frames]
+
+    def _frames(self, key):
+        # seules les frames tirees (voir VideoDataset.frame_indices) sont decodees
+        total = len(self.index["videos"][key])
+        return self.frame_indices(total) if total > self.nb_frames else list(range(total))
+
+    def _fit(self, video):
+        if video.shape[-2:] != (self.size, self.size):
+            video = resize_data(video, self.size, self.size)
+        return video
+
+    def _read(self, video_path, out=None, data=None):
+        key = os.path.basename(video_path)
+        data = self._bytes(key, self._frames(key))
+        video = self._fit(torch.stack(decode_frames(data, self.index["format"], self.device)))
+        if out is None:
+            return video
+        # read() complete une video trop courte
+        return out[:len(video)].copy_(video)
+
+    def read_batch(self, indices, out=None):
+        """
+        Decode tout le batch en un appel : [B, T, 3, S, S] uint8, ecrit dans
+        `out` sur CPU, ou un nouveau tenseur sur le device.
+        """
+        frames, counts = [], []
+        for idx in indices:
+            key = self.key(idx)
+            data = self._bytes(key, self._frames(key))
+            frames += data
+            counts.append(len(data))
+        decoded = decode_frames(frames, self.index["format"], self.device)
+        videos, i = [], 0
+        for n in counts:
+            video = self._fit(torch.stack(decoded[i:i + n]))
+            if n < self.nb_frames:
+                # video trop courte : on repete la derniere frame
+                video = torch.cat([video, video[-1:].expand(self.nb_frames - n, *video.shape[1:])])
+            videos.append(video)
+            i += n
+        if out is None or self.device != "cpu":
+            return torch.stack(videos)
+        return torch.stack(videos, out=out)
+
+
+def epoch_time(dataset, batch_size, num_workers):
+    loader = pooled_loader(dataset, batch_size, shuffle=True, num_workers=num_workers)
+    t1 = time.time()
+    n = 0
+    for X, label, ID in tqdm(loader, leave=False):
+        n += len(ID)
+    return time.time() - t1, n
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="convertit un cache de .pt en shards")
+    p.add_argument("--src", default=resized_dir)
+    p.add_argument("--out", required=True)
+    p.add_argument("--splits", nargs="+", default=SPLITS, choices=SPLITS)
+    p.add_argument("--format", default="jpeg", choices=FORMATS)
+    p.add_argument("--quality", type=int, default=90)
+
+    p = sub.add_parser("bench", help="temps d'une epoch, cache brut contre shards")
+    p.add_argument("--raw", default=resized_dir)
+    p.add_argument("--shards", required=True)
+    p.add_argument("--split", default="train")
+    p.add_argument("--batch-size", type=int, default=32)
+    p.add_argument("--num-workers", type=int, default=8)
+    p.add_argument("--device", default="cpu", help="cuda : decode_jpeg sur le GPU (sans worker)")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_shards(args.src, args.out, args.splits, args.format, args.quality)
+    else:
+        split = f"{args.split}_dataset"
+        raw = VideoDataset(args.raw, dataset_choice=args.split)
+        shards = ShardDataset(args.shards, dataset_choice=args.split, device=args.device)
+        workers = 0 if args.device != "cpu" else args.num_workers
+        for name, ds, w, path in [("raw", raw, args.num_workers, os.path.join(args.raw, split)),
+                                  ("shards", shards, workers, os.path.join(args.shards, split))]:
+            seconds, n = epoch_time(ds, args.batch_size, w)
+            print(f"{name:7s} {dir_size(path) / 2**30:6.2f} GiB  epoch {seconds:6.1f}s  {n / seconds:7.1f} videos/s")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# LANCEMENT SLURM
+# run, runlinear et runddp codent en dur une ligne srun par modele, et le
+# preprocessing n'a rien pour le cluster. Ici un fichier YAML (slurm.yaml)
+# decrit les options Slurm communes et les jobs ; on en tire les lignes srun,
+# les scripts sbatch, ou on soumet tout le pipeline :
+#   - preprocess : job array, chaque tache construit un shard du cache
+#     (preprocess.py --num-shards N, shard = SLURM_ARRAY_TASK_ID, partition par
+#     hash du nom de video) ;
+#   - merge : preprocess.py --merge, apres le array (afterok), assemble manifest.json ;
+#   - les jobs d'entrainement, apres le merge.
+# L'executeur local lance les memes shards en sous-process (meme variable
+# SLURM_ARRAY_TASK_ID), puis le merge et les jobs : tout le pipeline se teste
+# sur une machine Linux sans Slurm.
+#
+#   python slurm.py slurm.yaml render                 (lignes srun, comme ./run)
+#   python slurm.py slurm.yaml render --sbatch preprocess
+#   python slurm.py slurm.yaml submit preprocess unetv4
+#   python slurm.py slurm.yaml local preprocess --parallel 4
+
+import argparse
+import os
+import shlex
+import subprocess
+import time
+
+import yaml
+
+# options communes des scripts run / runlinear
+SLURM_DEFAULTS = {
+    "partition": "interactive10", "gres": "gpu:1g.10gb:1", "ntasks": 1, "cpus-per-task": 4,
+    "reservation": "hackathon", "time": "1:00:00", "signal": "USR1@120",
+}
+
+
+def _options(options):
+    # cpus_per_task (YAML) et cpus-per-task (sbatch) : une seule cle par option
+    return {k.replace("_", "-"): v for k, v in (options or {}).items()}
+
+
+def load_config(path):
+    """
+    Lit le YAML et renvoie {nom : job}. Un job a `command` (liste ou chaine),
+    `slurm` (options, None pour en retirer une) et eventuellement `array`
+    (nombre de taches) et `after` (jobs dont il depend). La section
+    `preprocess` donne les deux jobs preprocess (array) et merge.
+    """
+    with open(path, 'r') as file:
+        config = yaml.safe_load(file)
+    # chaque couche est normalisee avant la fusion : la plus specifique gagne
+    defaults = dict(_options(SLURM_DEFAULTS), **_options(config.get("slurm")))
+    jobs = {}
+    pre = config.get("preprocess")
+    if pre:
+        args = shlex.split(pre["args"]) if isinstance(pre["args"], str) else list(pre["args"])
+        shards = int(pre.get("shards", 1))
+        command = ["python", "preprocess.py"] + args
+        jobs["preprocess"] = {"command": command + ["--num-shards", str(shards)], "array": shards,
+                              "slurm": pre.get("slurm") or {}, "after": []}
+        jobs["merge"] = {"command": command + ["--num-shards", str(shards), "--merge"],
+                         "slurm": pre.get("slurm") or {}, "after": ["preprocess"]}
+    for name, job in (config.get("jobs") or {}).items():
+        command = job["command"]
+        job = dict(job, command=shlex.split(command) if isinstance(command, str) else list(command))
+        # par defaut un entrainement attend le cache du pipeline
+        job.setdefault("after", ["merge"] if pre else [])
+        jobs[name] = job
+    for job in jobs.values():
+        options = dict(defaults, **_options(job.get("slurm")))
+        job["slurm"] = {k: v for k, v in options.items() if v is not None}
+    return jobs
+
+
+def slurm_flags(options):
+    return [f"--{k}={v}" for k, v in options.items()]
+
+
+def render_srun(job):
+    # une ligne comme dans ./run ; un array devient une boucle shell sur les taches
+    line = shlex.join(["srun"] + slurm_flags(job["slurm"]) + job["command"])
+    if job.get("array"):
+        return f"for i in $(seq 0 {job['array'] - 1}); do SLURM_ARRAY_TASK_ID=$i {line} & done; wait"
+    return line
+
+
+def batch_options(options):
+    # sans srun, le signal doit viser le shell batch (B:), sinon Slurm ne
+    # l'envoie qu'aux job steps et il n'arrive jamais au process python
+    signal = options.get("signal")
+    if signal is not None and not str(signal).startswith("B:"):
+        options = dict(options, signal=f"B:{signal}")
+    return options
+
+
+def render_sbatch(name, job, log_dir="logs"):
+    # plusieurs taches (DDP) : srun les lance et recoit le signal, sinon python
+    # remplace le shell batch
+    multi = int(job["slurm"].get("ntasks", 1)) > 1
+    lines = ["#!/bin/sh", f"#SBATCH --job-name={name}"]
+    lines += [f"#SBATCH {flag}" for flag in slurm_flags(job["slurm"] if multi else batch_options(job["slurm"]))]
+    if job.get("array"):
+        lines.append(f"#SBATCH --array=0-{job['array'] - 1}")
+        lines.append(f"#SBATCH --output={log_dir}/%x_%A_%a.out")
+    else:
+        lines.append(f"#SBATCH --output={log_dir}/%x_%j.out")
+    # exec : python (ou srun, qui relaie aux taches) remplace le shell batch
+    lines.append("exec " + shlex.join((["srun"] if multi else []) + job["command"]))
+    return "\n".join(lines) + "\n"
+
+
+def selected(jobs, names):
+    # ordre du fichier, avec les dependances presentes dans la selection
+    names = names or list(jobs)
+    unknown = [n for n in names if n not in jobs]
+    if unknown:
+        raise KeyError(f"unknown jobs {unknown}, available: {sorted(jobs)}")
+    if "preprocess" in names and "merge" in jobs and "merge" not in names:
+        names = names + ["merge"]
+    return [n for n in jobs if n in names]
+
+
+def submit(jobs, names, script_dir="slurm_jobs", log_dir="logs", dry_run=False):
+    """
+    Ecrit un script sbatch par job et les soumet dans l'ordre, avec
+    --dependency=afterok sur les jobs soumis dont il depend. Renvoie {nom : id}.
+    """
+    os.makedirs(script_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+    ids = {}
+    for name in selected(jobs, names):
+        job = jobs[name]
+        path = os.path.join(script_dir, f"{name}.sbatch")
+        with open(path, 'w') as file:
+            file.write(render_sbatch(name, job, log_dir))
+        cmd = ["sbatch", "--parsable"]
+        after = [ids[a] for a in job.get("after", []) if a in ids]
+        if after:
+            cmd.append("--dependency=afterok:" + ":".join(after))
+        cmd.append(path)
+        if dry_run:
+            print(shlex.join(cmd))
+            ids[name] = f"<{name}>"
+            continue
+        # --parsable : "id" ou "id;cluster"
+        ids[name] = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip().split(";")[0]
+        print(f"{name}: job {ids[name]} ({path})")
+    return ids
+
+
+def run_local(jobs, names, parallel=1, log_dir="logs"):
+    """
+    Execute les jobs ici, dans l'ordre : les taches d'un array en
+    sous-process (au plus `parallel` a la fois) avec les variables SLURM_*
+    qu'aurait posees Slurm. S'arrete au premier job en echec, comme afterok.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    for name in selected(jobs, names):
+        job = jobs[name]
+        t1 = time.time()
+        tasks = list(range(job["array"])) if job.get("array") else [None]
+        running, failed = [], []
+        for task in tasks:
+            env = dict(os.environ, SLURM_CPUS_PER_TASK=str(job["slurm"].get("cpus-per-task", 1)))
+            log = f"{name}.out" if task is None else f"{name}_{task}.out"
+            if task is not None:
+                env.update(SLURM_ARRAY_TASK_ID=str(task), SLURM_ARRAY_TASK_COUNT=str(len(tasks)))
+            while len(running) >= parallel:
+                failed += _reap(running)
+            file = open(os.path.join(log_dir, log), 'w')
+            running.append((task, subprocess.Popen(job["command"], env=env, stdout=file, stderr=subprocess.STDOUT), file))
+        while running:
+            failed += _reap(running)
+        if failed:
+            raise RuntimeError(f"{name}: tasks {sorted(failed, key=str)} failed, see {log_dir}/")
+        print(f"{name}: {len(tasks)} task(s) done in {time.time() - t1:.1f}s")
+
+
+def _reap(running):
+    # attend la fin d'au moins une tache, renvoie celles en echec
+    while True:
+        done = [r for r in running if r[1].poll() is not None]
+        if done:
+            break
+        time.sleep(0.2)
+    failed = []
+    for r in done:
+        running.remove(r)
+        r[2].close()
+        if r[1].returncode != 0:
+            failed.append(r[0])
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="fichier YAML (voir slurm.yaml)")
+    parser.add_argument("action", choices=["render", "submit", "local"])
+    parser.add_argument("jobs", nargs="*", help="jobs a lancer (defaut : tous)")
+    parser.add_argument("--sbatch", action="store_true", help="render : scripts sbatch au lieu des lignes srun")
+    parser.add_argument("--dry-run", action="store_true", help="submit : affiche les commandes sbatch sans soumettre")
+    parser.add_argument("--parallel", type=int, default=os.cpu_count() // 4 or 1,
+                        help="local : taches d'un array lancees en meme temps")
+    parser.add_argument("--log-dir", default="logs")
+    args = parser.parse_intermixed_args()
+
+    jobs = load_config(args.config)
+    if args.action == "render":
+        for name in selected(jobs, args.jobs):
+            print(render_sbatch(name, jobs[name], args.log_dir) if args.sbatch else f"# {name}\n{render_srun(jobs[name])}")
+    elif args.action == "submit":
+        submit(jobs, args.jobs, log_dir=args.log_dir, dry_run=args.dry_run)
+    else:
+        run_local(jobs, args.jobs, args.parallel, args.log_dir)
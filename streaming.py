@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# INFERENCE EN STREAMING
+# Decode la video au fil de l'eau et produit des fenetres glissantes de
+# `window` frames (pas de `stride` frames). Chaque fenetre est scoree des
+# qu'elle est complete et le score de la video est agrege en ligne ; on
+# s'arrete des que la moyenne est nettement au-dessus/en-dessous du seuil.
+# La memoire ne depend que de `window`, pas de la longueur de la video.
+#
+#   python streaming.py --model cnn3d --checkpoint model.safetensors --videos test_dataset/
+
+import argparse
+import csv
+import os
+from collections import deque
+
+import torch
+import torchvision.io as io
+from tqdm import tqdm
+
+import quarantine
+from dataset import smart_resize
+from models import MODELS, load_registered, predict_proba
+
+
+def iter_windows(video_path, window=10, stride=5, size=256, frame_step=1):
+    """
+    Generateur de fenetres [window, 3, size, size] dans [0, 1].
+    frame_step permet de ne garder qu'une frame sur n avant de fenetrer.
+    Une video plus courte que `window` donne une seule fenetre completee en
+    repetant la derniere frame ; sans aucune frame, ValueError.
+    """
+    reader = io.VideoReader(video_path, "video")
+    frames = deque(maxlen=window)
+    kept = 0
+    next_at = window
+    for i, frame in enumerate(reader):
+        if i % frame_step:
+            continue
+        # on redimensionne frame par frame, la pleine resolution n'est jamais empilee
+        frames.append(smart_resize(frame["data"], size))
+        kept += 1
+        if kept == next_at:
+            next_at += stride
+            yield torch.stack(tuple(frames)) / 255
+    if kept == 0:
+        raise ValueError(f"no frames decoded from {video_path}")
+    if kept < window:
+        # comme buffers.py pour les videos trop courtes
+        yield torch.stack(list(frames) + [frames[-1]] * (window - kept)) / 255
+
+
+class OnlineAggregator:
+    # moyenne et max glissants des scores de fenetres, avec arret anticipe
+    def __init__(self, threshold=0.5, margin=0.35, min_windows=3):
+        self.threshold = threshold
+        self.margin = margin
+        self.min_windows = min_windows
+        self.n = 0
+        self.mean = 0.0
+        self.max = 0.0
+
+    def update(self, score):
+        self.n += 1
+        self.mean += (score - self.mean) / self.n
+        self.max = max(self.max, score)
+
+    def confident(self):
+        if self.n < self.min_windows:
+            return False
+        return abs(self.mean - self.threshold) >= self.margin
+
+
+def stream_score(name, model, video_path, device, window=10, stride=5, frame_step=1,
+                 threshold=0.5, margin=0.35, min_windows=3, max_windows=None):
+    agg = OnlineAggregator(threshold, margin, min_windows)
+    stopped_early = False
+    with torch.inference_mode():
+        for clip in iter_windows(video_path, window, stride, MODELS[name]["size"], frame_step):
+            score = predict_proba(name, model, clip.unsqueeze(0).to(device)).item()
+            agg.update(score)
+            if agg.confident():
+                stopped_early = True
+                break
+            if max_windows is not None and agg.n >= max_windows:
+                break
+    return {"score": agg.mean, "max": agg.max, "windows": agg.n, "stopped_early": stopped_early}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=sorted(MODELS), required=True)
+    parser.add_argument("--checkpoint", required=True)
+    parser.add_argument("--videos", required=True)
+    parser.add_argument("--window", type=int, default=10)
+    parser.add_argument("--stride", type=int, default=5)
+    parser.add_argument("--frame-step", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--margin", type=float, default=0.35)
+    parser.add_argument("--min-windows", type=int, default=3)
+    parser.add_argument("--max-windows", type=int)
+    parser.add_argument("--dataset-csv", help="dataset.csv pour retrouver les id de la submission")
+    parser.add_argument("--output", default="submission_streaming.csv")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_registered(args.model, args.checkpoint, device)
+    files = sorted(f for f in os.listdir(args.videos) if f.endswith(".mp4"))
+    ids = {}
+    if args.dataset_csv:
+        with open(args.dataset_csv, 'r') as file:
+            ids = {row[1]: row[0] for row in csv.reader(file)}
+    lines = ["id,label\n"]
+    early = 0
+    for f in tqdm(files):
+        try:
+            res = stream_score(args.model, model, os.path.join(args.videos, f), device,
+                               window=args.window, stride=args.stride, frame_step=args.frame_step,
+                               threshold=args.threshold, margin=args.margin, min_windows=args.min_windows,
+                               max_windows=args.max_windows)
+        except ValueError as e:
+            # video vide : sa ligne garde la prediction par defaut
+            print(e)
+            res = {"score": quarantine.default_proba, "stopped_early": False}
+        early += res["stopped_early"]
+        lines.append(f"{ids.get(f, f[:-4])},{int(res['score'] > args.threshold)}\n")
+    print(f"stopped early on {early}/{len(files)} videos")
+    with open(args.output, "w") as file:
+        file.writelines(lines)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# SWEEP
+# Explorer lr / weight_decay / seed voulait dire copier un script, changer
+# lr=0.001 et lancer un job Slurm de plus qui recharge tout le dataset. Ici un
+# fichier YAML decrit plusieurs petits essais qui tournent ensemble dans un seul
+# process, sur un seul flux de donnees : chaque batch est lu, decode et copie
+# sur le GPU une fois pour tous les essais.
+# Les modeles sont empiles avec torch.func.stack_module_state et executes d'un
+# coup avec vmap ; les running stats des BatchNorm sont empilees aussi (une par
+# essai). Si vmap echoue sur le modele, les essais passent a tour de role sur le
+# meme batch. Un essai qui diverge (NaN, attendu avec un grand lr) est gele et
+# marque "diverged" sans arreter les autres.
+#
+#   python sweep.py sweep.yaml
+
+import argparse
+import copy
+import itertools
+import json
+import math
+import time
+
+import torch
+import torch.nn.functional as F
+import yaml
+from torch.func import functional_call, stack_module_state, vmap, replace_all_batch_norm_modules_
+from tqdm import tqdm
+
+from buffers import pooled_loader
+from dataset import VideoDataset, resized_dir
+from models import MODELS, build_model, prepare_input
+from prefetch import DevicePrefetcher
+from training import prepare_batch
+from validation import holdout_split
+
+DEFAULTS = {
+    "data_dir": resized_dir, "split": "experimental", "batch_size": 16, "epochs": 3, "num_workers": 4,
+    "holdout": 0.1, "holdout_subsample": None, "mode": "auto", "pretrained": True, "out": "sweep_results.json",
+}
+TRIAL_DEFAULTS = {"lr": 1e-3, "weight_decay": 0.0, "seed": 0}
+
+
+def load_config(path):
+    """
+    Lit le YAML et renvoie (config, essais). Les essais viennent de `trials`
+    (liste de dicts) et/ou de `grid` (produit cartesien des listes) ; chaque
+    essai a un nom, lr, weight_decay et seed.
+    """
+    with open(path, 'r') as file:
+        config = dict(DEFAULTS, **yaml.safe_load(file))
+    trials = [dict(t) for t in config.get("trials") or []]
+    grid = config.get("grid") or {}
+    if grid:
+        keys = sorted(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            trials.append(dict(zip(keys, values)))
+    if not trials:
+        trials = [{}]
+    for t in trials:
+        for k, v in TRIAL_DEFAULTS.items():
+            t[k] = float(t.get(k, v)) if k != "seed" else int(t.get(k, v))
+        t.setdefault("name", f"lr{t['lr']:g}_wd{t['weight_decay']:g}_s{t['seed']}")
+    return config, trials
+
+
+def _finite(p):
+    # la BCE refuse une entree NaN (assert sur CUDA) : on la remplace, l'essai est marque a part
+    return torch.where(torch.isfinite(p), p, torch.full_like(p, 0.5)).clamp(1e-6, 1 - 1e-6)
+
+
+def trial_loss(output, out, label):
+    # out : sortie du modele, label [B, 1] ; "sigmoid" -> BCE, "logits" -> 2 classes
+    # NaN si l'essai a diverge (cross_entropy propage deja le NaN sans erreur)
+    if output == "logits":
+        return F.cross_entropy(out, label.flatten().long())
+    p = out.float()
+    loss = F.binary_cross_entropy(_finite(p), label.float())
+    return torch.where(torch.isfinite(p).all(), loss, torch.full_like(loss, float("nan")))
+
+
+def trial_proba(output, out):
+    if output == "logits":
+        return torch.softmax(out, dim=-1)[..., 1]
+    return out.flatten(-2) if out.dim() > 1 else out
+
+
+class InterleavedTrials:
+    """Un modele et un optimizer par essai, chacun fait son pas sur le batch partage."""
+    def __init__(self, name, trials, device, pretrained=True):
+        self.output = MODELS[name]["output"]
+        self.models, self.optimizers = [], []
+        for t in trials:
+            torch.manual_seed(t["seed"])
+            model = build_model(name, pretrained).to(device)
+            self.models.append(model)
+            self.optimizers.append(torch.optim.Adam([p for p in model.parameters() if p.requires_grad],
+                                                    lr=t["lr"], weight_decay=t["weight_decay"]))
+        self.frozen = [False] * len(trials)
+
+    def train(self, mode=True):
+        for model in self.models:
+            model.train(mode)
+
+    def freeze(self, dead):
+        # essais diverges : plus de pas ni d'evaluation
+        self.frozen = [f or bool(d) for f, d in zip(self.frozen, dead.tolist())]
+
+    def step(self, X, label):
+        losses = []
+        for model, optimizer, frozen in zip(self.models, self.optimizers, self.frozen):
+            if frozen:
+                losses.append(torch.tensor(float("nan"), device=X.device))
+                continue
+            optimizer.zero_grad()
+            loss = trial_loss(self.output, model(X), label)
+            loss.backward()
+            optimizer.step()
+            losses.append(loss.detach())
+        return torch.stack(losses)
+
+    def proba(self, X):
+        return torch.stack([torch.full((len(X),), float("nan"), device=X.device) if frozen
+                            else trial_proba(self.output, model(X))
+                            for model, frozen in zip(self.models, self.frozen)])
+
+
+class VmapTrials:
+    """
+    Poids et buffers (running stats des BatchNorm comprises) de tous les essais
+    empiles ([N, ...]) et un seul forward vmap ; Adam est fait a la main pour
+    avoir un lr et un weight_decay par essai. batch_stats=True : BatchNorm en
+    stats du batch, sans running stats (replace_all_batch_norm_modules_).
+    """
+    def __init__(self, name, trials, device, pretrained=True, batch_stats=False):
+        self.output = MODELS[name]["output"]
+        models = []
+        for t in trials:
+            torch.manual_seed(t["seed"])
+            models.append(build_model(name, pretrained).to(device))
+        if batch_stats:
+            for m in models:
+                replace_all_batch_norm_modules_(m)
+        self.params, self.buffers = stack_module_state(models)
+        self.base = copy.deepcopy(models[0]).to("meta")
+        self.lr = torch.tensor([t["lr"] for t in trials], device=device)
+        self.weight_decay = torch.tensor([t["weight_decay"] for t in trials], device=device)
+        self.exp_avg = {k: torch.zeros_like(p) for k, p in self.params.items() if p.requires_grad}
+        self.exp_avg_sq = {k: torch.zeros_like(p) for k, p in self.params.items() if p.requires_grad}
+        self.t = 0
+
+    def train(self, mode=True):
+        self.base.train(mode)
+
+    def freeze(self, dead):
+        # un essai diverge garde ses poids NaN, isoles dans sa tranche ; lr nul
+        self.lr[dead.to(self.lr.device)] = 0
+
+    def check(self, X):
+        # forward d'essai en mode train (mise a jour des running stats empilees
+        # comprise) ; leve si vmap ne sait pas faire sur ce modele
+        saved = {k: b.clone() for k, b in self.buffers.items()}
+        try:
+            with torch.no_grad():
+                self.train(True)
+                self.proba(X)
+        finally:
+            for k, b in saved.items():
+                self.buffers[k].copy_(b)
+
+    def _forward(self, params, buffers, X):
+        return functional_call(self.base, (params, buffers), (X,))
+
+    def step(self, X, label):
+        def loss_one(params, buffers, X, label):
+            return trial_loss(self.output, self._forward(params, buffers, X), label)
+
+        losses = vmap(loss_one, in_dims=(0, 0, None, None), randomness="different")(
+            self.params, self.buffers, X, label)
+        # les essais sont independants : la somme donne a chacun son propre gradient
+        losses.sum().backward()
+        self._adam()
+        return losses.detach()
+
+    def _adam(self, beta1=0.9, beta2=0.999, eps=1e-8):
+        self.t += 1
+        with torch.no_grad():
+            for k, m in self.exp_avg.items():
+                p = self.params[k]
+                if p.grad is None:
+                    continue
+                shape = (-1,) + (1,) * (p.dim() - 1)
+                # meme convention que torch.optim.Adam(weight_decay=...)
+                g = p.grad + self.weight_decay.view(shape) * p
+                v = self.exp_avg_sq[k]
+                m.mul_(beta1).add_(g, alpha=1 - beta1)
+                v.mul_(beta2).addcmul_(g, g, value=1 - beta2)
+                m_hat = m / (1 - beta1 ** self.t)
+                v_hat = v / (1 - beta2 ** self.t)
+                p.sub_(self.lr.view(shape) * m_hat / (v_hat.sqrt() + eps))
+                p.grad = None
+
+    def proba(self, X):
+        out = vmap(self._forward, in_dims=(0, 0, None), randomness="different")(self.params, self.buffers, X)
+        return trial_proba(self.output, out)
+
+
+def make_trials(name, trials, device, mode="auto", pretrained=True):
+    """
+    mode : "auto" (vmap avec running stats empilees, sinon a tour de role),
+    "vmap" (idem, sinon BatchNorm en stats du batch) ou "interleaved".
+    """
+    if mode == "interleaved":
+        return InterleavedTrials(name, trials, device, pretrained)
+    spec = MODELS[name]
+    X = prepare_input(name, torch.rand(2, 10, 3, spec["size"], spec["size"], device=device))
+    try:
+        runner = VmapTrials(name, trials, device, pretrained)
+        runner.check(X)
+        return runner
+    except RuntimeError as e:
+        print(f"vmap with stacked BatchNorm stats failed on {name}: {e}")
+    if mode == "vmap":
+        print("vmap: BatchNorm layers use batch statistics (no running stats)")
+        return VmapTrials(name, trials, device, pretrained, batch_stats=True)
+    return InterleavedTrials(name, trials, device, pretrained)
+
+
+def run_sweep(config, trials, device):
+    name = config["model"]
+    dataset = VideoDataset(config["data_dir"], dataset_choice=config["split"])
+    train_part, holdout = holdout_split(dataset, config["holdout"], config["holdout_subsample"])
+    runner = make_trials(name, trials, device, config["mode"], config["pretrained"])
+    print(f"{len(trials)} trials of {name} ({type(runner).__name__}) on {len(train_part)} videos")
+    prepare = lambda sample, device: prepare_batch(sample, device)
+    history = [[] for _ in trials]
+    t1 = time.time()
+    for epoch in range(config["epochs"]):
+        runner.train(True)
+        loader = pooled_loader(train_part, config["batch_size"], shuffle=True, num_workers=config["num_workers"])
+        total, n = torch.zeros(len(trials), device=device), 0
+        for X, label, ID in tqdm(DevicePrefetcher(loader, device, prepare), total=len(loader), desc=f"Epoch {epoch}"):
+            # meme batch pour tous les essais
+            total += runner.step(prepare_input(name, X), label) * len(ID)
+            n += len(ID)
+
+        runner.train(False)
+        val_loss, correct, m = torch.zeros(len(trials), device=device), torch.zeros(len(trials), device=device), 0
+        loader = pooled_loader(holdout, config["batch_size"], num_workers=config["num_workers"])
+        with torch.no_grad():
+            for X, label, ID in DevicePrefetcher(loader, device, prepare):
+                proba = runner.proba(prepare_input(name, X)).float()
+                target = label.flatten().float()
+                bce = F.binary_cross_entropy(_finite(proba), target.expand_as(proba), reduction="none").sum(1)
+                val_loss += torch.where(torch.isfinite(proba).all(1), bce, torch.full_like(bce, float("nan")))
+                correct += ((proba > 0.5).float() == target).float().sum(1)
+                m += len(ID)
+        # NaN dans la loss d'entrainement ou de validation : l'essai a diverge
+        runner.freeze(~(torch.isfinite(total) & torch.isfinite(val_loss)))
+        for i, t in enumerate(trials):
+            history[i].append({"epoch": epoch, "train_loss": float(total[i]) / max(n, 1),
+                               "val_loss": float(val_loss[i]) / max(m, 1), "val_acc": float(correct[i]) / max(m, 1),
+                               "time": time.time() - t1})
+        print(f"epoch {epoch}: " + "  ".join(f"{t['name']} {history[i][-1]['val_loss']:.4f}"
+                                             for i, t in enumerate(trials)))
+    return [{"trial": t, "history": h} for t, h in zip(trials, history)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="fichier YAML (voir sweep.yaml)")
+    args = parser.parse_args()
+
+    config, trials = load_config(args.config)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    results = run_sweep(config, trials, device)
+    with open(config["out"], 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f"\n{'trial':30s} {'train_loss':>10s} {'val_loss':>10s} {'val_acc':>8s}")
+    for r in sorted(results, key=lambda r: (math.isnan(r["history"][-1]["val_loss"]), r["history"][-1]["val_loss"])):
+        last = r["history"][-1]
+        if math.isnan(last["val_loss"]):
+            print(f"{r['trial']['name']:30s} {'diverged':>10s}")
+            continue
+        print(f"{r['trial']['name']:30s} {last['train_loss']:10.4f} {last['val_loss']:10.4f} {last['val_acc']:8.3f}")
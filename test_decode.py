@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# TESTS DU DECODAGE
+# Encode une petite video synthetique avec pyav (une teinte de gris par frame)
+# et verifie que les backends de decode.py rendent les memes frames, a la meme
+# taille, et que le resize dans ffmpeg colle a smart_resize.
+#
+#   python -m pytest -q test_decode.py
+
+import pytest
+
+av = pytest.importorskip("av")
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+import decode
+
+NB_FRAMES = 6
+SIZE = 32
+
+
+def make_video(path, frames=24, width=64, height=48, fps=12):
+    # frame i : gris uniforme 20 + 9 i, pour reconnaitre la frame decodee
+    container = av.open(str(path), mode="w")
+    stream = container.add_stream("mpeg4", rate=fps)
+    stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+    for i in range(frames):
+        arr = np.full((height, width, 3), 20 + 9 * i, dtype=np.uint8)
+        for packet in stream.encode(av.VideoFrame.from_ndarray(arr, format="rgb24")):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return str(path)
+
+
+@pytest.fixture
+def video(tmp_path):
+    # meme arborescence que le dataset (pas de probe.csv : probe direct)
+    split_dir = tmp_path / "train_dataset"
+    split_dir.mkdir()
+    return make_video(split_dir / "synthetic.mp4")
+
+
+def decode_or_skip(name, video, **kwargs):
+    try:
+        return decode.DECODE_BACKENDS[name](video, NB_FRAMES, SIZE, **kwargs)
+    except (RuntimeError, AttributeError) as e:
+        # VideoReader n'est pas compile dans toutes les versions de torchvision
+        # (et l'API video n'existe plus dans les recentes)
+        pytest.skip(f"{name} unavailable: {e}")
+
+
+def test_uniform_indices(video):
+    assert decode.frame_indices(video, NB_FRAMES) == [0, 4, 8, 12, 16, 20]
+
+
+@pytest.mark.parametrize("name", sorted(decode.DECODE_BACKENDS))
+def test_backends_agree(video, name):
+    ref = decode.DECODE_BACKENDS["av"](video, NB_FRAMES, SIZE)
+    out = decode_or_skip(name, video)
+    assert out.shape == ref.shape == (NB_FRAMES, 3, SIZE, SIZE)
+    assert out.dtype == torch.uint8
+    # memes frames : la teinte de chacune est celle de son indice (lignes du
+    # centre, hors des bandes noires du letterbox 64x48 -> 32x24)
+    expected = torch.tensor([20 + 9 * i for i in decode.frame_indices(video, NB_FRAMES)], dtype=torch.float)
+    assert (out[..., 8:24, :].float().mean(dim=(1, 2, 3)) - expected).abs().max() < 6
+    assert (out.float() - ref.float()).abs().mean() < 3
+
+
+def test_decode_into_buffer(video):
+    buf = torch.full((NB_FRAMES, 3, SIZE, SIZE), 255, dtype=torch.uint8)
+    out = decode.decode_video(video, NB_FRAMES, SIZE, backend="av", out=buf)
+    assert out.data_ptr() == buf.data_ptr()
+    assert torch.equal(out, decode.decode_video(video, NB_FRAMES, SIZE, backend="av"))
+
+
+def test_parity(video):
+    res = decode.parity([video], nb_frames=NB_FRAMES, size=SIZE)
+    assert res["max_mean_abs_diff"] < 3
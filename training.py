@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+# ENTRAINEMENT
+# Boucle d'entrainement commune, reprenable en plein milieu d'une epoch.
+# Le job Slurm est limite a 1h : on checkpoint regulierement et des qu'on recoit
+# SIGTERM/SIGUSR1 (srun --signal=USR1@120), puis on reprend au meme batch.
+# Lance sous torchrun ou srun multi-task, la meme boucle tourne en DDP.
+
+import os
+import random
+import signal
+import time
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Sampler
+from tqdm import tqdm
+
+from checkpoint import save_checkpoint, load_checkpoint, atomic_save
+from decode import loader_kwargs
+from buffers import pooled_loader
+from distributed import get_rank, get_world_size, is_main, barrier, any_ranks, all_sum
+from prefetch import DevicePrefetcher
+from progressive import resize_batch
+from validation import EarlyStopping
+
+
+class ResumableSampler(Sampler):
+    """
+    Sampler dont l'ordre ne depend que de (seed, epoch), et qui peut commencer
+    a une position donnee : a la reprise on saute les samples deja vus au lieu
+    de les rejouer.
+    En DDP chaque rank prend une part de la meme permutation (rank::num_replicas),
+    `start` compte les samples vus par l'ensemble des ranks.
+    """
+    def __init__(self, data_source, seed=0, shuffle=True, rank=0, num_replicas=1):
+        self.data_source = data_source
+        self.seed = seed
+        self.shuffle = shuffle
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def indices(self):
+        n = len(self.data_source)
+        if not self.shuffle:
+            return list(range(n))
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        return torch.randperm(n, generator=g).tolist()
+
+    def _global_indices(self):
+        indices = self.indices()
+        # meme nombre de samples par rank, sinon les ranks se desynchronisent
+        pad = (-len(indices)) % self.num_replicas
+        indices += indices[:pad]
+        return indices[self.start:]
+
+    def __iter__(self):
+        return iter(self._global_indices()[self.rank::self.num_replicas])
+
+    def __len__(self):
+        return len(self._global_indices()[self.rank::self.num_replicas])
+
+
+class WalltimeGuard:
+    # leve un drapeau sur SIGTERM/SIGUSR1 ou quand on approche de la fin du creneau
+    def __init__(self, walltime=None, margin=120, signals=(signal.SIGTERM, signal.SIGUSR1)):
+        self.deadline = None if walltime is None else time.time() + walltime - margin
+        self.received = None
+        self._previous = {}
+        for sig in signals:
+            self._previous[sig] = signal.signal(sig, self._handler)
+
+    def _handler(self, signum, frame):
+        self.received = signum
+
+    def should_stop(self):
+        if self.received is not None:
+            return True
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def restore(self):
+        for sig, handler in self._previous.items():
+            signal.signal(sig, handler)
+
+
+def get_rng_state():
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),
+        "python": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def unwrap(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def save_training_state(ckpt_dir, model, optimizer, epoch, position, step, extra=None):
+    # poids en safetensors, le reste (optimizer, sampler) a cote, ecrits par le
+    # rank 0 ; chaque rank garde son propre etat RNG. extra : compteurs en plus
+    rank = get_rank()
+    atomic_save(get_rng_state(), os.path.join(ckpt_dir, f"rng{rank}.pt"))
+    if rank == 0:
+        save_checkpoint(unwrap(model).state_dict(), os.path.join(ckpt_dir, "model.safetensors"),
+                        metadata={"epoch": epoch, "position": position, "step": step})
+        atomic_save({
+            "optimizer": optimizer.state_dict(),
+            "epoch": epoch,
+            "position": position,
+            "step": step,
+            "world_size": get_world_size(),
+            **(extra or {}),
+        }, os.path.join(ckpt_dir, "state.pt"))
+    barrier()
+
+
+def load_training_state(ckpt_dir, model, optimizer, device):
+    state_path = os.path.join(ckpt_dir, "state.pt")
+    model_path = os.path.join(ckpt_dir, "model.safetensors")
+    if not (os.path.exists(state_path) and os.path.exists(model_path)):
+        return None
+    unwrap(model).load_state_dict(load_checkpoint(model_path, device))
+    state = torch.load(state_path, map_location="cpu")
+    optimizer.load_state_dict(state["optimizer"])
+    rng_path = os.path.join(ckpt_dir, f"rng{get_rank()}.pt")
+    if os.path.exists(rng_path):
+        set_rng_state(torch.load(rng_path))
+    return state
+
+
+def prepare_batch(sample, device, permute=False, size=None, nb_frames=None, augment=None):
+    X, label, ID = sample
+    X = X.to(device, non_blocking=True)
+    if X.dtype == torch.uint8:
+        # batchs du pool (buffers.py) : normalises sur le device, 4x moins a transferer
+        X = X.float() / 255
+    # no-op si le dataset sort deja la taille de l'epoch (progressive.py)
+    X = resize_batch(X, size, nb_frames)
+    if augment is not None:
+        # augment.BatchAugment : sur le batch entier, avant le permute
+        X = augment(X)
+    if permute:
+        # les modeles 3D attendent [B, C, T, H, W]
+        X = X.permute(0, 2, 1, 3, 4)
+    label = torch.unsqueeze(label.to(device), dim=1)
+    return X, label, ID
+
+
+def sample_losses(label_pred, label):
+    # loss par sample pour les modeles a sortie sigmoid, [B]
+    pred = label_pred.detach().float().clamp(1e-6, 1 - 1e-6)
+    return F.binary_cross_entropy(pred, label.float(), reduction="none").flatten(1).mean(1)
+
+
+def evaluate(model, dataset, loss_fn, device, batch_size=32, permute=False, num_workers=0, size=None,
+             nb_frames=None):
+    # loss moyenne sur tout `dataset`, en inference_mode ; en DDP chaque rank
+    # evalue une part du dataset et tous recoivent la meme loss (all-reduce)
+    model = unwrap(model)
+    was_training = model.training
+    model.eval()
+    total, n = 0.0, 0
+    rank, world_size = get_rank(), get_world_size()
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=range(rank, len(dataset), world_size),
+                        **loader_kwargs(num_workers))
+    with torch.inference_mode():
+        for sample in loader:
+            X, label, ID = prepare_batch(sample, device, permute, size, nb_frames)
+            total += loss_fn(model(X), label).item() * len(ID)
+            n += len(ID)
+    model.train(was_training)
+    total, n = all_sum([total, n], device)
+    return total / max(n, 1)
+
+
+def train(model, dataset, loss_fn, optimizer, device, epochs, batch_size=32,
+          ckpt_dir="checkpoints", checkpoint_every=600, walltime=None, seed=0,
+          permute=False, num_workers=0, log=None, bucket_cap_mb=25, pooled=False,
+          schedule=None, target_loss=None, sampler=None, val_dataset=None, prefetch=2, augment=None,
+          val_every=None, patience=None, min_delta=0.0, sync_every=10):
+    """
+    Entraine `model` sur `dataset` (samples (X, label, ID)) et renvoie True si
+    toutes les epochs sont finies, False si on s'est arrete pour la walltime.
+    Relancer le meme appel reprend exactement la ou on s'etait arrete.
+    Si torch.distributed est initialise (voir distributed.setup_distributed),
+    le modele est enveloppe dans DDP et `batch_size` est la taille par rank.
+    pooled=True decode les batchs dans des buffers reutilises (buffers.py).
+    schedule : progressive.ResolutionSchedule, taille/frames par epoch.
+    target_loss : note dans state.pt le temps d'entrainement (time_to_target) et
+    le nombre de pas (steps_to_target) quand la loss passe dessous : loss de
+    validation en fin d'epoch si val_dataset, sinon moyenne glissante du train.
+    sampler : un ResumableSampler (ex. hardsampler.HardExampleSampler) ; s'il a
+    update(), il recoit la loss de chaque sample vu.
+    prefetch : batchs gardes d'avance sur le device (prefetch.py), 0 pour copier
+    chaque batch juste avant le forward.
+    augment : augment.BatchAugment applique aux batchs d'entrainement sur le device.
+    val_dataset : holdout (voir validation.holdout_split) evalue tous les
+    `val_every` pas, ou en fin d'epoch si val_every est None. Le meilleur modele
+    est garde dans ckpt_dir/best.safetensors ; avec `patience`, on s'arrete
+    apres autant de validations sans gain de min_delta (renvoie alors True).
+    sync_every : pas entre deux verifications walltime/checkpoint, qui coutent
+    un all-reduce et une synchro host en DDP.
+    """
+    rank, world_size = get_rank(), get_world_size()
+    if sampler is None:
+        sampler = ResumableSampler(dataset, seed=seed)
+    sampler.rank, sampler.num_replicas = rank, world_size
+    epoch, position, step = 0, 0, 0
+    # temps d'entrainement cumule sur les reprises, pour time_to_target
+    timing = {"elapsed": 0.0, "loss_ema": None, "time_to_target": None, "steps_to_target": None}
+    stopper = EarlyStopping(patience, min_delta)
+    state = load_training_state(ckpt_dir, model, optimizer, device)
+    if state is not None:
+        epoch, position, step = state["epoch"], state["position"], state["step"]
+        timing.update({k: state[k] for k in timing if k in state})
+        if "sampler" in state:
+            sampler.load_state_dict(state["sampler"])
+        if "validation" in state:
+            stopper.load_state_dict(state["validation"])
+        if state.get("stopped_early"):
+            if is_main():
+                print(f"Training already stopped early at step {step}")
+            return True
+        if is_main():
+            print(f"Resuming from epoch {epoch}, sample {position}")
+    else:
+        torch.manual_seed(seed + rank)
+
+    if world_size > 1:
+        # les gradients sont reduits par paquets de bucket_cap_mb pendant le backward
+        model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None,
+                                        bucket_cap_mb=bucket_cap_mb, gradient_as_bucket_view=True)
+
+    guard = WalltimeGuard(walltime)
+    last_save = time.time()
+    started = time.time() - timing["elapsed"]
+
+    def checkpoint(stopped_early=False):
+        timing["elapsed"] = time.time() - started
+        extra = dict(timing, validation=stopper.state_dict(), stopped_early=stopped_early)
+        if hasattr(sampler, "sync"):
+            # losses deja vues dans l'epoch, rassemblees depuis tous les ranks pour la reprise
+            sampler.sync(device, commit=False)
+        if hasattr(sampler, "state_dict"):
+            extra["sampler"] = sampler.state_dict()
+        save_training_state(ckpt_dir, model, optimizer, epoch, position, step, extra=extra)
+
+    def validate():
+        # True s'il faut arreter (early stopping) ; evaluate renvoie la meme loss
+        # a tous les ranks, donc meme decision partout
+        val_loss = evaluate(model, val_dataset, loss_fn, device, batch_size, permute, num_workers,
+                            size, nb_frames)
+        if stopper.step(val_loss) and is_main():
+            save_checkpoint(unwrap(model).state_dict(), os.path.join(ckpt_dir, "best.safetensors"),
+                            metadata={"val_loss": val_loss, "epoch": epoch, "step": step})
+        if log is not None and is_main():
+            log({"val_loss": val_loss, "best_val_loss": stopper.best, "epoch": epoch})
+        if target_loss is not None:
+            reached(val_loss)
+        return stopper.should_stop()
+
+    def stop_early():
+        checkpoint(stopped_early=True)
+        if is_main():
+            print(f"Early stopping at step {step}: best validation loss {stopper.best:.4f}")
+        return True
+
+    def reached(loss):
+        if timing["time_to_target"] is None and loss <= target_loss:
+            timing["time_to_target"], timing["steps_to_target"] = time.time() - started, step
+            if is_main():
+                print(f"Target loss {target_loss} reached after {step} steps, {timing['time_to_target']:.0f}s")
+
+    model.train()
+    size, nb_frames = None, None
+    try:
+        while epoch < epochs:
+            sampler.set_epoch(epoch, start=position)
+            if schedule is not None:
+                size, nb_frames = schedule.at(epoch)
+                if hasattr(dataset, "set_resolution"):
+                    # VideoDataset : lit directement le bon niveau de pyramide
+                    dataset.set_resolution(size, nb_frames)
+                if is_main():
+                    print(f"Epoch {epoch}: {size}px" + (f", {nb_frames} frames" if nb_frames else ""))
+            if hasattr(dataset, "plan"):
+                # readahead.ReadAheadDataset : ordre de l'epoch pour lire en avance
+                dataset.plan(iter(sampler), batch_size, num_workers)
+            if pooled:
+                loader = pooled_loader(dataset, batch_size, sampler=sampler, num_workers=num_workers, pin=True,
+                                       lookahead=prefetch or 0)
+            else:
+                loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler, **loader_kwargs(num_workers))
+            # indices de ce rank dans l'ordre des batchs, pour sampler.update
+            order = list(iter(sampler)) if hasattr(sampler, "update") else None
+            seen = 0
+            prepare = lambda sample, device: prepare_batch(sample, device, permute, size, nb_frames, augment)
+            if prefetch:
+                batches = DevicePrefetcher(loader, device, prepare, depth=prefetch)
+            else:
+                batches = (prepare(sample, device) for sample in loader)
+            for X, label, ID in tqdm(batches, total=len(loader), desc=f"Epoch {epoch}", disable=not is_main()):
+                optimizer.zero_grad()
+                label_pred = model(X)
+                loss = loss_fn(label_pred, label)
+                loss.backward()
+                optimizer.step()
+                if order is not None:
+                    sampler.update(order[seen:seen + len(ID)], sample_losses(label_pred, label))
+                seen += len(ID)
+                position += len(ID) * world_size
+                step += 1
+                if log is not None and is_main():
+                    log({"loss": loss.item(), "epoch": epoch})
+                if target_loss is not None and val_dataset is None and timing["time_to_target"] is None:
+                    ema = timing["loss_ema"]
+                    timing["loss_ema"] = loss.item() if ema is None else 0.95 * ema + 0.05 * loss.item()
+                    # quelques pas d'abord, le temps que la moyenne se stabilise
+                    if step >= 20:
+                        reached(timing["loss_ema"])
+
+                if val_dataset is not None and val_every and step % val_every == 0:
+                    if validate():
+                        return stop_early()
+
+                if step % sync_every:
+                    continue
+                # les deux decisions en un seul all-reduce ; `step` est le meme sur tous les ranks
+                stop, save = any_ranks([guard.should_stop(), time.time() - last_save >= checkpoint_every], device)
+                if stop:
+                    checkpoint()
+                    if is_main():
+                        print(f"Stopping at epoch {epoch}, sample {position} (checkpoint saved)")
+                    return False
+                if save:
+                    checkpoint()
+                    last_save = time.time()
+            if hasattr(sampler, "sync"):
+                sampler.sync(device)
+            epoch, position = epoch + 1, 0
+            if val_dataset is not None and not val_every and validate():
+                return stop_early()
+        checkpoint()
+        return True
+    finally:
+        guard.restore()
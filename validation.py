@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# VALIDATION
+# Les scripts entrainaient N epochs a l'aveugle. On garde une partie de
+# train_dataset (stratifiee real/fake) comme holdout, evaluee tous les N pas par
+# training.train (inference_mode, eventuellement sur un sous-echantillon fixe) :
+# le meilleur checkpoint est garde et l'entrainement s'arrete s'il ne progresse
+# plus (early stopping), au lieu de bruler tout le creneau Slurm.
+
+import torch
+from torch.utils.data import Dataset
+
+
+def _key(dataset, i):
+    # VideoDataset de dataset.py (key) ou copie des scripts (video_files)
+    return dataset.key(i) if hasattr(dataset, "key") else dataset.video_files[i]
+
+
+def label_array(dataset):
+    # labels 0/1 du dataset, dans l'ordre des indices
+    return torch.tensor([float(dataset.data[_key(dataset, i)]) for i in range(len(dataset))])
+
+
+def stratified_split(labels, fraction=0.1, seed=0):
+    # (indices train, indices holdout), meme proportion de chaque classe dans les deux
+    g = torch.Generator()
+    g.manual_seed(seed)
+    train, holdout = [], []
+    for c in labels.unique():
+        members = torch.nonzero(labels == c).flatten()
+        members = members[torch.randperm(len(members), generator=g)].tolist()
+        n = int(round(len(members) * fraction))
+        holdout += members[:n]
+        train += members[n:]
+    return sorted(train), sorted(holdout)
+
+
+class SplitView(Dataset):
+    """
+    Sous-ensemble d'un dataset qui garde son interface (ids, data, nb_frames,
+    read, key... pour buffers.py et readahead.py) : seuls les indices changent.
+    """
+    def __init__(self, dataset, indices):
+        self.dataset = dataset
+        self.indices = list(indices)
+
+    def __getattr__(self, name):
+        if name == "dataset":
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        return self.dataset[self.indices[idx]]
+
+    def read(self, idx, out=None, **kwargs):
+        return self.dataset.read(self.indices[idx], out=out, **kwargs)
+
+    def key(self, idx):
+        return _key(self.dataset, self.indices[idx])
+
+    def path(self, idx):
+        return self.dataset.path(self.indices[idx])
+
+    def video_index(self, idx):
+        return self.dataset.video_index(self.indices[idx])
+
+
+def holdout_split(dataset, fraction=0.1, subsample=None, seed=0):
+    """
+    Decoupe `dataset` en (train, holdout) stratifies. subsample : nombre fixe de
+    videos du holdout reellement evaluees (stratifie aussi), pour une validation
+    rapide tous les N pas ; les autres videos du holdout ne servent pas.
+    """
+    labels = label_array(dataset)
+    train, holdout = stratified_split(labels, fraction, seed)
+    if subsample is not None and subsample < len(holdout):
+        _, keep = stratified_split(labels[holdout], subsample / len(holdout), seed)
+        holdout = [holdout[i] for i in keep]
+    return SplitView(dataset, train), SplitView(dataset, holdout)
+
+
+class EarlyStopping:
+    """
+    Compte les validations sans amelioration d'au moins min_delta ; should_stop
+    apres `patience` d'affilee (jamais si patience est None).
+    """
+    def __init__(self, patience=None, min_delta=0.0):
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = None
+        self.bad = 0
+
+    def step(self, loss):
+        # True si `loss` est la meilleure jusqu'ici
+        if self.best is None or loss < self.best - self.min_delta:
+            self.best = loss
+            self.bad = 0
+            return True
+        self.bad += 1
+        return False
+
+    def should_stop(self):
+        return self.patience is not None and self.bad >= self.patience
+
+    def state_dict(self):
+        return {"best": self.best, "bad": self.bad}
+
+    def load_state_dict(self, state):
+        self.best, self.bad = state["best"], state["bad"]